@@ -0,0 +1,514 @@
+"""asyncio HTTP server for self-hosted deployments (serve.py runs it).
+
+On Vercel every request owns a thread (BaseHTTPRequestHandler) that sits
+idle while Gemini generates, so thread count caps concurrency. Here one
+event loop serves every connection, and Gemini calls go through
+AsyncGeminiClient, so an in-flight request costs a coroutine and a socket.
+
+The request path is recommend.py's, made async only where it waits: the
+Gemini call with its admission and retries, the LLM-1 / LLM-2 stages, the
+cache and warm-set lookups and the deadline race are recommend.py's _steps
+generators, run here by _steps.arun with the I/O table _AOPS (AGEMINI,
+ADMISSION.acquire_async, INFLIGHT.do_async with the same keys, so async
+and threaded callers share calls, a task for the race). Differences from
+the Vercel handler:
+
+- no hedging, and no NDJSON streaming: ?stream=1 and a GET with Accept:
+  application/x-ndjson get the plain JSON answer (the frontend reads
+  either) and GEMINI_PIPELINE falls back to the two-call mode;
+- /api/recommend_batch and "more ideas" pages (a POST with a
+  continuation token) run get_batch_recommendations() /
+  get_more_recommendations() on a worker thread, since they use the
+  threaded client;
+- GET /healthz answers 200, or 503 while draining so the load balancer
+  stops sending traffic.
+
+Bounded concurrency and backpressure: at most `max_inflight` requests are
+being worked on at once; up to `max_queue` more wait for a slot; anything
+past that gets an immediate 503 with Retry-After, which is cheaper for
+everyone than a request that times out in a queue. Writes wait on drain(),
+so a slow client holds its own request, not the process's memory.
+
+Graceful shutdown (SIGTERM / SIGINT): stop accepting, close idle
+keep-alive connections, let in-flight requests finish for up to `grace`
+seconds (their responses carry Connection: close), then cancel what is
+left.
+"""
+import asyncio
+import http
+import json
+import os
+import signal
+import sys
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import recommend  # noqa: E402
+from recommend import (  # noqa: E402
+    ADMISSION,
+    GEMINI_API_KEY,
+    GEMINI_API_URL,
+    INFLIGHT,
+    RECOMMEND_DEADLINE_S,
+    RESPONSE_CACHE,
+    _MAX_REQUEST_BYTES,
+    _budget_band,
+    _cache_control,
+    _enrich_links,
+    _etag,
+    _etag_matches,
+    _log_request,
+    _query_inputs,
+    _race_generation,
+    _race_outcome,
+    _recommendation_steps,
+    _request_args,
+    _sanitize_inputs,
+    _warm_profile,
+    canonical_query,
+    cors_origin,
+    get_fallback_recommendations,
+)
+from _gemini_async import AsyncGeminiClient  # noqa: E402
+from _steps import arun  # noqa: E402
+from _timing import Timings, activate, current as current_timings, maybe_profile, span  # noqa: E402
+
+# One client per process (per event loop); connections are pooled.
+AGEMINI = AsyncGeminiClient(
+    GEMINI_API_URL,
+    GEMINI_API_KEY,
+    pool_size=int(os.environ.get('GEMINI_POOL_SIZE', '256')),
+    connect_timeout=float(os.environ.get('GEMINI_CONNECT_TIMEOUT', '5')),
+    read_timeout=float(os.environ.get('GEMINI_READ_TIMEOUT', '30')),
+)
+
+_MAX_HEADER_BYTES = 16 * 1024
+_MAX_BODY_BYTES = 512 * 1024     # the largest any route takes (recommend_batch)
+_HEADER_TIMEOUT_S = 10.0
+
+# Late generations, still caching their result after the response went out.
+_BACKGROUND: set = set()
+
+
+# -- I/O for recommend.py's _steps -------------------------------------------
+
+async def _settle(estimate, actual):
+    """ADMISSION.settle(), on a thread when a shared counter may block."""
+    if ADMISSION.counter is not None:
+        await asyncio.to_thread(ADMISSION.settle, estimate, actual)
+    else:
+        ADMISSION.settle(estimate, actual)
+
+
+async def _generate(body, timeout, hedge_after, trace):
+    """One Gemini call on AGEMINI; `hedge_after` is ignored (no hedging here)."""
+    return await AGEMINI.generate(body, timeout=timeout)
+
+
+async def _cache_call(fn, *args):
+    """A RESPONSE_CACHE method; on a thread when a shared tier may block."""
+    if RESPONSE_CACHE.shared is None:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+async def _flight(key, stage, args, kwargs, deadline, trace):
+    """One _steps stage through INFLIGHT (do_async, so threaded callers share it too)."""
+    return await INFLIGHT.do_async(key, lambda *a, **kw: arun(stage(*a, **kw), _AOPS), *args, deadline=deadline,
+                                   trace=trace, **kwargs)
+
+
+async def _race(key, args, meta, mode):
+    """recommend._race_ai_recommendations() with a task instead of a thread.
+
+    The generation task outlives a missed deadline and still caches its
+    result; it is kept in _BACKGROUND until then.
+    """
+    started = time.monotonic()
+    deadline = started + RECOMMEND_DEADLINE_S
+    trace = {}
+    partial = []
+    banded = args[:4] + (_budget_band(args[4]),) + args[5:]
+    task = asyncio.create_task(arun(_race_generation(key, banded, deadline, trace, partial.append, mode, None,
+                                                     started), _AOPS))
+    _BACKGROUND.add(task)
+    task.add_done_callback(_BACKGROUND.discard)
+    fallback = await _fallback(*args[:8])
+    await asyncio.wait({task}, timeout=max(0.0, deadline - time.monotonic()))
+    finished = task.done() and not task.cancelled()
+    return _race_outcome(meta, trace, finished, task.result() if finished else None, partial, fallback)
+
+
+async def _fallback(*args):
+    # CPU-bound (the catalog's first bitsets take ~100ms on a large one):
+    # off the loop, so other connections keep being served.
+    return await asyncio.to_thread(get_fallback_recommendations, *args)
+
+
+async def _enrich(recs, meta):
+    # Waits up to PRODUCT_RESOLVER_DEADLINE on the lookup pool.
+    return await asyncio.to_thread(_enrich_links, recs, meta)
+
+
+# How the event loop does each I/O step: the same steps as recommend._OPS,
+# awaited. No 'pipelined': GEMINI_PIPELINE is never passed to the steps here.
+_AOPS = {
+    'admit': ADMISSION.acquire_async,
+    'generate': _generate,
+    'settle': _settle,
+    'flight': _flight,
+    'cache_get': lambda key: _cache_call(RESPONSE_CACHE.get, key),
+    'cache_set': lambda key, recs: _cache_call(RESPONSE_CACHE.set, key, recs),
+    'race': _race,
+    'enrich': _enrich,
+    'fallback': _fallback,
+}
+
+
+async def aget_recommendations(relationship, occasion, age_group, vibe, budget, gender="", notes="", gift_types=None,
+                               city="", mode=''):
+    """recommend.get_recommendations() for the event loop; same response and meta."""
+    return await arun(_recommendation_steps(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types,
+                                            city, mode), _AOPS)
+
+
+# -- HTTP --------------------------------------------------------------------
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class _Request:
+    __slots__ = ('method', 'path', 'query', 'headers', 'body', 'keep_alive')
+
+    def __init__(self, method, target, headers, body, keep_alive):
+        parsed = urlparse(target)
+        self.method = method
+        self.path = parsed.path.rstrip('/') or '/'
+        self.query = parsed.query
+        self.headers = headers
+        self.body = body
+        self.keep_alive = keep_alive
+
+
+async def _read_request(reader, max_body: int) -> '_Request | None':
+    """Next request on the connection; None on a clean EOF."""
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+        raise _HTTPError(400, "bad request line")
+    method, target, version = parts
+    headers, size = {}, 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        size += len(line)
+        if size > _MAX_HEADER_BYTES:
+            raise _HTTPError(431, "request headers too large")
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    if 'transfer-encoding' in headers:
+        raise _HTTPError(411, "content-length required")
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        raise _HTTPError(400, "invalid content-length")
+    if length > max_body:
+        raise _HTTPError(413, "request too large")
+    body = await reader.readexactly(length) if length > 0 else b''
+    return _Request(method, target, headers, body, keep_alive)
+
+
+def _json_body(request) -> object:
+    if not request.body:
+        raise _HTTPError(400, "request body is required")
+    try:
+        return json.loads(request.body)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise _HTTPError(400, "invalid request body")
+
+
+class AsyncServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 8000, *, max_inflight: int = 1000,
+                 max_queue: int = 1000, grace: float = 25.0, keepalive: float = 15.0, sock=None):
+        """`max_inflight` requests run at once, `max_queue` more may wait; see module docstring."""
+        self.host = host
+        self.port = port
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.grace = grace
+        self.keepalive = keepalive
+        self.sock = sock
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._server = None
+        self._stopping = None
+        self._draining = False
+        self._connections: dict = {}     # task -> writer
+        self._idle: set = set()          # writers between requests
+        self.inflight = 0
+        self.waiting = 0
+        self.served = 0
+        self.shed = 0
+
+    # -- lifecycle --------------------------------------------------------
+
+    async def start(self) -> None:
+        # Load the catalog and warm set now rather than on the first request.
+        recommend.get_catalog()
+        recommend.get_warm_set()
+        self._stopping = asyncio.Event()
+        kwargs = {'sock': self.sock} if self.sock is not None else {'host': self.host, 'port': self.port}
+        self._server = await asyncio.start_server(self._connection, backlog=1024, **kwargs)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def stop(self) -> None:
+        """Begin a graceful shutdown (safe to call more than once)."""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def serve(self) -> None:
+        """Serve until stop() or SIGTERM / SIGINT, then drain."""
+        if self._server is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass        # not the main thread
+        print(f"async server on {self.host}:{self.port}, pid {os.getpid()} (max_inflight={self.max_inflight}, "
+              f"max_queue={self.max_queue})")
+        await self._stopping.wait()
+        await self.drain()
+
+    async def drain(self) -> None:
+        self._draining = True
+        self._server.close()                 # stop accepting
+        for writer in list(self._idle):
+            writer.close()
+        busy = set(self._connections)
+        print(f"async server draining: {self.inflight} in flight, {len(busy)} connections")
+        if busy:
+            _, pending = await asyncio.wait(busy, timeout=self.grace)
+            for task in pending:
+                task.cancel()
+            if pending:
+                print(f"async server: cancelled {len(pending)} connections after {self.grace:.0f}s")
+                await asyncio.wait(pending, timeout=1.0)
+        for task in list(_BACKGROUND):
+            task.cancel()
+        AGEMINI.close()
+
+    # -- connections ------------------------------------------------------
+
+    async def _connection(self, reader, writer) -> None:
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            first = True
+            while not self._draining:
+                self._idle.add(writer)
+                try:
+                    request = await asyncio.wait_for(_read_request(reader, _MAX_BODY_BYTES),
+                                                     _HEADER_TIMEOUT_S if first else self.keepalive)
+                except _HTTPError as e:
+                    await self._write(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        ConnectionError, ValueError):
+                    break
+                finally:
+                    self._idle.discard(writer)
+                if request is None:
+                    break
+                first = False
+                if not await self._request(request, writer):
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _request(self, request, writer) -> bool:
+        """Answer one request; returns whether the connection stays open."""
+        timings = Timings()
+        profiler = None
+        outcome, profile, event = {}, None, None      # event: the log line, POSTs to the API only
+        with activate(timings):
+            try:
+                if request.method == 'OPTIONS':
+                    return await self._write(writer, 204, None, request=request, preflight=True)
+                if request.path == '/healthz' and request.method in ('GET', 'HEAD'):
+                    return await self._write(writer, 503 if self._draining else 200, self.stats(), request=request)
+                if request.path not in ('/api/recommend', '/api/recommend_batch'):
+                    raise _HTTPError(404, "not found")
+                if request.method != 'POST' and not (request.method == 'GET' and request.path == '/api/recommend'):
+                    raise _HTTPError(405, "method not allowed")
+                event = request.path.rsplit('/', 1)[-1]
+
+                if self.waiting >= self.max_queue and self._slots.locked():
+                    self.shed += 1
+                    outcome = {"status": 503}
+                    return await self._write(writer, 503, {"error": "server busy"}, request=request,
+                                             headers={'Retry-After': '1'})
+                profiler = maybe_profile()
+                self.waiting += 1
+                try:
+                    with span('queue'):
+                        await self._slots.acquire()
+                finally:
+                    self.waiting -= 1
+                self.inflight += 1
+                try:
+                    if request.method == 'GET':
+                        status, payload, profile, headers = await self._get(request)
+                    else:
+                        status, payload, profile = await self._dispatch(event, request)
+                        headers = None
+                finally:
+                    self.inflight -= 1
+                    self._slots.release()
+                self.served += 1
+                outcome = {"status": status, "meta": (payload or {}).get('meta')}
+                if status == 304:
+                    payload = None
+                return await self._write(writer, status, payload, request=request, headers=headers)
+            except _HTTPError as e:
+                outcome = {"status": e.status}
+                return await self._write(writer, e.status, {"error": str(e)}, request=request)
+            finally:
+                if profiler is not None:
+                    profiler.stop()
+                if event is not None:
+                    _log_request(event, timings, outcome, profiler, profile)
+
+    async def _dispatch(self, event, request) -> tuple:
+        """(status, payload, logged profile) for a POST."""
+        if event == 'recommend' and len(request.body) > _MAX_REQUEST_BYTES:
+            raise _HTTPError(413, "request too large")
+        data = _json_body(request)
+        if event == 'recommend_batch':
+            import recommend_batch
+            items = data.get('items') if isinstance(data, dict) else data
+            if not isinstance(items, list) or not items:
+                raise _HTTPError(400, "invalid request body")
+            if len(items) > recommend_batch._MAX_BATCH_ITEMS:
+                raise _HTTPError(413, f"at most {recommend_batch._MAX_BATCH_ITEMS} items per batch")
+            try:
+                return 200, await asyncio.to_thread(recommend_batch.get_batch_recommendations, items), None
+            except Exception as exc:
+                print(f"recommend_batch error: {type(exc).__name__}: {exc}")
+                return 500, {"error": "internal error"}, None
+
+        if not isinstance(data, dict):
+            raise _HTTPError(400, "invalid request body")
+        if 'continuation' in data:
+            try:
+                return 200, await asyncio.to_thread(
+                    recommend.get_more_recommendations, str(data['continuation'] or ''), data.get('count')), None
+            except ValueError:
+                raise _HTTPError(400, "invalid continuation token")
+            except Exception as exc:
+                print(f"recommend error: {type(exc).__name__}: {exc}")
+                return 500, {"error": "internal error"}, None
+        clean = _sanitize_inputs(data)
+        args = _request_args(clean)
+        try:
+            return 200, await aget_recommendations(*args, mode=clean['mode']), _warm_profile(*args)
+        except Exception as exc:
+            print(f"recommend error: {type(exc).__name__}: {exc}")
+            return 500, {"error": "internal error"}, None
+
+    async def _get(self, request) -> tuple:
+        """(status, payload, logged profile, headers) for GET /api/recommend.
+
+        Mirrors recommend.handler._do_get, less the NDJSON stream: a
+        non-canonical query is redirected, everything else is cacheable
+        JSON. A 304 still carries the payload so its meta is logged.
+        """
+        clean = _sanitize_inputs(_query_inputs(request.query))
+        canonical = canonical_query(clean)
+        if request.query != canonical:
+            return 308, None, None, {
+                'Location': f"{request.path}?{canonical}",
+                'Cache-Control': _cache_control(None, clean),
+            }
+        args = _request_args(clean)
+        try:
+            payload = await aget_recommendations(*args, mode=clean['mode'])
+        except Exception as exc:
+            print(f"recommend error: {type(exc).__name__}: {exc}")
+            return 500, {"error": "internal error"}, None, {'Cache-Control': 'no-store'}
+        etag = _etag(payload)
+        headers = {'Cache-Control': _cache_control(payload, clean), 'ETag': etag}
+        status = 304 if _etag_matches(request.headers.get('if-none-match', ''), etag) else 200
+        return status, payload, _warm_profile(*args), headers
+
+    async def _write(self, writer, status: int, payload, *, request=None, keep_alive=None, headers=None,
+                     preflight=False) -> bool:
+        """Send one response; returns whether the connection stays open."""
+        if keep_alive is None:
+            keep_alive = request is not None and request.keep_alive and not self._draining
+        with span('serialize'):
+            body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        lines = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}"]
+        if payload is not None:
+            lines.append('Content-Type: application/json')
+            cache_status = (payload.get('meta') or {}).get('cache') if isinstance(payload, dict) else None
+            if cache_status:
+                lines.append(f"X-Cache: {cache_status.upper()}")
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        timings = current_timings()
+        if timings is not None:
+            lines.append(f"Server-Timing: {timings.header()}")
+        cors = cors_origin(request.headers.get('origin', '')) if request is not None else None
+        if cors:
+            lines.append(f"Access-Control-Allow-Origin: {cors}")
+            if preflight:
+                lines.append('Access-Control-Allow-Methods: GET, POST, OPTIONS')
+                lines.append('Access-Control-Allow-Headers: Content-Type')
+                lines.append('Access-Control-Max-Age: 86400')
+            lines.append('Vary: Origin')
+        if status not in (204, 304):
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        writer.write(head + (body if request is None or request.method != 'HEAD' else b''))
+        await writer.drain()
+        return keep_alive
+
+    def stats(self) -> dict:
+        return {
+            "status": "draining" if self._draining else "ok",
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "connections": len(self._connections),
+            "served": self.served,
+            "shed": self.shed,
+            "background": len(_BACKGROUND),
+            "gemini": AGEMINI.stats(),
+            "admission": ADMISSION.stats(),
+            "inflight": INFLIGHT.stats(),
+            "response_cache": RESPONSE_CACHE.stats(),
+            "context_cache": recommend.CONTEXT_CACHE.stats() if recommend.CONTEXT_CACHE is not None else None,
+            "links": recommend.LINK_ENRICHER.stats() if recommend.LINK_ENRICHER is not None else None,
+        }
+
+
+def run(host: str = '127.0.0.1', port: int = 8000, **kwargs) -> None:
+    """Serve in this process until SIGTERM / SIGINT."""
+    async def main():
+        await AsyncServer(host, port, **kwargs).serve()
+    asyncio.run(main())
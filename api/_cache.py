@@ -0,0 +1,621 @@
+"""Response cache and request coalescing for /api/recommend.
+
+Two tiers, both keyed on a string built from the sanitized request:
+- TTLCache: bounded in-process LRU with per-entry TTL. Survives across
+  warm invocations of the same serverless instance.
+- A shared store (SQLiteStore, RedisStore or ShmStore) so instances can
+  reuse each other's Gemini results. Optional; selected by URL.
+
+Values are JSON-serializable dicts. Every tier stores the encoded JSON
+string, so each hit decodes to a fresh object the caller may mutate.
+Backend failures are logged and treated as misses -- a broken cache must
+never fail a request.
+
+asyncio and sqlite3 are imported where used: the serverless handler is
+synchronous and usually has no SQLite tier, so neither belongs on its cold
+start.
+
+SingleFlight sits behind the cache: identical requests that miss at the
+same moment share one upstream Gemini call instead of each starting their
+own.
+"""
+import copy
+import hashlib
+import json
+import os
+import struct
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+class TTLCache:
+    """Thread-safe LRU with a fixed max size and per-entry expiry."""
+
+    def __init__(self, maxsize: int = 512, ttl: float = 6 * 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value, ttl: 'float | None' = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteStore:
+    """Shared store in a SQLite file (e.g. on a mounted volume or /tmp)."""
+
+    def __init__(self, path: str, ttl: float = 6 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connect()
+
+    def _connect(self) -> None:
+        import sqlite3
+        self._db = sqlite3.connect(self.path, timeout=1.0, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._pid = os.getpid()
+
+    @property
+    def db(self):
+        # A connection must not cross fork(): a pre-forked worker opens its own.
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._connect()
+        return self._db
+
+    def get(self, key: str) -> 'str | None':
+        db = self.db
+        with self._lock:
+            row = db.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: 'float | None' = None) -> None:
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        db = self.db
+        with self._lock:
+            db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", (key, value, expires)
+            )
+            # Opportunistic cleanup; cheap with the primary-key table this small.
+            db.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+
+
+class RedisStore:
+    """Minimal RESP client speaking GET / SET EX to a Redis-compatible server.
+
+    Just enough protocol for a cache; any server that implements those two
+    commands (Redis, Valkey, KeyDB, a local stand-in) works.
+    """
+
+    def __init__(self, host: str, port: int = 6379, db: int = 0, ttl: float = 6 * 3600, timeout: float = 0.25):
+        self.host, self.port, self.db = host, port, db
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+        self._pid = None
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._pid = os.getpid()
+        self._file = self._sock.makefile('rb')
+        if self.db:
+            self._send('SELECT', str(self.db))
+            self._read()
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._file = None
+
+    def _send(self, *args: str) -> None:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for a in args:
+            b = a.encode('utf-8')
+            parts.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        self._sock.sendall(b''.join(parts))
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RuntimeError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self._file.read(n + 2)[:-2]
+            return data.decode('utf-8')
+        raise RuntimeError(f"unexpected redis reply {line!r}")
+
+    def command(self, *args: str):
+        if self._pid is not None and self._pid != os.getpid():
+            # Inherited across fork(): the socket belongs to the parent.
+            self._lock = threading.Lock()
+            self._sock = self._file = self._pid = None
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._send(*args)
+                    return self._read()
+                except (OSError, ConnectionError):
+                    # Stale pooled socket: reconnect once, then give up.
+                    self._close()
+                    if attempt:
+                        raise
+
+    def get(self, key: str) -> 'str | None':
+        return self.command('GET', key)
+
+    def set(self, key: str, value: str, ttl: 'float | None' = None) -> None:
+        self.command('SET', key, value, 'EX', str(max(1, int(self.ttl if ttl is None else ttl))))
+
+
+class ShmStore:
+    """Fixed-size hash table in a shared-memory file, for processes on one host.
+
+    Every process that maps the same file (pre-forked workers, or
+    unrelated ones given the same path) sees the same entries, with no
+    server to run. The table is `buckets` x `ways` slots of `slot_size`
+    bytes. A key hashes to one bucket, and a full bucket evicts the entry
+    closest to expiry. A value that does not fit in a slot is not stored
+    (counted in `too_large`). Each bucket has its own fcntl byte-range
+    lock, shared for reads and exclusive for writes. Holders keep it for a
+    memcpy, so workers rarely wait on each other.
+
+    incr() keeps integer counters in the same table, which makes a
+    ShmStore usable as a _ratelimit counter too.
+
+    Layout: a 64-byte header (magic, version, buckets, ways, slot_size),
+    then slots of [16-byte key digest | f64 expires | u32 length | u32 kind |
+    payload]. Expiry is wall-clock time, which every process agrees on.
+    """
+
+    MAGIC = b'GGSHM\0\0\0'
+    VERSION = 1
+    _HEADER = struct.Struct('<8sIIII')
+    _HEADER_SIZE = 64
+    _SLOT = struct.Struct('<16sdII')
+    _STR, _INT = 1, 2
+
+    def __init__(self, path: str, ttl: float = 6 * 3600, *, size_mb: float = 64, slot_size: int = 8192,
+                 ways: int = 8):
+        import fcntl
+        import mmap
+        self._fcntl = fcntl
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.too_large = 0
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, 0)        # byte 0 guards creation
+            try:
+                if os.fstat(fd).st_size == 0:
+                    buckets = max(1, int(size_mb * 1024 * 1024) // (slot_size * ways))
+                    os.ftruncate(fd, self._HEADER_SIZE + buckets * ways * slot_size)
+                    os.pwrite(fd, self._HEADER.pack(self.MAGIC, self.VERSION, buckets, ways, slot_size), 0)
+                magic, version, buckets, ways, slot_size = self._HEADER.unpack(
+                    os.pread(fd, self._HEADER.size, 0))
+                if magic != self.MAGIC or version != self.VERSION:
+                    raise ValueError(f"{path} is not a v{self.VERSION} shared cache segment")
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, 0)
+            self._map = mmap.mmap(fd, 0, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self.buckets, self.ways, self.slot_size = buckets, ways, slot_size
+        self._capacity = slot_size - self._SLOT.size
+
+    # -- slots --------------------------------------------------------------
+
+    def _locate(self, key: str) -> tuple:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        return digest, int.from_bytes(digest[:8], 'little') % self.buckets
+
+    def _slot(self, bucket: int, way: int) -> int:
+        return self._HEADER_SIZE + (bucket * self.ways + way) * self.slot_size
+
+    def _bucket_lock(self, bucket: int, mode: int) -> None:
+        # One lock byte per bucket, past byte 0; fcntl ranges need not exist in the file.
+        self._fcntl.lockf(self._fd, mode, 1, bucket + 1)
+
+    def _find(self, digest: bytes, bucket: int, now: float) -> tuple:
+        """(offset of `digest`'s live slot or None, offset of the best slot to reuse)."""
+        victim, victim_expires = None, None
+        for way in range(self.ways):
+            off = self._slot(bucket, way)
+            slot_digest, expires, _, _ = self._SLOT.unpack_from(self._map, off)
+            if expires > now and slot_digest == digest:
+                return off, off
+            if expires <= now:
+                expires = 0.0                   # empty or expired: free
+            if victim is None or expires < victim_expires:
+                victim, victim_expires = off, expires
+        return None, victim
+
+    def _read(self, key: str, kind: int):
+        digest, bucket = self._locate(key)
+        with self._lock:
+            self._bucket_lock(bucket, self._fcntl.LOCK_SH)
+            try:
+                off, _ = self._find(digest, bucket, time.time())
+                if off is None:
+                    return None
+                _, _, length, slot_kind = self._SLOT.unpack_from(self._map, off)
+                if slot_kind != kind:
+                    return None
+                start = off + self._SLOT.size
+                return self._map[start:start + length]
+            finally:
+                self._bucket_lock(bucket, self._fcntl.LOCK_UN)
+
+    # -- store API ------------------------------------------------------------
+
+    def get(self, key: str) -> 'str | None':
+        raw = self._read(key, self._STR)
+        return raw.decode('utf-8') if raw is not None else None
+
+    def set(self, key: str, value: str, ttl: 'float | None' = None) -> None:
+        data = value.encode('utf-8')
+        if len(data) > self._capacity:
+            self.too_large += 1
+            return
+        digest, bucket = self._locate(key)
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._bucket_lock(bucket, self._fcntl.LOCK_EX)
+            try:
+                _, off = self._find(digest, bucket, time.time())
+                start = off + self._SLOT.size
+                self._map[start:start + len(data)] = data
+                self._SLOT.pack_into(self._map, off, digest, expires, len(data), self._STR)
+            finally:
+                self._bucket_lock(bucket, self._fcntl.LOCK_UN)
+
+    def incr(self, key: str, amount: int, ttl: int) -> int:
+        """Add `amount` to the counter `key` (created with `ttl`); returns the new value."""
+        digest, bucket = self._locate(key)
+        now = time.time()
+        with self._lock:
+            self._bucket_lock(bucket, self._fcntl.LOCK_EX)
+            try:
+                found, off = self._find(digest, bucket, now)
+                start = off + self._SLOT.size
+                if found is not None and self._SLOT.unpack_from(self._map, off)[3] == self._INT:
+                    _, expires, _, _ = self._SLOT.unpack_from(self._map, off)
+                    value = struct.unpack_from('<q', self._map, start)[0] + amount
+                else:
+                    expires, value = now + ttl, amount
+                struct.pack_into('<q', self._map, start, value)
+                self._SLOT.pack_into(self._map, off, digest, expires, 8, self._INT)
+            finally:
+                self._bucket_lock(bucket, self._fcntl.LOCK_UN)
+        return value
+
+    def stats(self) -> dict:
+        now = time.time()
+        live = 0
+        for bucket in range(self.buckets):
+            for way in range(self.ways):
+                live += self._SLOT.unpack_from(self._map, self._slot(bucket, way))[1] > now
+        return {"slots": self.buckets * self.ways, "live": live, "too_large": self.too_large}
+
+
+def _shm_path(parsed) -> str:
+    """shm:///name -> /dev/shm/name (or the temp dir without /dev/shm); shm:///a/b/c is used as is."""
+    path = parsed.path or '/gifting-idea-cache'
+    if path.count('/') > 1:
+        return path
+    import tempfile
+    root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(root, path.lstrip('/'))
+
+
+_SHM_STORES: dict = {}     # path -> ShmStore, one per process
+_SHM_LOCK = threading.Lock()
+
+
+def open_shm(url: str, ttl: float = 6 * 3600) -> ShmStore:
+    """ShmStore from shm:///name?mb=64&slot=8192 (size only applies on creation).
+
+    A path opened twice in one process (the response cache and the quota
+    counter pointed at the same segment) gets the same ShmStore: fcntl
+    locks are per process, so two mappings in one process would not
+    exclude each other. `ttl` is the first opener's; ResponseCache passes
+    its own on every set.
+    """
+    from urllib.parse import parse_qs
+    parsed = urlparse(url)
+    query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+    path = _shm_path(parsed)
+    with _SHM_LOCK:
+        store = _SHM_STORES.get(path)
+        if store is None:
+            store = _SHM_STORES[path] = ShmStore(path, ttl=ttl, size_mb=float(query.get('mb', 64)),
+                                                 slot_size=int(query.get('slot', 8192)))
+        return store
+
+
+def open_store(url: str, ttl: float = 6 * 3600):
+    """Build a shared store from a URL; '' means no shared tier.
+
+    sqlite:///path/to/cache.db  |  redis://host:port/db  |  shm:///name?mb=64
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'shm':
+        return open_shm(url, ttl=ttl)
+    if parsed.scheme == 'sqlite':
+        return SQLiteStore(parsed.path or os.path.join('/tmp', 'recommend-cache.db'), ttl=ttl)
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.lstrip('/') or 0)
+        return RedisStore(parsed.hostname or '127.0.0.1', parsed.port or 6379, db=db, ttl=ttl)
+    raise ValueError(f"unsupported cache url: {url}")
+
+
+class ResponseCache:
+    """In-process TTLCache in front of an optional shared store."""
+
+    def __init__(self, maxsize: int = 512, ttl: float = 6 * 3600, shared=None):
+        self.local = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.shared = shared
+        self.shared_hits = 0
+        self.shared_errors = 0
+
+    def get(self, key: str) -> 'dict | None':
+        raw = self.local.get(key)
+        if raw is None and self.shared is not None:
+            try:
+                raw = self.shared.get(key)
+            except Exception as e:
+                self.shared_errors += 1
+                print(f"cache backend error: {type(e).__name__}: {e}")
+                raw = None
+            if raw is not None:
+                self.shared_hits += 1
+                self.local.set(key, raw)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: dict) -> None:
+        raw = json.dumps(value, separators=(',', ':'))
+        self.local.set(key, raw)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, raw, self.ttl)
+            except Exception as e:
+                self.shared_errors += 1
+                print(f"cache backend error: {type(e).__name__}: {e}")
+
+    def stats(self) -> dict:
+        out = self.local.stats()
+        out["shared_hits"] = self.shared_hits
+        out["shared_errors"] = self.shared_errors
+        return out
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'trace', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.trace = {}     # what the leader's call added to its trace
+        self.waiters = []   # (loop, future) pairs from async followers
+
+
+def _resolve(fut, result, error) -> None:
+    if fut.done():
+        return
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(copy.deepcopy(result))
+
+
+def _snapshot(trace) -> dict:
+    """Copy of a trace dict, one level of nested dicts deep."""
+    return {k: dict(v) if isinstance(v, dict) else v for k, v in list(trace.items())}
+
+
+def _trace_delta(before: dict, after: dict) -> dict:
+    """What happened to a trace between two snapshots: counters by their
+    increase, anything else by its new value."""
+    delta = {}
+    for k, v in after.items():
+        old = before.get(k)
+        if isinstance(v, dict):
+            sub = _trace_delta(old if isinstance(old, dict) else {}, v)
+            if sub:
+                delta[k] = sub
+        elif isinstance(v, int) and not isinstance(v, bool) and isinstance(old, int):
+            if v != old:
+                delta[k] = v - old
+        elif v != old:
+            delta[k] = v
+    return delta
+
+
+def merge_trace(trace: dict, delta: dict) -> None:
+    """Add `delta` (see _trace_delta) into `trace`: counters summed, the rest set."""
+    for k, v in delta.items():
+        if isinstance(v, dict):
+            merge_trace(trace.setdefault(k, {}), v)
+        elif isinstance(v, int) and not isinstance(v, bool):
+            trace[k] = trace.get(k, 0) + v
+        else:
+            trace[k] = v
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one upstream call.
+
+    The first caller for a key (the leader) runs the function; everyone who
+    arrives while it is in flight waits and receives a deep copy of the same
+    result, or the same exception. Works across threads (do) and asyncio
+    tasks (do_async), and the two can follow each other's leaders.
+    Nothing is remembered once the call finishes -- that is the cache's job.
+
+    `trace` is the caller's trace dict, passed on to the function as
+    trace=; whatever the leader's call adds to it (tokens, hedge, parse
+    errors) is added to each follower's trace too. `deadline` (a
+    time.monotonic() value) bounds how long a follower waits: past it, it
+    gets TimeoutError and falls back like any caller whose call timed out.
+    The leader is not affected by it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict = {}
+        self.calls = 0       # upstream calls actually made
+        self.coalesced = 0   # callers served by someone else's call
+        self.timeouts = 0    # followers that gave up at their deadline
+
+    def _join(self, key):
+        """Return (call, is_leader); registers a new call if none in flight."""
+        call = self._calls.get(key)
+        if call is not None:
+            self.coalesced += 1
+            return call, False
+        call = self._calls[key] = _Call()
+        self.calls += 1
+        return call, True
+
+    def _finish(self, key, call, result, error, delta) -> None:
+        with self._lock:
+            del self._calls[key]
+            call.result, call.error, call.trace = result, error, delta
+            waiters, call.waiters = call.waiters, []
+        call.event.set()
+        for loop, fut in waiters:
+            loop.call_soon_threadsafe(_resolve, fut, result, error)
+
+    def _timed_out(self, key):
+        with self._lock:
+            self.timeouts += 1
+        return TimeoutError(f"single-flight wait for {key!r} passed its deadline")
+
+    def do(self, key: str, fn, *args, deadline: 'float | None' = None, trace: 'dict | None' = None, **kwargs):
+        with self._lock:
+            call, leader = self._join(key)
+        if not leader:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not call.event.wait(timeout):
+                raise self._timed_out(key)
+            if trace is not None:
+                merge_trace(trace, call.trace)
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+        if trace is not None:
+            kwargs['trace'] = trace
+        before = _snapshot(trace or {})
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, call, None, e, _trace_delta(before, _snapshot(trace or {})))
+            raise
+        self._finish(key, call, result, None, _trace_delta(before, _snapshot(trace or {})))
+        return result
+
+    async def do_async(self, key: str, fn, *args, deadline: 'float | None' = None, trace: 'dict | None' = None,
+                       **kwargs):
+        """Async variant; `fn` returns an awaitable."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            call, leader = self._join(key)
+            if not leader:
+                fut = loop.create_future()
+                call.waiters.append((loop, fut))
+        if not leader:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                return await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
+                if fut.cancelled():     # our deadline, not the leader's error
+                    raise self._timed_out(key) from None
+                raise
+            finally:
+                if trace is not None and call.event.is_set():
+                    merge_trace(trace, call.trace)
+        if trace is not None:
+            kwargs['trace'] = trace
+        before = _snapshot(trace or {})
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, call, None, e, _trace_delta(before, _snapshot(trace or {})))
+            raise
+        self._finish(key, call, result, None, _trace_delta(before, _snapshot(trace or {})))
+        return result
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "timeouts": self.timeouts,
+                "in_flight": len(self._calls)}
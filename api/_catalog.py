@@ -0,0 +1,491 @@
+"""Gift catalog for the rule-based fallback.
+
+The source of truth is data/gift_catalog.json (items plus the small
+relationship / occasion / pro-tip maps). tools/build_catalog.py compiles it
+into data/gift_catalog.bin, a columnar file that is read through mmap:
+opening it costs a header parse, not a JSON parse of every item, and the
+pages are shared between worker processes by the OS page cache.
+
+Either way the catalog exposes the same columns and indexes:
+
+- items are numbered 0..n-1; per-item columns hold title, icon, a
+  one-byte gift_type code and the price range (price_min..price_max, INR);
+- by_category / by_tag / by_audience / by_occasion map a key to a sorted
+  sequence of item ids (posting lists);
+- the price index: item ids sorted by typical price (the geometric mean of
+  the range), the sorted prices themselves for bisect, and each item's
+  position in that order.
+
+select() answers "what fits this budget" with two bisects: the items
+priced at 50-100% of the budget are one contiguous run of the price
+order. The requested gift types and the recipient's audience are hard
+filters on top of that (see select() for how they widen). Scoring then
+works on int bitsets over price positions, one bit per item, so every step
+is a big-int AND/XOR across all the candidates at once rather than a
+Python loop over items:
+
+- each feature (budget fit, gift_type match, relationship / vibe
+  categories, occasion, audience) is a bitset, memoized per posting list;
+- their weighted sum is kept bit-sliced -- planes[k] holds bit k of every
+  item's score -- and built with a ripple-carry add per feature;
+- the best-scoring candidates are found by ANDing down the planes from the
+  top, and one is drawn from them with a caller-supplied random.Random,
+  preferring a gift_type not picked yet (diversity).
+
+Results are reproducible per request and nothing touches the global
+`random` state.
+
+Binary layout (little-endian, sections 8-byte aligned):
+
+    magic  b'GGCAT\\0\\0\\0'
+    u32 version, u32 n_items, u32 n_sections, u32 reserved
+    n_sections x (8s name, u64 offset, u64 length)
+    STROFF   u32[n_strings + 1]   offsets into STRBLOB
+    STRBLOB  utf-8 bytes
+    TITLE    u32[n_items]         string id per item
+    ICON     u32[n_items]         string id per item
+    TAG      u8[n_items]          index into meta["tags"]
+    PRICELO  u32[n_items]         price_min per item
+    PRICEHI  u32[n_items]         price_max per item
+    PORDER   u32[n_items]         item ids by typical price, ascending
+    PKEY     u32[n_items]         typical price of PORDER[k]
+    PRANK    u32[n_items]         position of each item in PORDER
+    POSTING  u32[...]             every posting list, back to back
+    META     JSON: tag names, index directory {kind: {key: [start, count]}},
+             relationships, occasions, pro_tips, source_sha256
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+_DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+DEFAULT_JSON = os.path.join(_DATA_DIR, 'gift_catalog.json')
+DEFAULT_BIN = os.path.join(_DATA_DIR, 'gift_catalog.bin')
+
+MAGIC = b'GGCAT\0\0\0'
+FORMAT_VERSION = 2
+_HEADER = struct.Struct('<8sIIII')
+_SECTION = struct.Struct('<8sQQ')
+
+# Share of the budget an item's typical price should reach to count as a
+# fit; cheaper items are only offered when the band runs out.
+BUDGET_FLOOR = 0.5
+
+# Score weights. Audience outranks everything so a child never gets adult
+# items while kids' items are left; the requested gift types come next.
+_WEIGHTS = {
+    'audience': 16,
+    'gift_type': 8,
+    'lead': 4,          # the first (most specific) category in the request
+    'category': 2,      # any of the requested categories
+    'occasion': 2,
+    'fit': 1,           # typical price in the upper half of the band
+}
+
+_INDEX_FIELDS = (
+    ('category', 'categories', ()),
+    ('tag', None, ()),
+    ('audience', 'audience', ('adult',)),
+    ('occasion', 'occasions', ()),
+)
+
+
+class _Strings:
+    """Read-only sequence of strings decoded on access from a string table."""
+
+    __slots__ = ('_offsets', '_blob', '_ids')
+
+    def __init__(self, offsets, blob, ids):
+        self._offsets, self._blob, self._ids = offsets, blob, ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, i: int) -> str:
+        sid = self._ids[i]
+        return str(self._blob[self._offsets[sid]:self._offsets[sid + 1]], 'utf-8')
+
+
+def _u32(buf):
+    """Zero-copy u32 view of a little-endian buffer (copies on big-endian hosts)."""
+    if sys.byteorder == 'little':
+        return memoryview(buf).cast('I')
+    out = array('I', bytes(buf))
+    out.byteswap()
+    return out
+
+
+def _typical(lo: int, hi: int) -> int:
+    return round(math.sqrt(lo * hi)) if lo and hi else lo or hi
+
+
+def _price_index(lows, highs) -> tuple:
+    """(order, keys, rank) arrays for the price columns."""
+    typical = [_typical(lo, hi) for lo, hi in zip(lows, highs)]
+    order = array('I', sorted(range(len(typical)), key=lambda i: (typical[i], i)))
+    keys = array('I', (typical[i] for i in order))
+    rank = array('I', bytes(4 * len(order)))
+    for k, i in enumerate(order):
+        rank[i] = k
+    return order, keys, rank
+
+
+def _add(planes: list, bits: int, weight: int) -> None:
+    """planes += weight * bits, every item's score at once (bit-sliced)."""
+    k = 0
+    while weight:
+        if weight & 1:
+            carry, j = bits, k
+            while carry:
+                while j >= len(planes):
+                    planes.append(0)
+                planes[j], carry = planes[j] ^ carry, planes[j] & carry
+                j += 1
+        weight >>= 1
+        k += 1
+
+
+def _best(planes: list, mask: int) -> int:
+    """The subset of `mask` with the highest score."""
+    for plane in reversed(planes):
+        top = mask & plane
+        if top:
+            mask = top
+    return mask
+
+
+def _draw(bits: int, rng) -> int:
+    """A set bit of `bits`: the first one at or after a random position."""
+    low = (bits & -bits).bit_length() - 1
+    start = rng.randint(low, bits.bit_length() - 1)
+    rest = bits >> start
+    return start + (rest & -rest).bit_length() - 1
+
+
+def _span(lo: int, hi: int) -> int:
+    """Bitset of positions lo..hi-1."""
+    return (1 << hi) - (1 << lo) if hi > lo else 0
+
+
+class Catalog:
+    def __init__(self, titles, icons, tags, tag_names, indexes: dict, meta: dict, prices: tuple):
+        self.titles = titles
+        self.icons = icons
+        self.tags = tags
+        self.price_min, self.price_max, self.price_order, self.price_keys, self.price_rank = prices
+        self.tag_names = list(tag_names)
+        self.tag_codes = {t: i for i, t in enumerate(self.tag_names)}
+        self.by_category = indexes.get('category', {})
+        self.by_tag = indexes.get('tag', {})
+        self.by_audience = indexes.get('audience', {})
+        self.by_occasion = indexes.get('occasion', {})
+        self.relationships = meta.get('relationships', {})
+        self.occasions = meta.get('occasions', {})
+        self.pro_tips = meta.get('pro_tips', {})
+        self.source_sha256 = meta.get('source_sha256', '')
+        self._bits: dict = {}
+        self._id_of = None
+
+    # -- construction ---------------------------------------------------
+
+    @classmethod
+    def from_records(cls, records: list, meta: 'dict | None' = None) -> 'Catalog':
+        """Build in memory from item dicts (the JSON source's "items")."""
+        titles, icons, tags, tag_names = [], [], bytearray(), []
+        lows, highs = array('I'), array('I')
+        tag_codes: dict = {}
+        indexes = {kind: {} for kind, _, _ in _INDEX_FIELDS}
+        for i, rec in enumerate(records):
+            titles.append(rec['title'])
+            icons.append(rec.get('icon') or '🎁')
+            tag = rec.get('gift_type') or 'Practical'
+            if tag not in tag_codes:
+                tag_codes[tag] = len(tag_names)
+                tag_names.append(tag)
+            tags.append(tag_codes[tag])
+            lows.append(int(rec.get('price_min') or 0))
+            highs.append(int(rec.get('price_max') or rec.get('price_min') or 0))
+            for kind, field, default in _INDEX_FIELDS:
+                keys = (tag,) if field is None else (rec.get(field) or default)
+                for key in keys:
+                    indexes[kind].setdefault(key, array('I')).append(i)
+        return cls(titles, icons, bytes(tags), tag_names, indexes, meta or {},
+                   (lows, highs) + _price_index(lows, highs))
+
+    @classmethod
+    def from_json(cls, path: str) -> 'Catalog':
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls.from_records(data['items'], data)
+
+    @classmethod
+    def open(cls, path: str) -> 'Catalog':
+        """Map a compiled .bin catalog; columns stay views into the mapping."""
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_items, n_sections, _ = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path}: not a v{FORMAT_VERSION} gift catalog")
+        view = memoryview(mm)
+        sections = {}
+        for k in range(n_sections):
+            name, offset, length = _SECTION.unpack_from(mm, _HEADER.size + k * _SECTION.size)
+            sections[name.rstrip(b'\0').decode()] = view[offset:offset + length]
+
+        meta = json.loads(bytes(sections['META']))
+        offsets = _u32(sections['STROFF'])
+        blob = sections['STRBLOB']
+        postings = _u32(sections['POSTING'])
+        indexes = {
+            kind: {key: postings[start:start + count] for key, (start, count) in keys.items()}
+            for kind, keys in meta['indexes'].items()
+        }
+        cat = cls(
+            _Strings(offsets, blob, _u32(sections['TITLE'])),
+            _Strings(offsets, blob, _u32(sections['ICON'])),
+            sections['TAG'],
+            meta['tags'],
+            indexes,
+            meta,
+            tuple(_u32(sections[name]) for name in ('PRICELO', 'PRICEHI', 'PORDER', 'PKEY', 'PRANK')),
+        )
+        cat._mmap = mm   # keep the mapping alive as long as the views
+        assert len(cat.titles) == n_items
+        return cat
+
+    @classmethod
+    def load(cls, path: str) -> 'Catalog':
+        return cls.open(path) if path.endswith('.bin') else cls.from_json(path)
+
+    # -- lookups --------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def tag_of(self, i: int) -> str:
+        return self.tag_names[self.tags[i]]
+
+    def id_of(self, title: str) -> 'int | None':
+        """Item id for a title; builds the reverse map on first use."""
+        if self._id_of is None:
+            self._id_of = {self.titles[i]: i for i in range(len(self.titles))}
+        return self._id_of.get(title)
+
+    def price_of(self, i: int) -> int:
+        """Typical price of item `i` (geometric mean of its range)."""
+        return self.price_keys[self.price_rank[i]]
+
+    def bits(self, ids) -> int:
+        """Bitset over price positions for a posting list (memoized per list object)."""
+        key = id(ids)
+        cached = self._bits.get(key)
+        if cached is None or cached[0] is not ids:
+            rank = self.price_rank
+            buf = bytearray((len(rank) + 7) // 8)
+            for i in ids:
+                p = rank[i]
+                buf[p >> 3] |= 1 << (p & 7)
+            cached = self._bits[key] = (ids, int.from_bytes(buf, 'little'))
+        return cached[1]
+
+    def _union(self, index: dict, keys) -> int:
+        out = 0
+        for key in keys:
+            ids = index.get(key)
+            if ids:
+                out |= self.bits(ids)
+        return out
+
+    # -- selection ------------------------------------------------------
+
+    def budget_span(self, budget: int, floor: float = BUDGET_FLOOR) -> tuple:
+        """Price positions [lo, hi) whose typical price is within floor*budget..budget."""
+        keys = self.price_keys
+        return bisect_left(keys, math.ceil(budget * floor)), bisect_right(keys, budget)
+
+    def price_for(self, i: int, budget: int) -> int:
+        """What item `i` is shown at for `budget`: its typical price if that
+        fits, else the nearest price in its range (the budget, or price_min
+        when even that is over)."""
+        typical = self.price_of(i)
+        if typical <= budget:
+            return typical
+        return max(self.price_min[i], budget)
+
+    def select(self, budget: int, categories: list, gift_types, rng, *, occasion: str = '',
+               audience: str = '', count: int = 10, exclude=()) -> list:
+        """Pick up to `count` distinct item ids for `budget`, best score first.
+
+        Only items whose gift_type is in `gift_types` and whose audience
+        includes `audience` are eligible. Within that, the items priced at
+        BUDGET_FLOOR..1 x budget come first, then the cheaper ones, then
+        those above the budget (best score, cheapest first), so a small
+        budget still gets a page of the right kind of gift. If the page is
+        still short, it is filled without the audience filter, from
+        `categories` first; gift_types is only dropped when no item of
+        those types exists at all.
+
+        Scores follow _WEIGHTS: `categories` is in order of preference (the
+        first is the "lead"), `occasion` is a by_occasion key, `audience` a
+        by_audience key. Ids in `exclude` (items an earlier page already
+        showed) are never picked.
+        """
+        n = len(self.price_order)
+        lo, hi = self.budget_span(budget)
+        mid = bisect_left(self.price_keys, math.ceil(budget * (1 + BUDGET_FLOOR) / 2), lo, hi)
+        by_type = self._union(self.by_tag, gift_types or ()) or _span(0, n)
+        for_audience = self._union(self.by_audience, (audience,)) if audience else _span(0, n)
+        in_categories = self._union(self.by_category, categories)
+        features = [
+            (_WEIGHTS['audience'], for_audience),
+            (_WEIGHTS['gift_type'], by_type),
+            (_WEIGHTS['lead'], self._union(self.by_category, categories[:1])),
+            (_WEIGHTS['category'], in_categories),
+            (_WEIGHTS['occasion'], self._union(self.by_occasion, (occasion,))),
+            (_WEIGHTS['fit'], _span(mid, hi)),
+        ]
+        used = 0
+        for i in exclude:
+            used |= 1 << self.price_rank[i]
+
+        picked: list = []
+        seen: set = set()
+        planes_for: dict = {}
+        # Strict filters first, then without the audience (requested
+        # categories, then any); within each, the band, everything cheaper,
+        # then over budget. Each window is shifted
+        # down to bit 0 so the big-int ops only span the window, not the
+        # whole catalog.
+        for allowed in dict.fromkeys((by_type & for_audience, by_type & in_categories, by_type)):
+            for start, stop, cheapest in ((lo, hi, False), (0, lo, False), (hi, n, True)):
+                if len(picked) >= count or stop <= start:
+                    continue
+                window = (1 << (stop - start)) - 1
+                pool = allowed >> start & window & ~(used >> start)
+                if not pool:
+                    continue
+                if start not in planes_for:
+                    planes: list = []
+                    for weight, bits in features:
+                        bits = bits >> start & window
+                        if bits:
+                            _add(planes, bits, weight)
+                    planes_for[start] = (planes, {})
+                planes, tag_bits = planes_for[start]
+                while pool and len(picked) < count:
+                    best = _best(planes, pool)
+                    if len(seen) == len(self.tag_names):
+                        seen.clear()     # every tag has had a turn
+                    fresh = best
+                    for code in seen:
+                        if code not in tag_bits:
+                            tag_bits[code] = self.bits(self.by_tag[self.tag_names[code]]) >> start & window
+                        fresh &= ~tag_bits[code]
+                    if fresh:
+                        best = fresh
+                    else:
+                        seen.clear()
+                    p = (best & -best).bit_length() - 1 if cheapest else _draw(best, rng)
+                    i = self.price_order[start + p]
+                    picked.append(i)
+                    pool &= ~(1 << p)
+                    used |= 1 << (start + p)
+                    seen.add(self.tags[i])
+        return picked
+
+
+def write_binary(records: list, meta: dict, path: str) -> None:
+    """Compile item dicts + small maps into the mmap-able .bin layout."""
+    cat = Catalog.from_records(records, meta)
+
+    strings: list = []
+    string_ids: dict = {}
+
+    def sid(s: str) -> int:
+        if s not in string_ids:
+            string_ids[s] = len(strings)
+            strings.append(s)
+        return string_ids[s]
+
+    title_ids = array('I', (sid(t) for t in cat.titles))
+    icon_ids = array('I', (sid(i) for i in cat.icons))
+    blob = bytearray()
+    offsets = array('I', [0])
+    for s in strings:
+        blob += s.encode('utf-8')
+        offsets.append(len(blob))
+
+    postings = array('I')
+    directory: dict = {}
+    for kind, keys in (('category', cat.by_category), ('tag', cat.by_tag),
+                       ('audience', cat.by_audience), ('occasion', cat.by_occasion)):
+        directory[kind] = {}
+        for key in sorted(keys):
+            directory[kind][key] = [len(postings), len(keys[key])]
+            postings.extend(keys[key])
+
+    out_meta = {
+        'tags': cat.tag_names,
+        'indexes': directory,
+        'relationships': meta.get('relationships', {}),
+        'occasions': meta.get('occasions', {}),
+        'pro_tips': meta.get('pro_tips', {}),
+        'source_sha256': meta.get('source_sha256', ''),
+    }
+
+    def le(arr: array) -> bytes:
+        if sys.byteorder != 'little':
+            arr = array(arr.typecode, arr)
+            arr.byteswap()
+        return arr.tobytes()
+
+    sections = [
+        (b'STROFF', le(offsets)),
+        (b'STRBLOB', bytes(blob)),
+        (b'TITLE', le(title_ids)),
+        (b'ICON', le(icon_ids)),
+        (b'TAG', bytes(cat.tags)),
+        (b'PRICELO', le(cat.price_min)),
+        (b'PRICEHI', le(cat.price_max)),
+        (b'PORDER', le(cat.price_order)),
+        (b'PKEY', le(cat.price_keys)),
+        (b'PRANK', le(cat.price_rank)),
+        (b'POSTING', le(postings)),
+        (b'META', json.dumps(out_meta, ensure_ascii=False, separators=(',', ':')).encode('utf-8')),
+    ]
+
+    pos = _HEADER.size + _SECTION.size * len(sections)
+    table, body = [], bytearray()
+    for name, data in sections:
+        pad = -(pos + len(body)) % 8
+        body += b'\0' * pad
+        table.append(_SECTION.pack(name, pos + len(body), len(data)))
+        body += data
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(cat), len(sections), 0))
+        f.write(b''.join(table))
+        f.write(body)
+    os.replace(tmp, path)
+
+
+_CATALOG = None
+
+
+def get_catalog() -> Catalog:
+    """Process-wide catalog, loaded on first use.
+
+    GIFT_CATALOG_PATH overrides; otherwise the compiled .bin is preferred
+    and the JSON source is the fallback.
+    """
+    global _CATALOG
+    if _CATALOG is None:
+        path = os.environ.get('GIFT_CATALOG_PATH') or (DEFAULT_BIN if os.path.exists(DEFAULT_BIN) else DEFAULT_JSON)
+        _CATALOG = Catalog.load(path)
+    return _CATALOG
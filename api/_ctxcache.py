@@ -0,0 +1,148 @@
+"""Gemini context caching for the static part of the prompts.
+
+Every prompt is a long block of fixed instructions followed by ten or so
+lines about the recipient. Sent whole, the instructions are uploaded and
+billed as fresh prompt tokens on every call. With context caching they are
+registered once as a cachedContents resource (as its systemInstruction),
+and each call sends only the recipient section plus the resource's name;
+Gemini bills the cached tokens at a discount and skips re-reading them.
+
+ContextCache keeps one resource per distinct instruction text (they differ
+by prompt kind: LLM-1 / LLM-2, free-form / structured, single-pass):
+
+- lookup() never waits on the API. It returns the resource name if one is
+  live, and when there is none yet, or it expires within `refresh_before`
+  seconds, starts a background create / ttl update. Until that lands the
+  caller sends the full prompt, so the first call of a process pays
+  nothing extra;
+- a create that fails (the API enforces a minimum cached size per model,
+  and rejects anything smaller with a 400) is retried after
+  `retry_after` seconds, a transient error after a few seconds;
+- invalidate() forgets a resource the API no longer knows (expired early
+  or deleted); the caller resends that call in full.
+
+Resources are per process. Pre-forked workers each keep their own, which
+costs a create per worker per prompt kind and nothing per request.
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+from _gemini import GeminiError
+
+# A resource this close to its expireTime is not handed out: the call that
+# uses it may still be in flight when it expires.
+_SAFETY_S = 30.0
+_TRANSIENT_RETRY_S = 5.0
+
+
+def _expires_at(resource: dict, ttl: float) -> float:
+    """expireTime ("2026-10-18T12:00:00.123456Z") as a time.time() value."""
+    try:
+        stamp = resource['expireTime'].replace('Z', '+00:00')
+        head, dot, tail = stamp.partition('.')
+        if dot:   # fromisoformat wants at most 6 fractional digits
+            digits = len(tail) - len(tail.lstrip('0123456789'))
+            stamp = f"{head}.{tail[:min(digits, 6)]}{tail[digits:]}"
+        return datetime.fromisoformat(stamp).timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return time.time() + ttl
+
+
+class ContextCache:
+    def __init__(self, client, *, ttl: float = 3600.0, refresh_before: float = 300.0,
+                 retry_after: float = 600.0):
+        """`client` is a GeminiClient; resources are made for its model."""
+        self.client = client
+        self.ttl = ttl
+        self.refresh_before = refresh_before
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._entries: dict = {}     # digest -> {"name", "expires", "tokens", "busy", "retry_at"}
+        self.created = 0
+        self.refreshed = 0
+        self.failures = 0
+        self.invalidated = 0
+
+    def lookup(self, instructions: str) -> 'str | None':
+        """Name of a live resource holding `instructions`, else None (see module doc)."""
+        digest = hashlib.sha256(instructions.encode('utf-8')).hexdigest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                entry = self._entries[digest] = {"name": None, "expires": 0.0, "tokens": 0, "busy": False,
+                                                 "retry_at": 0.0}
+            left = entry["expires"] - now
+            name = entry["name"] if left > _SAFETY_S else None
+            due = (not entry["busy"] and now >= entry["retry_at"]
+                   and left < _SAFETY_S + self.refresh_before)
+            if due:
+                entry["busy"] = True
+                # A resource past the safety margin but not yet expired can still be extended.
+                current = entry["name"] if left > 0 else None
+        if due:
+            threading.Thread(target=self._refresh, args=(digest, instructions, current),
+                             name='gemini-ctxcache', daemon=True).start()
+        return name
+
+    def _refresh(self, digest: str, instructions: str, name: 'str | None') -> None:
+        retry_at = 0.0
+        try:
+            if name is not None:
+                try:
+                    resource = self.client.update_cached_content(name, self.ttl)
+                    refreshed = True
+                except GeminiError as e:
+                    if e.status not in (403, 404):
+                        raise
+                    name = None     # gone already: make a new one
+            if name is None:
+                resource = self.client.create_cached_content({
+                    "model": self.client.model,
+                    "systemInstruction": {"parts": [{"text": instructions}]},
+                    "ttl": f"{int(self.ttl)}s",
+                })
+                refreshed = False
+            with self._lock:
+                entry = self._entries[digest]
+                entry["name"] = resource.get('name') or name
+                entry["expires"] = _expires_at(resource, self.ttl)
+                entry["tokens"] = int((resource.get('usageMetadata') or {}).get('totalTokenCount') or 0)
+                if refreshed:
+                    self.refreshed += 1
+                else:
+                    self.created += 1
+        except Exception as e:
+            transient = not isinstance(e, GeminiError) or e.retryable
+            retry_at = time.time() + (_TRANSIENT_RETRY_S if transient else self.retry_after)
+            with self._lock:
+                self.failures += 1
+            print(f"Gemini context cache error: {type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                entry = self._entries[digest]
+                entry["busy"] = False
+                entry["retry_at"] = retry_at
+
+    def invalidate(self, name: str) -> None:
+        """Forget `name`; the next lookup() of its instructions makes a new one."""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry["name"] == name:
+                    entry["name"], entry["expires"] = None, 0.0
+                    self.invalidated += 1
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            live = [e for e in self._entries.values() if e["expires"] - now > _SAFETY_S]
+            return {
+                "live": len(live),
+                "cached_tokens": sum(e["tokens"] for e in live),
+                "created": self.created,
+                "refreshed": self.refreshed,
+                "failures": self.failures,
+                "invalidated": self.invalidated,
+            }
@@ -0,0 +1,221 @@
+"""Product-link enrichment: search URLs -> concrete product pages.
+
+purchase_links are merchant search URLs built from the title, and many of
+them land on an empty or off-target results page. With a resolver
+configured, LinkEnricher looks up each (title, merchant) pair and, where
+the resolver finds a product, swaps in its page URL and price:
+
+- a resolver is any callable resolve(title, merchant) -> {"url",
+  "price_inr"} or None. resolver_from_url() builds one from
+  PRODUCT_RESOLVER_URL: stub://?latency_ms=40&miss=0.2 for a local,
+  deterministic stand-in (tests, load runs), or http(s)://host/path for a
+  service answering GET ?title=...&merchant=... with that JSON (404 = no
+  product);
+- lookups for all gifts x merchants run on one bounded, process-wide
+  thread pool. A request waits for them until its deadline and not a
+  moment longer; whatever is unresolved by then keeps its search URL, so
+  enrichment never adds more than the deadline to a response;
+- lookups that miss the deadline still finish in the background and land
+  in the cache, as do results for other requests' titles: a repeat title
+  is answered from memory;
+- results, "no product" included, are cached per normalized title in a
+  TTLCache. A failed lookup is not cached and is retried next time;
+- identical lookups in flight share one future, and past `max_pending`
+  queued lookups new ones are skipped (shed) rather than queued behind a
+  backlog that could never finish in time.
+"""
+import hashlib
+import json
+import threading
+import time
+from urllib.parse import parse_qs, quote, urlencode, urlparse
+
+from _cache import TTLCache
+from _links import MERCHANTS
+
+
+def normalize_title(title) -> str:
+    """Cache key for a title: case- and whitespace-folded."""
+    return ' '.join(str(title or '').lower().split())
+
+
+def _product(value) -> 'dict | None':
+    """A resolver answer as {"url", "price_inr"}, or None if unusable."""
+    if not isinstance(value, dict):
+        return None
+    url = value.get('url')
+    if not isinstance(url, str) or urlparse(url).scheme != 'https':
+        return None
+    price = value.get('price_inr')
+    return {"url": url, "price_inr": int(price) if isinstance(price, (int, float)) and price > 0 else None}
+
+
+class StubResolver:
+    """Deterministic local resolver: fake product pages with stable prices.
+
+    Each (title, merchant) pair hashes to its answer, so repeated runs
+    agree. `miss` is the share of pairs with no product; a lookup sleeps
+    0.5-1.5 x `latency_s`, which lets a test put some of them past the
+    deadline.
+    """
+
+    def __init__(self, latency_s: float = 0.0, miss: float = 0.0):
+        self.latency_s = latency_s
+        self.miss = miss
+        self.calls = 0
+
+    def __call__(self, title: str, merchant: str) -> 'dict | None':
+        digest = hashlib.sha256(f"{normalize_title(title)}|{merchant}".encode('utf-8')).digest()
+        self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s * (0.5 + digest[0] / 255))
+        if digest[1] / 256 < self.miss:
+            return None
+        host = urlparse(MERCHANTS.get(merchant, '')).netloc or f"www.{merchant}.example"
+        slug = quote('-'.join(normalize_title(title).split()), safe='-')
+        price = 199 + int.from_bytes(digest[2:4], 'big') % 50 * 100
+        return {"url": f"https://{host}/p/{slug}-{digest[4:8].hex()}", "price_inr": price}
+
+
+class HTTPResolver:
+    """GET `url`?title=...&merchant=... -> {"url", "price_inr"}; 404 means no product."""
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, title: str, merchant: str) -> 'dict | None':
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
+
+        sep = '&' if '?' in self.url else '?'
+        req = Request(f"{self.url}{sep}{urlencode({'title': title, 'merchant': merchant})}",
+                      headers={'Accept': 'application/json'})
+        try:
+            with urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+
+def resolver_from_url(url: str):
+    """PRODUCT_RESOLVER_URL -> resolver; '' means enrichment is off.
+
+    stub://?latency_ms=40&miss=0.2  |  https://resolver.internal/lookup
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'stub':
+        opts = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        return StubResolver(latency_s=float(opts.get('latency_ms', 0)) / 1000, miss=float(opts.get('miss', 0)))
+    if parsed.scheme in ('http', 'https'):
+        return HTTPResolver(url)
+    raise ValueError(f"unsupported resolver url: {url}")
+
+
+class LinkEnricher:
+    def __init__(self, resolver, merchants, *, workers: int = 16, deadline_s: float = 0.25,
+                 ttl: float = 6 * 3600, maxsize: int = 4096, max_pending: 'int | None' = None):
+        """`merchants` are the purchase_links names to resolve for every title."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.resolver = resolver
+        self.merchants = list(merchants)
+        self.deadline_s = deadline_s
+        self.max_pending = workers * 8 if max_pending is None else max_pending
+        self.cache = TTLCache(maxsize, ttl)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='enrich')
+        self._lock = threading.Lock()
+        self._pending: dict = {}     # (key, merchant) -> Future
+        self.lookups = 0
+        self.found = 0
+        self.errors = 0
+        self.shed = 0
+
+    def _resolve(self, title: str, key: str, merchant: str) -> None:
+        try:
+            product = _product(self.resolver(title, merchant))
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"Product lookup failed for {merchant}: {type(e).__name__}: {e}")
+            return
+        with self._lock:
+            entry = dict(self.cache.get(key) or {})
+            entry[merchant] = product
+            self.cache.set(key, entry)
+            self.found += product is not None
+
+    def _submit(self, title: str, key: str, merchant: str):
+        """Future for one lookup, shared with any identical one in flight; None if shed."""
+        with self._lock:
+            fut = self._pending.get((key, merchant))
+            if fut is not None:
+                return fut
+            if len(self._pending) >= self.max_pending:
+                self.shed += 1
+                return None
+            self.lookups += 1
+            fut = self._pending[(key, merchant)] = self._pool.submit(self._resolve, title, key, merchant)
+        fut.add_done_callback(lambda _: self._forget(key, merchant))
+        return fut
+
+    def _forget(self, key: str, merchant: str) -> None:
+        with self._lock:
+            self._pending.pop((key, merchant), None)
+
+    def enrich(self, recs: list, deadline_s: 'float | None' = None) -> tuple:
+        """(recs with "products", stats) after waiting at most `deadline_s`.
+
+        Each returned rec is a copy; those with at least one product carry
+        "products": {merchant: {"url", "price_inr"}}. deadline_s=0 answers
+        from the cache alone and leaves the lookups running for next time.
+        """
+        started = time.monotonic()
+        budget = self.deadline_s if deadline_s is None else deadline_s
+        keys: dict = {}
+        for rec in recs:
+            keys.setdefault(normalize_title(rec.get('title')), rec.get('title', ''))
+        futures, cached = [], 0
+        for key, title in keys.items():
+            entry = self.cache.get(key) or {}
+            cached += sum(m in entry for m in self.merchants)
+            for merchant in self.merchants:
+                if merchant not in entry:
+                    fut = self._submit(title, key, merchant)
+                    if fut is not None:
+                        futures.append(fut)
+        late = 0
+        if futures and budget > 0:
+            from concurrent.futures import wait
+            late = len(wait(futures, timeout=budget)[1])
+        elif futures:
+            late = sum(not f.done() for f in futures)
+
+        out, resolved = [], 0
+        for rec in recs:
+            entry = self.cache.get(normalize_title(rec.get('title'))) or {}
+            products = {m: p for m, p in entry.items() if p is not None and m in self.merchants}
+            resolved += len(products)
+            out.append({**rec, "products": products} if products else dict(rec))
+        return out, {
+            "resolved": resolved,
+            "cached": cached,
+            "looked_up": len(futures),
+            "late": late,
+            "ms": round((time.monotonic() - started) * 1000),
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "titles": len(self.cache),
+                "lookups": self.lookups,
+                "found": self.found,
+                "errors": self.errors,
+                "shed": self.shed,
+                "pending": len(self._pending),
+            }
@@ -0,0 +1,346 @@
+"""Pooled HTTP client for the Gemini REST API.
+
+urllib opens a fresh TCP + TLS connection for every request. A warm
+serverless instance (or a self-hosted process) makes many Gemini calls
+over its lifetime, so GeminiClient keeps a small LIFO pool of keep-alive
+http.client connections to the API host and reuses them across calls and
+threads:
+
+- connect and read timeouts are separate (the handshake should fail fast,
+  generation legitimately takes seconds);
+- a pooled connection the server has since closed is detected on use and
+  the request is retried once on a fresh connection;
+- connections idle longer than `idle_timeout` are dropped rather than
+  risked;
+- warm() opens one connection in the background so the first real request
+  skips DNS + TCP + TLS;
+- a forked child starts with an empty pool (pre-forked workers do not
+  share the parent's sockets);
+- with `hedge_after`, a request whose response headers have not arrived in
+  that many seconds gets a duplicate on a second connection, and whichever
+  answers first is used (the loser's connection is closed);
+- create_cached_content() / update_cached_content() manage the
+  cachedContents resources that _ctxcache.ContextCache keeps prompt
+  prefixes in, over the same pool.
+
+Construction does no I/O: the TLS context (loading the CA bundle costs tens
+of milliseconds) is built on the first connect, off the import path.
+"""
+import email.utils
+import http.client
+import json
+import os
+import queue
+import ssl
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class GeminiError(Exception):
+    """Non-200 answer from the API.
+
+    `retry_after` is the server's requested wait in seconds, from the
+    Retry-After header or the RetryInfo detail of a 429 body, else None.
+    """
+
+    def __init__(self, status: int, body: bytes, retry_after: 'float | None' = None):
+        super().__init__(f"HTTP {status}: {body[:200]!r}")
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == 429 or self.status >= 500
+
+
+def _retry_after(resp, body: bytes) -> 'float | None':
+    return parse_retry_after(resp.getheader('Retry-After'), body)
+
+
+def parse_retry_after(value: 'str | None', body: bytes) -> 'float | None':
+    """Seconds from a Retry-After header value, else from a RetryInfo body."""
+    if value:
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    # {"error": {"details": [{"@type": ".../google.rpc.RetryInfo", "retryDelay": "12s"}]}}
+    try:
+        details = json.loads(body.decode('utf-8'))['error']['details']
+        for d in details:
+            if d.get('@type', '').endswith('RetryInfo') and str(d.get('retryDelay', '')).endswith('s'):
+                return float(d['retryDelay'][:-1])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return None
+
+
+# Errors that mean "the pooled socket went stale", not "the API failed".
+_STALE = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class GeminiClient:
+    def __init__(self, model_url: str, api_key: str = '', *, pool_size: int = 8,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 idle_timeout: float = 60.0, ssl_context: 'ssl.SSLContext | None' = None):
+        """`model_url` is the :generateContent endpoint of the model."""
+        parsed = urlparse(model_url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.generate_path = parsed.path
+        self.stream_path = parsed.path.replace(':generateContent', ':streamGenerateContent')
+        # /v1beta/models/gemini-1.5-flash:generateContent -> "/v1beta", "models/gemini-1.5-flash"
+        version, _, model = parsed.path.lstrip('/').partition('/')
+        self.api_root = '/' + version
+        self.model = model.split(':', 1)[0]
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self._ssl = ssl_context
+        self._idle: list = []        # [(conn, last_used)], most recent last
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.requests_reused = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    # -- pool -----------------------------------------------------------
+
+    def _after_fork(self) -> None:
+        # A pre-forked worker must not talk over its parent's sockets.
+        idle, self._idle = self._idle, []
+        self._lock = threading.Lock()
+        for conn, _ in idle:
+            conn.close()
+
+    def _ssl_context(self) -> 'ssl.SSLContext':
+        if self._ssl is None:
+            ctx = ssl.create_default_context()
+            with self._lock:
+                if self._ssl is None:
+                    self._ssl = ctx
+        return self._ssl
+
+    def _connect(self, connect_timeout: float):
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=connect_timeout,
+                                               context=self._ssl_context())
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=connect_timeout)
+        conn.connect()
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    def _acquire(self, connect_timeout: float):
+        """Return (conn, reused). Prefers the most recently used idle conn."""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used < self.idle_timeout and conn.sock is not None:
+                    return conn, True
+                conn.close()
+        return self._connect(connect_timeout), False
+
+    def _release(self, conn) -> None:
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def warm(self) -> None:
+        """Open one pooled connection on a daemon thread."""
+        def run():
+            try:
+                self._release(self._connect(self.connect_timeout))
+            except OSError as e:
+                print(f"Gemini pre-warm failed: {e}")
+        threading.Thread(target=run, name='gemini-warm', daemon=True).start()
+
+    # -- requests -------------------------------------------------------
+
+    def _open(self, path: str, payload: dict, read_timeout: float, accept: str, method: str = 'POST'):
+        """Send a request (POST unless `method` says otherwise) and return
+        (conn, response) with headers read.
+
+        Retries once on a fresh connection if a reused one turns out stale.
+        """
+        body = json.dumps(payload).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': accept,
+            'x-goog-api-key': self.api_key,
+        }
+        connect_timeout = min(self.connect_timeout, read_timeout)
+        while True:
+            conn, reused = self._acquire(connect_timeout)
+            try:
+                conn.sock.settimeout(read_timeout)
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+            except _STALE:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if reused:
+                with self._lock:
+                    self.requests_reused += 1
+            return conn, resp
+
+    def _open_hedged(self, path: str, payload: dict, read_timeout: float, accept: str,
+                     hedge_after: 'float | None', trace: 'dict | None'):
+        """_open(), plus a duplicate request if the first is slow to answer.
+
+        The first attempt to get response headers wins; a later one closes
+        its connection as soon as it arrives. An attempt that fails leaves
+        the other to finish. `trace`, if given, gets "hedge": "won"/"lost"
+        when a duplicate was sent.
+        """
+        if not hedge_after or hedge_after >= read_timeout:
+            return self._open(path, payload, read_timeout, accept)
+
+        results = queue.SimpleQueue()
+        claim = threading.Lock()
+        winner = []
+
+        def attempt(n):
+            try:
+                conn, resp = self._open(path, payload, read_timeout, accept)
+            except Exception as e:
+                results.put((n, None, e))
+                return
+            with claim:
+                won = not winner
+                if won:
+                    winner.append(n)
+            if won:
+                results.put((n, (conn, resp), None))
+            else:
+                conn.close()
+
+        deadline = time.monotonic() + read_timeout
+        threading.Thread(target=attempt, args=(0,), daemon=True).start()
+        running, hedged = 1, False
+        wait = hedge_after
+        while True:
+            try:
+                n, opened, error = results.get(timeout=max(0.0, wait))
+            except queue.Empty:
+                if not hedged and time.monotonic() < deadline:
+                    # Primary is late: race a duplicate against it.
+                    threading.Thread(target=attempt, args=(1,), daemon=True).start()
+                    running, hedged = running + 1, True
+                    with self._lock:
+                        self.hedges_sent += 1
+                    if trace is not None:
+                        trace["hedge"] = "lost"
+                    wait = deadline - time.monotonic()
+                    continue
+                with claim:
+                    winner.append(None)   # stragglers close their connections
+                while not results.empty():
+                    _, opened, _ = results.get_nowait()
+                    if opened is not None:
+                        opened[0].close()
+                raise TimeoutError(f"no response from Gemini in {read_timeout:.1f}s")
+            if error is None:
+                if n == 1:
+                    with self._lock:
+                        self.hedges_won += 1
+                    if trace is not None:
+                        trace["hedge"] = "won"
+                return opened
+            running -= 1
+            if running == 0:
+                raise error
+            wait = deadline - time.monotonic()
+
+    def generate(self, payload: dict, timeout: 'float | None' = None, *,
+                 hedge_after: 'float | None' = None, trace: 'dict | None' = None) -> dict:
+        """POST :generateContent and return the decoded JSON body."""
+        conn, resp = self._open_hedged(self.generate_path, payload, timeout or self.read_timeout,
+                                       'application/json', hedge_after, trace)
+        return self._json(conn, resp)
+
+    def create_cached_content(self, payload: dict, timeout: 'float | None' = None) -> dict:
+        """POST cachedContents; returns the resource (name, expireTime, usageMetadata)."""
+        conn, resp = self._open(f"{self.api_root}/cachedContents", payload, timeout or self.read_timeout,
+                                'application/json')
+        return self._json(conn, resp)
+
+    def update_cached_content(self, name: str, ttl_s: float, timeout: 'float | None' = None) -> dict:
+        """PATCH a cachedContents resource's ttl (from now); returns the resource."""
+        conn, resp = self._open(f"{self.api_root}/{name}?updateMask=ttl", {"ttl": f"{int(ttl_s)}s"},
+                                timeout or self.read_timeout, 'application/json', method='PATCH')
+        return self._json(conn, resp)
+
+    def _json(self, conn, resp) -> dict:
+        """Read a response, return the connection to the pool, decode or raise GeminiError."""
+        try:
+            data = resp.read()
+        except BaseException:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        if resp.status != 200:
+            raise GeminiError(resp.status, data, _retry_after(resp, data))
+        return json.loads(data.decode('utf-8'))
+
+    def stream(self, payload: dict, timeout: 'float | None' = None, *,
+               hedge_after: 'float | None' = None, trace: 'dict | None' = None):
+        """POST :streamGenerateContent?alt=sse and yield each event dict.
+
+        The connection goes back to the pool only if the stream was read to
+        the end; abandoning the generator early closes it.
+        """
+        conn, resp = self._open_hedged(f"{self.stream_path}?alt=sse", payload, timeout or self.read_timeout,
+                                       'text/event-stream', hedge_after, trace)
+        finished = False
+        try:
+            if resp.status != 200:
+                data = resp.read()
+                raise GeminiError(resp.status, data, _retry_after(resp, data))
+            while True:
+                raw = resp.readline()
+                if not raw:
+                    finished = True
+                    break
+                line = raw.decode('utf-8').strip()
+                if line.startswith('data:'):
+                    yield json.loads(line[5:])
+        finally:
+            if finished and not resp.will_close:
+                self._release(conn)
+            else:
+                conn.close()
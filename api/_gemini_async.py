@@ -0,0 +1,185 @@
+"""asyncio client for the Gemini REST API (the self-hosted async server).
+
+GeminiClient parks a thread on every call for as long as generation takes.
+AsyncGeminiClient does the same POST on asyncio streams instead, so one
+event loop can keep thousands of calls open. It speaks just enough
+HTTP/1.1 for the API: one request per connection at a time, Content-Length
+or chunked bodies, keep-alive.
+
+Pooling follows GeminiClient: a LIFO list of idle keep-alive connections,
+at most `pool_size` of them, dropped after `idle_timeout`. A reused
+connection that turns out to have been closed by the server is retried
+once on a fresh one. A call cancelled mid-answer (deadline, shutdown)
+closes its connection instead of returning it half-read. There is no
+hedging here: a slow call costs a coroutine, not a thread, so waiting it
+out is cheap.
+
+Errors surface as _gemini.GeminiError, with retry_after, so admission
+control treats both clients alike.
+"""
+import asyncio
+import json
+import ssl
+import time
+from urllib.parse import urlparse
+
+from _gemini import GeminiError, parse_retry_after
+
+# Errors that mean "the pooled socket went stale", not "the API failed".
+_STALE = (
+    asyncio.IncompleteReadError,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class AsyncGeminiClient:
+    def __init__(self, model_url: str, api_key: str = '', *, pool_size: int = 256,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 idle_timeout: float = 60.0, ssl_context: 'ssl.SSLContext | None' = None):
+        """`model_url` is the :generateContent endpoint of the model."""
+        parsed = urlparse(model_url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        self.generate_path = parsed.path
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self._ssl = ssl_context
+        self._host_header = self.host if parsed.port is None else f"{self.host}:{parsed.port}"
+        self._idle: list = []        # [(reader, writer, last_used)], most recent last
+        self.connections_opened = 0
+        self.requests_reused = 0
+
+    # -- pool -----------------------------------------------------------
+
+    async def _connect(self):
+        if self.scheme == 'https' and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self._ssl if self.scheme == 'https' else None),
+            self.connect_timeout,
+        )
+        self.connections_opened += 1
+        return reader, writer
+
+    async def _acquire(self):
+        """Return ((reader, writer), reused). Prefers the most recently used idle conn."""
+        now = time.monotonic()
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if now - last_used < self.idle_timeout and not writer.is_closing() and not reader.at_eof():
+                return (reader, writer), True
+            writer.close()
+        return await self._connect(), False
+
+    def _release(self, conn) -> None:
+        reader, writer = conn
+        if len(self._idle) < self.pool_size:
+            self._idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for _, writer, _ in idle:
+            writer.close()
+
+    # -- requests -------------------------------------------------------
+
+    def _request_head(self, path: str, length: int) -> bytes:
+        return (
+            f"POST {path} HTTP/1.1\r\n"
+            f"Host: {self._host_header}\r\n"
+            "Content-Type: application/json\r\n"
+            "Accept: application/json\r\n"
+            f"Content-Length: {length}\r\n"
+            f"x-goog-api-key: {self.api_key}\r\n"
+            "\r\n"
+        ).encode('latin-1')
+
+    @staticmethod
+    async def _read_response(reader) -> tuple:
+        """(status, {lower-case header: value}, body, keep_alive) of one response."""
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError("connection closed before the response")
+        parts = line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise ConnectionResetError(f"bad status line {line[:80]!r}")
+        version, status = parts[0], int(parts[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0].strip() or b'0', 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass           # trailers
+                    break
+                chunks.append((await reader.readexactly(size + 2))[:-2])
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return status, headers, body, keep_alive
+
+    async def _post(self, path: str, body: bytes) -> tuple:
+        """Send a POST and return (status, headers, body).
+
+        Retries once on a fresh connection if a reused one turns out stale.
+        """
+        head = self._request_head(path, len(body))
+        while True:
+            conn, reused = await self._acquire()
+            reader, writer = conn
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                status, headers, data, keep_alive = await self._read_response(reader)
+            except _STALE:
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._release(conn)
+            else:
+                writer.close()
+            if reused:
+                self.requests_reused += 1
+            return status, headers, data
+
+    async def generate(self, payload: dict, timeout: 'float | None' = None) -> dict:
+        """POST :generateContent and return the decoded JSON body.
+
+        `timeout` bounds the whole call (connect included); on expiry
+        asyncio.TimeoutError is raised and the connection is dropped.
+        """
+        body = json.dumps(payload).encode('utf-8')
+        status, headers, data = await asyncio.wait_for(self._post(self.generate_path, body),
+                                                       timeout or self.read_timeout)
+        if status != 200:
+            raise GeminiError(status, data, parse_retry_after(headers.get('retry-after'), data))
+        return json.loads(data.decode('utf-8'))
+
+    def stats(self) -> dict:
+        return {"connections_opened": self.connections_opened, "requests_reused": self.requests_reused,
+                "idle": len(self._idle)}
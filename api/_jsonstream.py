@@ -0,0 +1,243 @@
+"""Incremental, fault-tolerant extraction of JSON from Gemini output.
+
+Gemini answers are JSON "most of the time": often wrapped in ``` fences,
+sometimes preceded or followed by a sentence of prose, and cut off
+mid-object whenever maxOutputTokens is reached. json.loads on the whole
+string loses every gift for one bad byte. JsonStream instead yields each
+complete top-level element as soon as it closes:
+
+- expect='array'  -> each object element of a top-level [...]
+- expect='object' -> each (key, value) entry of a top-level {...}
+
+It is fed text chunks (a streamed response) or one string, scans each
+character once (a regex jumps between the few characters that matter), and
+keeps only the unfinished element in its buffer. Tolerated:
+
+- anything before the container (fences, prose) or after it;
+- a bracketed aside in the prose ("[10 ideas]") that yields nothing;
+- a malformed element, which is skipped and counted in `errors`;
+- trailing commas inside an element;
+- truncation: close() rebuilds the unfinished last element from its
+  longest valid prefix, so {"r2": [gift, gift, {"title": "X", "pri
+  still gives r2 its complete gifts, and an element that only lacks its
+  closers ({"title": "X") is kept whole.
+"""
+import json
+import re
+
+_SPECIAL = re.compile(r'["\[\]{},]')
+_STRING_END = re.compile(r'["\\]')
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+_CLOSER = {'[': ']', '{': '}'}
+# Cut points tried when rebuilding a truncated element, newest first.
+_REPAIR_TRIES = 8
+
+
+def _loads(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(_TRAILING_COMMA.sub(r'\1', text))
+    except json.JSONDecodeError:
+        return None
+
+
+def repair(text: str):
+    """Longest valid prefix of truncated JSON `text`, closed; None if none.
+
+    The whole text is tried first (closing a string it ends inside, then
+    the open containers), then cut back to the latest commas and brackets.
+    """
+    stack, cuts = [], []
+    in_string = False
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if in_string:
+            if ch == '\\':
+                i += 2
+                continue
+            if ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '[{':
+            stack.append(ch)
+            cuts.append((i + 1, tuple(stack)))
+        elif ch in ']}':
+            if stack:
+                stack.pop()
+            cuts.append((i + 1, tuple(stack)))
+        elif ch == ',':
+            cuts.append((i, tuple(stack)))
+        i += 1
+    # i > n: the text ends on a lone backslash, which the closing quote
+    # must not follow.
+    whole = (text[:n - (i > n)] + '"') if in_string else text
+    candidates = [(whole, tuple(stack))] + [(text[:cut], open_) for cut, open_ in reversed(cuts[-_REPAIR_TRIES:])]
+    for prefix, open_ in candidates:
+        value = _loads(prefix + ''.join(_CLOSER[c] for c in reversed(open_)))
+        if value is not None and value != {}:
+            return value
+    return None
+
+
+class JsonStream:
+    """Push parser for one top-level JSON array or object; see module doc."""
+
+    def __init__(self, expect: str = 'array'):
+        if expect not in ('array', 'object'):
+            raise ValueError(f"expect must be 'array' or 'object', not {expect!r}")
+        self.expect = expect
+        self._open = '[' if expect == 'array' else '{'
+        self._buf = ''
+        self._pos = 0          # next char to scan
+        self._start = 0        # start of the current element
+        self._depth = 0        # 0 = still looking for the container
+        self._in_string = False
+        self.count = 0         # elements / entries yielded
+        self.errors = 0        # malformed elements skipped
+        self.truncated = False
+        self.done = False
+
+    def _emit(self, text: str, out: list) -> None:
+        text = text.strip()
+        if not text:
+            return            # empty container or trailing comma
+        if self.expect == 'array':
+            value = _loads(text)
+            if isinstance(value, dict) and value:
+                out.append(value)
+                self.count += 1
+            else:
+                self.errors += 1
+        else:
+            value = _loads('{' + text + '}')
+            if isinstance(value, dict) and value:
+                out.extend(value.items())
+                self.count += len(value)
+            else:
+                self.errors += 1
+
+    def feed(self, chunk: str) -> list:
+        """Add text; return the elements (or entries) completed by it."""
+        out: list = []
+        if self.done or not chunk:
+            return out
+        buf = self._buf + chunk
+        pos = self._pos
+        errors_at_open = self.errors
+        while True:
+            if self._in_string:
+                m = _STRING_END.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                if m.group() == '\\':
+                    if m.end() >= len(buf):
+                        pos = m.start()   # escape split across chunks
+                        break
+                    pos = m.end() + 1
+                    continue
+                self._in_string = False
+                pos = m.end()
+                continue
+            if self._depth == 0:
+                i = buf.find(self._open, pos)
+                if i < 0:
+                    pos = len(buf)
+                    break
+                self._depth, self._start, pos = 1, i + 1, i + 1
+                errors_at_open = self.errors
+                continue
+            m = _SPECIAL.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            ch, pos = m.group(), m.end()
+            if ch == '"':
+                self._in_string = True
+            elif ch in '[{':
+                self._depth += 1
+            elif ch in ']}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(buf[self._start:pos - 1], out)
+                    if self.count:
+                        self.done = True
+                        break
+                    # Nothing usable inside: a bracketed aside in prose,
+                    # not an error. Keep looking for the real container.
+                    self.errors = errors_at_open
+            elif ch == ',' and self._depth == 1:
+                self._emit(buf[self._start:pos - 1], out)
+                self._start = pos
+        # Keep only the unfinished element so the buffer stays small.
+        if self._depth:
+            cut, self._start = self._start, 0
+        else:
+            cut = pos
+        self._buf = buf[cut:]
+        self._pos = pos - cut
+        return out
+
+    def close(self) -> list:
+        """End of input: recover what a truncated final element still holds."""
+        out: list = []
+        if self.done or self._depth == 0:
+            self.done = True
+            return out
+        self.done = self.truncated = True
+        tail = self._buf[self._start:].strip()
+        if not tail:
+            return out
+        value = repair(tail if self.expect == 'array' else '{' + tail)
+        if self.expect == 'array':
+            if isinstance(value, dict) and value:
+                out.append(value)
+                self.count += 1
+        elif isinstance(value, dict):
+            out.extend(value.items())
+            self.count += len(value)
+        return out
+
+
+def _report(stream: JsonStream, label: str, stats: 'dict | None') -> None:
+    if stats is not None:
+        stats["parse_errors"] = stats.get("parse_errors", 0) + stream.errors + stream.truncated
+    if stream.errors or stream.truncated:
+        print(f"{label} JSON: {stream.count} usable, {stream.errors} malformed skipped"
+              f"{', truncated tail recovered' if stream.truncated else ''}")
+
+
+def iter_array(chunks, label: str = 'stream', stats: 'dict | None' = None):
+    """Yield each object of a streamed JSON array as soon as it closes.
+
+    `stats`, if given, accumulates "parse_errors" (skipped elements plus a
+    repaired tail), as do the parse_* helpers.
+    """
+    stream = JsonStream('array')
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+        if stream.done:
+            break
+    yield from stream.close()
+    _report(stream, label, stats)
+
+
+def parse_array(text: str, label: str = 'response', stats: 'dict | None' = None) -> list:
+    """Every recoverable object element of the JSON array in `text`."""
+    stream = JsonStream('array')
+    items = stream.feed(text or '') + stream.close()
+    _report(stream, label, stats)
+    return items
+
+
+def parse_object(text: str, label: str = 'response', stats: 'dict | None' = None) -> dict:
+    """Every recoverable entry of the JSON object in `text`."""
+    stream = JsonStream('object')
+    entries = stream.feed(text or '') + stream.close()
+    _report(stream, label, stats)
+    return dict(entries)
@@ -0,0 +1,120 @@
+"""Purchase-link builder: merchant search URLs with affiliate wrapping.
+
+Every recommendation carries one search URL per merchant, and popular
+titles come back request after request. LinkBuilder does the URL work
+once per process instead of once per link:
+
+- each merchant template ("https://www.amazon.in/s?k={q}") is split
+  around {q} at construction, with the affiliate decision already applied
+  to the fixed parts: the Amazon tag appended, or the whole URL routed
+  through the Cuelinks redirect. quote_plus works character by character,
+  so the redirect's `url=` parameter is the quoted prefix, the title
+  quoted twice and the quoted suffix;
+- a title is then quote_plus'd at most twice, and each link is one
+  concatenation;
+- the finished purchase_links dict is memoized per title in a bounded LRU.
+
+The merchant set is configuration: PURCHASE_MERCHANTS is either a comma
+list choosing from (and ordering) MERCHANTS, or a JSON object
+{"name": "template with {q}"}. The frontend only renders the names it
+knows.
+"""
+import json
+import threading
+from collections import OrderedDict
+from urllib.parse import quote_plus, urlparse
+
+MERCHANTS = {
+    "amazon": "https://www.amazon.in/s?k={q}",
+    "flipkart": "https://www.flipkart.com/search?q={q}",
+    "myntra": "https://www.myntra.com/{q}",
+    "shoppersstop": "https://www.shoppersstop.com/search?q={q}",
+    "blinkit": "https://blinkit.com/s/?q={q}",
+    "meesho": "https://www.meesho.com/search?q={q}",
+}
+
+# Merchants that have no public affiliate program -> always pass-through.
+NO_AFFILIATE_MERCHANTS = frozenset({'blinkit', 'zepto', 'instamart', 'swiggy'})
+
+_CUELINKS = "https://linksredirect.com/?cid={cid}&source=linkkit&url="
+
+
+def is_amazon_in(url: str) -> bool:
+    """amazon.in or a subdomain; rejects lookalikes (myamazonshop.in, amazonaws.com)."""
+    try:
+        host = urlparse(url).netloc.lower()
+    except (ValueError, AttributeError):
+        return False
+    return host == 'amazon.in' or host.endswith('.amazon.in')
+
+
+def merchants_from_env(value: str) -> dict:
+    """PURCHASE_MERCHANTS -> {name: template}; empty or invalid -> MERCHANTS."""
+    value = (value or '').strip()
+    if not value:
+        return dict(MERCHANTS)
+    if value.startswith('{'):
+        try:
+            merchants = json.loads(value)
+        except json.JSONDecodeError as e:
+            print(f"PURCHASE_MERCHANTS is not valid JSON ({e}); using the default merchants")
+            return dict(MERCHANTS)
+        bad = [k for k, v in merchants.items() if not isinstance(v, str) or v.count('{q}') != 1]
+        for name in bad:
+            print(f"PURCHASE_MERCHANTS: template for {name!r} needs exactly one {{q}}; skipped")
+        return {k: v for k, v in merchants.items() if k not in bad} or dict(MERCHANTS)
+    names = [n.strip().lower() for n in value.split(',') if n.strip()]
+    unknown = [n for n in names if n not in MERCHANTS]
+    if unknown:
+        print(f"PURCHASE_MERCHANTS: unknown merchants {unknown} skipped")
+    return {n: MERCHANTS[n] for n in names if n in MERCHANTS} or dict(MERCHANTS)
+
+
+class LinkBuilder:
+    def __init__(self, merchants: 'dict | None' = None, *, amazon_tag: str = '', cuelinks_cid: str = '',
+                 maxsize: int = 2048):
+        """`merchants` maps name -> URL template with one {q} (default MERCHANTS)."""
+        self.merchants = dict(MERCHANTS if merchants is None else merchants)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._memo: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # [(name, prefix, suffix, quoted_twice)], compiled once.
+        self._parts = []
+        for name, template in self.merchants.items():
+            prefix, suffix = template.split('{q}', 1)
+            key = name.lower()
+            twice = False
+            if key in NO_AFFILIATE_MERCHANTS:
+                pass
+            elif key == 'amazon':
+                if amazon_tag and is_amazon_in(template):
+                    suffix += f"{'&' if '?' in template else '?'}tag={quote_plus(amazon_tag)}"
+            elif cuelinks_cid:
+                prefix = _CUELINKS.format(cid=quote_plus(cuelinks_cid)) + quote_plus(prefix)
+                suffix = quote_plus(suffix)
+                twice = True
+            self._parts.append((name, prefix, suffix, twice))
+
+    def build(self, title: str) -> dict:
+        """purchase_links for `title`, affiliate-wrapped, bypassing the memo."""
+        q = quote_plus(title)
+        qq = quote_plus(q) if any(p[3] for p in self._parts) else q
+        return {name: prefix + (qq if twice else q) + suffix for name, prefix, suffix, twice in self._parts}
+
+    def links(self, title: str) -> dict:
+        """Memoized build(); returns a fresh dict the caller may keep."""
+        with self._lock:
+            links = self._memo.get(title)
+            if links is not None:
+                self._memo.move_to_end(title)
+                self.hits += 1
+                return dict(links)
+            self.misses += 1
+        links = self.build(title)
+        with self._lock:
+            self._memo[title] = links
+            if len(self._memo) > self.maxsize:
+                self._memo.popitem(last=False)
+        return dict(links)
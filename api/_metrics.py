@@ -0,0 +1,59 @@
+"""In-process metrics for comparing generation modes.
+
+ModeMetrics keeps, per mode (e.g. "single" / "dual"), counters plus a
+sliding window of recent latencies, so an A/B split can be judged on the
+same instance that served it: latency percentiles, tokens per request and
+how often Gemini's answer needed repair or yielded nothing. Numbers are per
+process; aggregate across instances from the logs.
+"""
+import threading
+from collections import deque
+
+
+class ModeMetrics:
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._modes: dict = {}
+
+    def _mode(self, mode: str) -> dict:
+        stats = self._modes.get(mode)
+        if stats is None:
+            stats = self._modes[mode] = {
+                "requests": 0,
+                "failures": 0,         # Gemini gave nothing usable
+                "parse_issues": 0,     # malformed elements skipped or tail repaired
+                "prompt_tokens": 0,
+                "output_tokens": 0,
+                "latencies": deque(maxlen=self.window),
+            }
+        return stats
+
+    def record(self, mode: str, *, latency_ms: float, ok: bool, parse_issues: int = 0,
+               prompt_tokens: int = 0, output_tokens: int = 0) -> None:
+        with self._lock:
+            stats = self._mode(mode)
+            stats["requests"] += 1
+            stats["failures"] += not ok
+            stats["parse_issues"] += bool(parse_issues)
+            stats["prompt_tokens"] += prompt_tokens
+            stats["output_tokens"] += output_tokens
+            stats["latencies"].append(latency_ms)
+
+    def snapshot(self) -> dict:
+        """{mode: summary} with rates and per-request means."""
+        out = {}
+        with self._lock:
+            for mode, s in self._modes.items():
+                n = s["requests"]
+                lat = sorted(s["latencies"])
+                out[mode] = {
+                    "requests": n,
+                    "latency_ms_p50": round(lat[len(lat) // 2]) if lat else None,
+                    "latency_ms_p95": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))]) if lat else None,
+                    "prompt_tokens_avg": round(s["prompt_tokens"] / n) if n else 0,
+                    "output_tokens_avg": round(s["output_tokens"] / n) if n else 0,
+                    "parse_issue_rate": round(s["parse_issues"] / n, 3) if n else 0.0,
+                    "failure_rate": round(s["failures"] / n, 3) if n else 0.0,
+                }
+        return out
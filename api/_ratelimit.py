@@ -0,0 +1,313 @@
+"""Quota-aware admission control for Gemini calls.
+
+Gemini enforces per-minute request (RPM) and token (TPM) quotas per
+project. Overrunning them costs a 429 after a full round trip, and during a
+festival spike every request pays that before falling back. Admission
+decides before the call instead:
+
+- go: a local TokenBucket per quota (refilling at quota/60 per second)
+  has room, and so does the shared per-minute window, if one is
+  configured;
+- queue: no room yet, but room appears within `max_wait` (a few hundred
+  ms). acquire() sleeps and retries;
+- fallback: otherwise. The caller serves the rule-based catalog at once.
+
+Counting tokens before the call uses an estimate (prompt length plus
+maxOutputTokens). settle() corrects it with the answer's usageMetadata.
+
+The shared window counts every instance's calls in the current minute. It
+lives in a file (file:///tmp/gemini-quota.json; processes on one host), a
+shared-memory segment (shm:///name; same, without the file rewrite) or a
+Redis-compatible server (redis://host:port; tools/resp_standin.py works
+locally). An unreachable backend admits: a broken counter must not turn
+Gemini off.
+
+backoff() handles a 429 or 5xx that gets through anyway. It follows
+Retry-After, or Gemini's RetryInfo.retryDelay, when the error has one.
+Otherwise it waits an exponential delay with full jitter. Until the delay
+expires, acquire() queues or refuses like any other shortage, so one 429
+stops the whole instance from piling on.
+"""
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens/second, at most `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def wait_for(self, n: float, now: float) -> float:
+        """Seconds until `n` tokens are available (0 if they are now)."""
+        self._refill(now)
+        n = min(n, self.capacity)
+        return 0.0 if self.level >= n else (n - self.level) / self.rate
+
+    def take(self, n: float) -> None:
+        self.level -= n    # may go negative after settle(); refill catches up
+
+    def give(self, n: float) -> None:
+        self.level = min(self.capacity, self.level + n)
+
+
+class FileCounter:
+    """Counters in a small JSON file, serialized with flock.
+
+    Shared by every process on the host (a pre-forked server, several
+    `vercel dev` workers). Not for network filesystems.
+    """
+
+    def __init__(self, path: str):
+        import fcntl
+        self._flock = fcntl.flock
+        self._LOCK_EX = fcntl.LOCK_EX
+        self.path = path
+        self._lock = threading.Lock()
+
+    def incr(self, key: str, amount: int, ttl: int) -> int:
+        now = time.time()
+        with self._lock, open(self.path, 'a+', encoding='utf-8') as f:
+            self._flock(f, self._LOCK_EX)     # released on close
+            f.seek(0)
+            try:
+                data = json.loads(f.read() or '{}')
+            except json.JSONDecodeError:
+                data = {}
+            data = {k: v for k, v in data.items() if v[1] > now}
+            value = data.get(key, (0, 0))[0] + amount
+            data[key] = (value, now + ttl)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(data))
+        return value
+
+
+class RedisCounter:
+    """INCRBY + EXPIRE on a Redis-compatible server."""
+
+    def __init__(self, store):
+        self.store = store     # _cache.RedisStore
+
+    def incr(self, key: str, amount: int, ttl: int) -> int:
+        value = self.store.command('INCRBY', key, str(amount))
+        if value == amount:
+            self.store.command('EXPIRE', key, str(ttl))
+        return value
+
+
+def open_counter(url: str):
+    """Shared counter from a URL; '' means none (local buckets only).
+
+    file:///path/to/quota.json  |  redis://host:port/db  |  shm:///name
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'shm':
+        from _cache import open_shm
+        return open_shm(url)           # ShmStore.incr
+    if parsed.scheme == 'file':
+        return FileCounter(parsed.path or os.path.join('/tmp', 'gemini-quota.json'))
+    if parsed.scheme == 'redis':
+        from _cache import RedisStore
+        db = int(parsed.path.lstrip('/') or 0)
+        return RedisCounter(RedisStore(parsed.hostname or '127.0.0.1', parsed.port or 6379, db=db))
+    raise ValueError(f"unsupported quota counter url: {url}")
+
+
+class AdmissionController:
+    def __init__(self, rpm: int = 0, tpm: int = 0, *, counter=None, max_wait: float = 0.5,
+                 burst: float = 0.2, backoff_base: float = 1.0, backoff_cap: float = 30.0,
+                 prefix: str = 'gemini', local_share: float = 1.0):
+        """`rpm` / `tpm` are the quotas (0 = unlimited); `counter` shares them.
+
+        Each local bucket banks at most `burst` of a minute's quota, so one
+        instance cannot spend the whole minute in its first second. With
+        `local_share` < 1 (one of N pre-forked workers) the local buckets
+        get that fraction of each quota; the shared window still counts
+        the whole.
+        """
+        self.rpm, self.tpm = rpm, tpm
+        self.counter = counter
+        self.max_wait = max_wait
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.prefix = prefix
+        self._requests = TokenBucket(rpm * local_share / 60, max(1.0, rpm * burst * local_share)) if rpm else None
+        self._tokens = TokenBucket(tpm * local_share / 60, max(1.0, tpm * burst * local_share)) if tpm else None
+        self._lock = threading.Lock()
+        self._cooldown_until = 0.0
+        self._failures = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.backoffs = 0
+        self.counter_errors = 0
+
+    # -- local ----------------------------------------------------------
+
+    def _local_wait(self, tokens: int, now: float) -> float:
+        """Seconds until the call may go; takes from the buckets if 0."""
+        wait = max(0.0, self._cooldown_until - now)
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_for(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_for(tokens, now))
+        if wait == 0.0:
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None:
+                self._tokens.take(tokens)
+        return wait
+
+    def _local_refund(self, tokens: int) -> None:
+        with self._lock:
+            if self._requests is not None:
+                self._requests.give(1)
+            if self._tokens is not None:
+                self._tokens.give(tokens)
+
+    # -- shared ---------------------------------------------------------
+
+    def _window(self) -> tuple:
+        """(key suffix, seconds left) of the current minute."""
+        now = time.time()
+        minute = int(now // 60)
+        return str(minute), (minute + 1) * 60 - now
+
+    def _shared_wait(self, tokens: int) -> float:
+        """Count the call in this minute's window; seconds to wait if over."""
+        if self.counter is None or not (self.rpm or self.tpm):
+            return 0.0
+        window, left = self._window()
+        counted = []
+        try:
+            for name, amount, limit in (('rpm', 1, self.rpm), ('tpm', tokens, self.tpm)):
+                if not limit:
+                    continue
+                key = f"{self.prefix}:{name}:{window}"
+                total = self.counter.incr(key, amount, 120)
+                counted.append((key, amount))
+                if total > limit:
+                    for k, a in counted:
+                        self.counter.incr(k, -a, 120)
+                    return left
+        except Exception as e:
+            self.counter_errors += 1
+            print(f"quota counter error: {type(e).__name__}: {e}")
+        return 0.0
+
+    # -- API ------------------------------------------------------------
+
+    def acquire(self, tokens: int = 0, max_wait: 'float | None' = None) -> bool:
+        """Admit one call of ~`tokens` tokens, queueing up to `max_wait` s.
+
+        Returns False when the caller should fall back instead.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        give_up = time.monotonic() + max(0.0, max_wait)
+        waited = False
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                wait = self._local_wait(tokens, now)
+            if wait == 0.0:
+                wait = self._shared_wait(tokens)
+                if wait == 0.0:
+                    with self._lock:
+                        self.admitted += 1
+                        self.queued += waited
+                    return True
+                self._local_refund(tokens)
+            if now + wait > give_up:
+                with self._lock:
+                    self.rejected += 1
+                return False
+            # A little jitter so queued callers do not all wake together.
+            time.sleep(wait * random.uniform(1.0, 1.2))
+            waited = True
+
+    async def acquire_async(self, tokens: int = 0, max_wait: 'float | None' = None) -> bool:
+        """acquire() for asyncio code: queues with asyncio.sleep.
+
+        A shared counter is consulted on a worker thread, so a slow Redis
+        or a contended flock does not stall the event loop.
+        """
+        import asyncio
+        max_wait = self.max_wait if max_wait is None else max_wait
+        give_up = time.monotonic() + max(0.0, max_wait)
+        waited = False
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                wait = self._local_wait(tokens, now)
+            if wait == 0.0:
+                wait = await asyncio.to_thread(self._shared_wait, tokens) if self.counter is not None else 0.0
+                if wait == 0.0:
+                    with self._lock:
+                        self.admitted += 1
+                        self.queued += waited
+                    return True
+                self._local_refund(tokens)
+            if now + wait > give_up:
+                with self._lock:
+                    self.rejected += 1
+                return False
+            await asyncio.sleep(wait * random.uniform(1.0, 1.2))
+            waited = True
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Correct a call's token count once usageMetadata is known."""
+        diff = actual - estimated
+        if not diff or not self.tpm:
+            return
+        with self._lock:
+            if self._tokens is not None:
+                if diff > 0:
+                    self._tokens.take(diff)
+                else:
+                    self._tokens.give(-diff)
+        if self.counter is not None:
+            try:
+                self.counter.incr(f"{self.prefix}:tpm:{self._window()[0]}", diff, 120)
+            except Exception as e:
+                self.counter_errors += 1
+                print(f"quota counter error: {type(e).__name__}: {e}")
+
+    def success(self) -> None:
+        self._failures = 0
+
+    def backoff(self, retry_after: 'float | None' = None) -> float:
+        """Record a 429 / 5xx; returns the cooldown now in force (seconds)."""
+        with self._lock:
+            self._failures += 1
+            self.backoffs += 1
+            if retry_after is None:
+                # Exponential with full jitter.
+                ceiling = min(self.backoff_cap, self.backoff_base * 2 ** (self._failures - 1))
+                retry_after = random.uniform(0, ceiling)
+            until = time.monotonic() + retry_after
+            self._cooldown_until = max(self._cooldown_until, until)
+            return self._cooldown_until - time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "backoffs": self.backoffs,
+            "counter_errors": self.counter_errors,
+            "cooldown_s": round(max(0.0, self._cooldown_until - time.monotonic()), 3),
+        }
@@ -0,0 +1,48 @@
+"""Run request logic written once for both the threaded and the asyncio server.
+
+recommend.py's orchestration (Gemini admission and retries, the LLM-1 /
+LLM-2 stages, single-flight, cache lookups, the deadline race) is the same
+on Vercel and on the async server; only how each wait is done differs. So
+it is written as generators that yield their I/O as ('op', *args) tuples
+and get each result back (or the exception, raised at the yield). A table
+{op: callable} says how to do each one: run() calls them, arun() awaits
+them.
+
+    def steps(key):
+        value = yield ('cache_get', key)
+        return value or 'default'
+
+    run(steps('k'), {'cache_get': CACHE.get})
+    await arun(steps('k'), {'cache_get': acache_get})
+
+Steps compose with `yield from`. An op's exception, cancellation
+included, is thrown into the generator, so its `finally` blocks run.
+"""
+
+
+def run(steps, ops: dict):
+    """Drive `steps` to completion, calling ops[op](*args) for each I/O step."""
+    value = error = None
+    while True:
+        try:
+            op = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = ops[op[0]](*op[1:]), None
+        except BaseException as e:
+            value, error = None, e
+
+
+async def arun(steps, ops: dict):
+    """run() for coroutine ops: awaits ops[op](*args) for each I/O step."""
+    value = error = None
+    while True:
+        try:
+            op = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = await ops[op[0]](*op[1:]), None
+        except BaseException as e:
+            value, error = None, e
@@ -0,0 +1,188 @@
+"""Per-request stage timings, Server-Timing headers and a sampling profiler.
+
+A handler creates a Timings for each request and activates it for the
+work it does (a thread, or an asyncio task: the current Timings is a
+context variable). From then on, anything below it can record a stage
+without being handed an object:
+
+    with span('llm1'):
+        ...
+
+    @timed('fallback')
+    def get_fallback_recommendations(...):
+
+Spans are inclusive and add up per name, so a stage that runs twice
+(three LLM-2 batches) reports its total and count. With no active Timings
+a span costs one context-variable lookup. Work handed to another thread
+carries the request's Timings along via bind(fn); asyncio tasks and
+asyncio.to_thread() inherit it.
+
+Timings.header() renders the Server-Timing value, e.g.
+`llm1;dur=812.4, llm2;dur=640.1, total;dur=1490.2`, which browser devtools
+show under the request's Timing tab.
+
+Profiling: with RECOMMEND_PROFILE set to a sampling rate (0.01 = 1% of
+requests), a sampled request runs a SamplingProfiler. A daemon thread
+snapshots every thread's stack each RECOMMEND_PROFILE_INTERVAL_MS
+(default 5) and counts collapsed stacks ("mod:func;mod:func", the
+flamegraph.pl input format). It is a statistical profiler, with no
+per-call hooks, so it is cheap enough for production. Concurrent requests
+in the same process show up in each other's samples.
+"""
+import contextvars
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_current: contextvars.ContextVar = contextvars.ContextVar('timings', default=None)
+
+
+class Timings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: dict = {}      # name -> [total seconds, count]
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [seconds, 1]
+            else:
+                stage[0] += seconds
+                stage[1] += 1
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def as_dict(self) -> dict:
+        """{name: ms} plus "total"; stages seen more than once also get "<name>_n"."""
+        with self._lock:
+            stages = list(self.stages.items())
+        out = {}
+        for name, (seconds, count) in stages:
+            out[name] = round(seconds * 1000, 1)
+            if count > 1:
+                out[f"{name}_n"] = count
+        out["total"] = round(self.elapsed_ms(), 1)
+        return out
+
+    def header(self) -> str:
+        """Server-Timing header value."""
+        with self._lock:
+            stages = list(self.stages.items())
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, (seconds, _) in stages]
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ', '.join(parts)
+
+
+def current() -> 'Timings | None':
+    return _current.get()
+
+
+@contextmanager
+def activate(timings: 'Timings | None'):
+    """Make `timings` the current Timings of this thread or task for the block."""
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str):
+    """Time the block into the current Timings, if any."""
+    timings = current()
+    if timings is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - t0)
+
+
+def timed(name: str):
+    """Decorator form of span()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def bind(fn):
+    """`fn` wrapped to run with the caller's current Timings (for threads)."""
+    timings = current()
+    if timings is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with activate(timings):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class SamplingProfiler:
+    """Stack sampler over all threads; see module docstring."""
+
+    def __init__(self, interval: float = 0.005, depth: int = 40):
+        self.interval = interval
+        self.depth = depth
+        self.samples = 0
+        self.stacks: dict = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _collapse(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.depth:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            names.append(f"{module}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = self._collapse(frame)
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def start(self) -> 'SamplingProfiler':
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def top(self, n: int = 15) -> list:
+        """[(collapsed stack, samples)] for the `n` most sampled stacks."""
+        return sorted(self.stacks.items(), key=lambda kv: -kv[1])[:n]
+
+
+PROFILE_RATE = float(os.environ.get('RECOMMEND_PROFILE', '0') or 0)
+_PROFILE_INTERVAL_S = float(os.environ.get('RECOMMEND_PROFILE_INTERVAL_MS', '5')) / 1000
+
+
+def maybe_profile() -> 'SamplingProfiler | None':
+    """A started profiler for a RECOMMEND_PROFILE-sampled request, else None."""
+    if PROFILE_RATE <= 0 or random.random() >= PROFILE_RATE:
+        return None
+    return SamplingProfiler(_PROFILE_INTERVAL_S).start()
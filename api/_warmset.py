@@ -0,0 +1,123 @@
+"""Precomputed recommendations for the hot profiles of a festival season.
+
+Around each big occasion a few hundred relationship x occasion x age_group
+x vibe x budget-band profiles make up most of the traffic.
+tools/build_warmset.py generates AI recommendations for them offline and
+writes them to one artifact. The handler serves a matching request from
+the artifact without calling Gemini.
+
+The artifact is gzip'd JSON:
+
+    {"format": 1, "version": "20261018T0930Z-3f9a1c2e", "generated_at": <epoch>,
+     "expires_at": <epoch>, "catalog_sha256": "...", "model": "...",
+     "entries": {"<_cache_key>": {"profile": [...], "recs": [...]}}}
+
+Entries are keyed by recommend._cache_key(), so a lookup is a dict hit.
+Recommendations are stored without purchase_links, which are rebuilt from
+the title on the way out, so a few hundred profiles stay well under a
+megabyte. Nothing here runs at import (gzip included); the artifact is
+read on the first cache miss. Past `expires_at` the artifact is ignored: stale festival picks
+should fall through to live generation, not linger.
+"""
+import hashlib
+import json
+import os
+import time
+
+FORMAT_VERSION = 1
+DEFAULT_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+                                             'warm_set.json.gz'))
+
+_WARM_SET = None
+_LOADED = False
+
+
+class WarmSet:
+    def __init__(self, entries: dict, *, version: str = '', generated_at: float = 0.0,
+                 expires_at: float = 0.0, path: str = '', meta: 'dict | None' = None):
+        self.entries = entries
+        self.version = version
+        self.generated_at = generated_at
+        self.expires_at = expires_at
+        self.path = path
+        self.meta = meta or {}
+        self.hits = 0
+
+    @classmethod
+    def open(cls, path: str) -> 'WarmSet':
+        import gzip
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            doc = json.load(f)
+        if doc.get('format') != FORMAT_VERSION:
+            raise ValueError(f"{path}: warm set format {doc.get('format')!r}, expected {FORMAT_VERSION}")
+        meta = {k: v for k, v in doc.items() if k not in ('entries', 'format', 'version', 'generated_at', 'expires_at')}
+        return cls(doc.get('entries') or {}, version=doc.get('version', ''),
+                   generated_at=float(doc.get('generated_at') or 0), expires_at=float(doc.get('expires_at') or 0),
+                   path=path, meta=meta)
+
+    def fresh(self, now: 'float | None' = None) -> bool:
+        return (time.time() if now is None else now) < self.expires_at
+
+    def get(self, key: str) -> 'tuple | None':
+        """(recs, freshness meta) for `key` while the artifact is fresh, else None."""
+        now = time.time()
+        if not self.fresh(now):
+            return None
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.hits += 1
+        return entry["recs"], {
+            "version": self.version,
+            "age_s": round(now - self.generated_at),
+            "expires_in_s": round(self.expires_at - now),
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def write(path: str, entries: dict, *, ttl: float, meta: 'dict | None' = None) -> dict:
+    """Write an artifact for {key: {"profile", "recs"}}; returns its header."""
+    import gzip
+    now = time.time()
+    compact = {
+        key: {"profile": e["profile"], "recs": [{k: v for k, v in r.items() if k != 'purchase_links'} for r in e["recs"]]}
+        for key, e in sorted(entries.items())
+    }
+    body = json.dumps(compact, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    header = {
+        "format": FORMAT_VERSION,
+        "version": time.strftime('%Y%m%dT%H%MZ', time.gmtime(now)) + '-'
+                   + hashlib.sha256(body.encode('utf-8')).hexdigest()[:8],
+        "generated_at": round(now),
+        "expires_at": round(now + ttl),
+        **(meta or {}),
+    }
+    tmp = f"{path}.tmp"
+    with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=9) as f:
+        f.write(json.dumps(header, ensure_ascii=False, separators=(',', ':'))[:-1])
+        f.write(',"entries":' + body + '}')
+    os.replace(tmp, path)
+    return header
+
+
+def get_warm_set() -> 'WarmSet | None':
+    """Process-wide warm set, loaded on first use; None if there is none.
+
+    WARM_SET_PATH overrides the default data/warm_set.json.gz. A missing
+    or unreadable artifact just means every miss goes to Gemini.
+    """
+    global _WARM_SET, _LOADED
+    if not _LOADED:
+        path = os.environ.get('WARM_SET_PATH') or DEFAULT_PATH
+        if os.path.exists(path):
+            try:
+                _WARM_SET = WarmSet.open(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"warm set {path} not loaded: {type(e).__name__}: {e}")
+            else:
+                if not _WARM_SET.fresh():
+                    print(f"warm set {_WARM_SET.version} expired; ignoring it")
+        _LOADED = True
+    return _WARM_SET
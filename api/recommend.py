@@ -1,15 +1,177 @@
 from http.server import BaseHTTPRequestHandler
+import base64
+import hashlib
 import json
 import random
 import os
-import urllib.request
-import urllib.error
-from urllib.parse import quote_plus, urlparse
+import sys
+import threading
+import time
+import zlib
+import string
+from urllib.parse import parse_qs, quote, quote_plus, urlencode, urlparse
+
+# Vercel loads this file by path; make the private _*.py helpers beside it
+# importable (underscore files are not deployed as their own functions).
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _cache import ResponseCache, SingleFlight, open_store  # noqa: E402
+from _catalog import get_catalog  # noqa: E402
+from _ctxcache import ContextCache  # noqa: E402
+from _enrich import LinkEnricher, resolver_from_url  # noqa: E402
+from _gemini import GeminiClient, GeminiError  # noqa: E402
+from _jsonstream import iter_array, parse_array, parse_object  # noqa: E402
+from _links import NO_AFFILIATE_MERCHANTS, LinkBuilder, is_amazon_in, merchants_from_env  # noqa: E402
+from _metrics import ModeMetrics  # noqa: E402
+from _ratelimit import AdmissionController, open_counter  # noqa: E402
+from _steps import run  # noqa: E402
+from _warmset import get_warm_set  # noqa: E402
+from _timing import Timings, activate, bind, current as current_timings, maybe_profile, span, timed  # noqa: E402
 
 
 # Gemini API Configuration
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+GEMINI_API_URL = os.environ.get(
+    'GEMINI_API_URL',
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent",
+)
+
+# One pooled keep-alive client per process, shared by all threads and warm
+# invocations. Pre-warmed at import so the first request skips the handshake.
+GEMINI = GeminiClient(
+    GEMINI_API_URL,
+    GEMINI_API_KEY,
+    connect_timeout=float(os.environ.get('GEMINI_CONNECT_TIMEOUT', '5')),
+    read_timeout=float(os.environ.get('GEMINI_READ_TIMEOUT', '30')),
+)
+if GEMINI_API_KEY:
+    GEMINI.warm()
+
+# Admission control against the project's Gemini quotas (see _ratelimit).
+# A call that cannot get quota within GEMINI_QUEUE_MS is not made and the
+# request falls back at once. GEMINI_QUOTA_URL shares the per-minute counts
+# between instances: file:///tmp/gemini-quota.json, shm:///name or
+# redis://host:port. RECOMMEND_WORKERS (set by serve.py --workers) splits
+# the local buckets between pre-forked workers.
+# GEMINI_RETRIES: retries of a 429 / 5xx, if the backoff fits the timeout.
+ADMISSION = AdmissionController(
+    rpm=int(os.environ.get('GEMINI_RPM', '0')),
+    tpm=int(os.environ.get('GEMINI_TPM', '0')),
+    counter=open_counter(os.environ.get('GEMINI_QUOTA_URL', '')),
+    max_wait=float(os.environ.get('GEMINI_QUEUE_MS', '500')) / 1000,
+    local_share=1 / max(1, int(os.environ.get('RECOMMEND_WORKERS', '1'))),
+)
+GEMINI_RETRIES = int(os.environ.get('GEMINI_RETRIES', '1'))
+
+# Pipelined mode: stream LLM-1 and start LLM-2 on batches of parsed gifts
+# while the rest of the array is still being generated. Both stages share
+# one deadline instead of 30s each.
+GEMINI_PIPELINE = os.environ.get('GEMINI_PIPELINE', '') == '1'
+_PIPELINE_DEADLINE_S = float(os.environ.get('GEMINI_PIPELINE_DEADLINE', '30'))
+_PIPELINE_BATCH = max(1, int(os.environ.get('GEMINI_PIPELINE_BATCH', '5')))
+
+# Overall latency budget for one /api/recommend answer. Generation runs in
+# the background; whatever is ready at the deadline is served (LLM-1 gifts
+# without LLM-2 reasons, or the rule-based fallback) and a late AI result
+# still lands in the cache for the next request.
+RECOMMEND_DEADLINE_S = float(os.environ.get('RECOMMEND_DEADLINE', '20'))
+# Hedged LLM-1 calls: if Gemini has not answered (response headers) within
+# this many seconds, send a duplicate and use whichever answers first.
+# Costs a second generation when it fires, so it is off unless set; a value
+# near the observed p95 time-to-first-byte keeps that to ~5% of calls.
+GEMINI_HEDGE_AFTER_S = float(os.environ.get('GEMINI_HEDGE_AFTER', '0')) or None
+
+# Structured output: send responseMimeType=application/json plus a
+# responseSchema, so Gemini's answer is constrained JSON and the prompts can
+# drop their format instructions and examples.
+GEMINI_STRUCTURED = os.environ.get('GEMINI_STRUCTURED', '') == '1'
+
+_GIFT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING", "description": "specific product, brand or experience"},
+        "gift_type": {"type": "STRING", "enum": ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"]},
+        "description": {"type": "STRING", "description": "why it suits this person"},
+        "price": {"type": "INTEGER", "description": "INR"},
+        "icon": {"type": "STRING", "description": "one emoji"},
+    },
+    "required": ["title", "gift_type", "description", "price", "icon"],
+    "propertyOrdering": ["title", "gift_type", "description", "price", "icon"],
+}
+GIFTS_SCHEMA = {"type": "ARRAY", "items": _GIFT_SCHEMA}
+# Schemas cannot express a map with free-form keys, so LLM-2 returns pairs.
+REASONS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"title": {"type": "STRING"}, "reason": {"type": "STRING"}},
+        "required": ["title", "reason"],
+        "propertyOrdering": ["title", "reason"],
+    },
+}
+
+# Single-pass mode: one call returns the gifts *and* LLM-2's personalized
+# reasons. GEMINI_SINGLE_PASS is the percentage of profiles that get it
+# (0 = dual-LLM only, 100 = single-pass only); a request can pick with
+# "mode": "single" | "dual". Split by profile hash, so a profile stays in
+# one arm; single-pass sets are cached under their own key (_mode_key), so
+# a cached answer always matches the mode the request resolved to.
+GEMINI_SINGLE_PASS_PCT = max(0, min(100, int(os.environ.get('GEMINI_SINGLE_PASS', '0'))))
+_SINGLE_PASS_MAX_TOKENS = 3072   # ten reasons add ~500 tokens to LLM-1's answer
+SINGLE_PASS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        **_GIFT_SCHEMA,
+        "properties": {**_GIFT_SCHEMA["properties"],
+                       "reasons": {"type": "STRING", "description": "2-3 personal reasons joined with ' • '"}},
+        "required": _GIFT_SCHEMA["required"] + ["reasons"],
+        "propertyOrdering": _GIFT_SCHEMA["propertyOrdering"] + ["reasons"],
+    },
+}
+# Latency, tokens and parse trouble per mode, for comparing the two arms.
+MODE_METRICS = ModeMetrics()
+
+# Token spend per stage, from each answer's usageMetadata.
+TOKEN_USAGE: dict = {}
+_USAGE_LOCK = threading.Lock()
+
+# Context caching (see _ctxcache): with GEMINI_CONTEXT_CACHE=1 each prompt
+# kind's fixed instructions live in a cachedContents resource, kept for
+# GEMINI_CONTEXT_CACHE_TTL seconds and renewed GEMINI_CONTEXT_CACHE_REFRESH
+# seconds before it runs out; calls send only the recipient section.
+# Gemini refuses to cache less than a per-model minimum of tokens, so with
+# short instructions every create fails (and is retried every 10 minutes)
+# while calls go out whole as before. CONTEXT_METRICS compares call latency
+# per stage with and without the cache.
+CONTEXT_CACHE = ContextCache(
+    GEMINI,
+    ttl=float(os.environ.get('GEMINI_CONTEXT_CACHE_TTL', '3600')),
+    refresh_before=float(os.environ.get('GEMINI_CONTEXT_CACHE_REFRESH', '300')),
+) if GEMINI_API_KEY and os.environ.get('GEMINI_CONTEXT_CACHE', '') == '1' else None
+CONTEXT_METRICS = ModeMetrics()
+
+
+# Response cache: AI recommendation sets keyed on the normalized request.
+# RECOMMEND_CACHE_URL adds a shared tier: sqlite:///path, redis://host:port or
+# shm:///name (shared memory, for workers on one host)
+RESPONSE_CACHE = ResponseCache(
+    maxsize=int(os.environ.get('RECOMMEND_CACHE_SIZE', '512')),
+    ttl=float(os.environ.get('RECOMMEND_CACHE_TTL', str(6 * 3600))),
+    shared=open_store(os.environ.get('RECOMMEND_CACHE_URL', ''),
+                      ttl=float(os.environ.get('RECOMMEND_CACHE_TTL', str(6 * 3600)))),
+)
+
+# Identical cache misses in flight at the same time share one Gemini call.
+INFLIGHT = SingleFlight()
+
+# Budget bands for cache keys: 100, 125, 160, 200, 250, 320, ... per decade.
+_BAND_STEPS = (100, 125, 160, 200, 250, 320, 400, 500, 640, 800)
+
+# "More ideas" pages (get_more_recommendations): gifts per page, and how many
+# already-shown titles a continuation token carries (the oldest drop off).
+MORE_COUNT = max(1, min(10, int(os.environ.get('RECOMMEND_MORE_COUNT', '5'))))
+_MORE_MAX_SHOWN = 40
+_PROFILE_FIELDS = ('relationship', 'occasion', 'age_group', 'vibe', 'budget', 'gender', 'notes', 'gift_types', 'city')
 
 
 # Affiliate program IDs (set in Vercel env). Any unset key -> raw URL.
@@ -18,8 +180,32 @@ GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini
 AMAZON_AFFILIATE_TAG = os.environ.get('AMAZON_AFFILIATE_TAG', '')
 CUELINKS_CID         = os.environ.get('CUELINKS_CID', '')
 
-# Merchants that have no public affiliate program -> always pass-through.
-_NO_AFFILIATE_MERCHANTS = {'blinkit', 'zepto', 'instamart', 'swiggy'}
+# purchase_links per title, from precompiled merchant templates (see _links).
+# PURCHASE_MERCHANTS picks the merchant set: "amazon,flipkart,blinkit" or a
+# JSON object {"name": "https://.../search?q={q}"}.
+_MERCHANTS = merchants_from_env(os.environ.get('PURCHASE_MERCHANTS', ''))
+_LINKS_CACHE_SIZE = int(os.environ.get('PURCHASE_LINKS_CACHE_SIZE', '2048'))
+# Unwrapped search URLs, as stored in cached recommendations...
+SEARCH_LINKS = LinkBuilder(_MERCHANTS, maxsize=_LINKS_CACHE_SIZE)
+# ...and what leaves the process, with this deployment's affiliate IDs.
+PURCHASE_LINKS = LinkBuilder(_MERCHANTS, amazon_tag=AMAZON_AFFILIATE_TAG, cuelinks_cid=CUELINKS_CID,
+                             maxsize=_LINKS_CACHE_SIZE)
+
+# Product pages instead of search pages (see _enrich). PRODUCT_RESOLVER_URL
+# picks the resolver: stub://?latency_ms=40&miss=0.2 or an http(s) lookup
+# service; unset, links stay search URLs. An AI answer waits at most
+# PRODUCT_RESOLVER_DEADLINE seconds for its lookups, which run
+# PRODUCT_RESOLVER_WORKERS at a time; results are kept per title for
+# PRODUCT_CACHE_TTL seconds.
+_RESOLVER = resolver_from_url(os.environ.get('PRODUCT_RESOLVER_URL', ''))
+LINK_ENRICHER = LinkEnricher(
+    _RESOLVER,
+    _MERCHANTS,
+    workers=int(os.environ.get('PRODUCT_RESOLVER_WORKERS', '16')),
+    deadline_s=float(os.environ.get('PRODUCT_RESOLVER_DEADLINE', '0.25')),
+    ttl=float(os.environ.get('PRODUCT_CACHE_TTL', str(6 * 3600))),
+    maxsize=int(os.environ.get('PRODUCT_CACHE_SIZE', '4096')),
+) if _RESOLVER else None
 
 # Server-side input caps -- protect against prompt-injection-via-bloat
 # and runaway token spend. Match or exceed the client-side maxlength.
@@ -38,12 +224,7 @@ def _add_amazon_tag(url: str) -> str:
     """Append Associates tag only to genuine amazon.in URLs."""
     if not AMAZON_AFFILIATE_TAG or not isinstance(url, str):
         return url
-    try:
-        host = urlparse(url).netloc.lower()
-    except (ValueError, AttributeError):
-        return url
-    # Match amazon.in and its subdomains; reject lookalikes (myamazonshop.in, amazonaws.com)
-    if host != 'amazon.in' and not host.endswith('.amazon.in'):
+    if not is_amazon_in(url):
         return url
     sep = '&' if '?' in url else '?'
     return f"{url}{sep}tag={quote_plus(AMAZON_AFFILIATE_TAG)}"
@@ -59,6 +240,7 @@ def _wrap_cuelinks(url: str) -> str:
     )
 
 
+@timed('links')
 def add_affiliate_tags(links: dict) -> dict:
     """Apply affiliate wrapping to outbound links where we have programs.
 
@@ -66,6 +248,9 @@ def add_affiliate_tags(links: dict) -> dict:
     - Amazon  -> direct tag append (preserves recognizable URL).
     - Other supported merchants -> Cuelinks if configured.
     - Quick commerce -> untouched (no affiliate programs exist).
+
+    For links of arbitrary shape; the builders' own links go through
+    PURCHASE_LINKS, which applies the same rules at compile time.
     """
     if not links:
         return links
@@ -76,7 +261,7 @@ def add_affiliate_tags(links: dict) -> dict:
             out[merchant] = url
             continue
         merchant_key = merchant.lower()
-        if merchant_key in _NO_AFFILIATE_MERCHANTS:
+        if merchant_key in NO_AFFILIATE_MERCHANTS:
             out[merchant] = url
         elif merchant_key == 'amazon':
             out[merchant] = _add_amazon_tag(url)
@@ -87,6 +272,7 @@ def add_affiliate_tags(links: dict) -> dict:
     return out
 
 
+@timed('sanitize')
 def _sanitize_inputs(data: dict) -> dict:
     """Coerce + truncate user-submitted fields before they hit the prompt.
 
@@ -114,62 +300,344 @@ def _sanitize_inputs(data: dict) -> dict:
         out['gift_types'] = [t for t in raw_types if isinstance(t, str) and t in valid_tags] or None
     else:
         out['gift_types'] = None
+
+    # mode: A/B override for the generation mode; anything else is ignored
+    mode = data.get('mode')
+    out['mode'] = mode if mode in ('single', 'dual') else ''
     return out
 
 
-def call_gemini(prompt, max_tokens=2048):
-    """Call Gemini API and return the response text."""
-    if not GEMINI_API_KEY:
+def _request_args(clean: dict) -> tuple:
+    """Positional get_recommendations() args for a sanitized payload, with defaults."""
+    return (
+        clean['relationship'] or 'Friend',
+        clean['occasion'] or 'Birthday',
+        clean['age_group'] or 'Adult',
+        clean['vibe'] or 'Traditional',
+        clean['budget'],
+        clean['gender'],
+        clean['notes'],
+        clean['gift_types'],
+        clean.get('city', ''),
+    )
+
+
+def _budget_band(budget: int) -> int:
+    """Round a budget down to its band floor (~20% wide bands)."""
+    scale = 1
+    while budget >= 1000 * scale:
+        scale *= 10
+    return max((step * scale for step in _BAND_STEPS if step * scale <= budget), default=budget)
+
+
+def _norm(val) -> str:
+    return ' '.join(str(val or '').lower().split())
+
+
+def _cache_key(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="") -> str:
+    """Stable key for a sanitized request: case/whitespace-folded, budget banded."""
+    types = ','.join(sorted(set(gift_types))) if gift_types and len(set(gift_types)) < 6 else '*'
+    raw = '|'.join([
+        _norm(relationship), _norm(occasion), _norm(age_group), _norm(vibe),
+        str(_budget_band(budget)), _norm(gender), types, _norm(notes), _norm(city),
+    ])
+    return 'rec:v1:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def _more_key(key, exclude, count) -> str:
+    """Cache / single-flight key for a continuation page of `key`."""
+    raw = json.dumps([sorted({_norm(t) for t in exclude}), count])
+    return key + ':more:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _warm_profile(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="") -> 'list | None':
+    """[relationship, occasion, age_group, vibe, band, gender] for requests the
+    warm set can serve (no notes, no city, all gift types), else None.
+
+    Logged per request so tools/build_warmset.py can rank profiles by demand.
+    """
+    if notes or city or (gift_types and len(set(gift_types)) < 6):
         return None
+    return [_norm(relationship), _norm(occasion), _norm(age_group), _norm(vibe), _budget_band(budget), _norm(gender)]
 
-    try:
-        url = f"{GEMINI_API_URL}?key={GEMINI_API_KEY}"
-        data = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {
-                "temperature": 0.7,
-                "maxOutputTokens": max_tokens,
-            }
+
+def _personalization_key(gifts, relationship, occasion, age_group, gender, notes) -> str:
+    """Single-flight key for LLM-2: the recipient plus the exact titles."""
+    titles = [g.get('title', '') for g in gifts[:10]]
+    raw = json.dumps([_norm(relationship), _norm(occasion), _norm(age_group), _norm(gender), _norm(notes), titles])
+    return 'llm2:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def _gemini_body(prompt, max_tokens, schema=None, use_cache=True):
+    """Request body; a _Prompt whose instructions are in CONTEXT_CACHE sends
+    only its context, plus the cachedContent reference."""
+    config = {
+        "temperature": 0.7,
+        "maxOutputTokens": max_tokens,
+    }
+    if schema is not None:
+        config["responseMimeType"] = "application/json"
+        config["responseSchema"] = schema
+    cached = None
+    if use_cache and CONTEXT_CACHE is not None and isinstance(prompt, _Prompt):
+        cached = CONTEXT_CACHE.lookup(prompt.instructions)
+    if cached:
+        return {
+            "cachedContent": cached,
+            "contents": [{"role": "user", "parts": [{"text": prompt.context}]}],
+            "generationConfig": config,
         }
+    return {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": config,
+    }
 
-        req = urllib.request.Request(
-            url,
-            data=json.dumps(data).encode('utf-8'),
-            headers={'Content-Type': 'application/json'},
-            method='POST'
-        )
 
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            if 'candidates' in result and len(result['candidates']) > 0:
-                return result['candidates'][0]['content']['parts'][0]['text']
-    except Exception as e:
-        print(f"Gemini API error: {e}")
+def _cache_rejected(body, error) -> bool:
+    """A call made through a cachedContent the API no longer has (expired or
+    deleted): forget it, so the caller can resend in full."""
+    if 'cachedContent' not in body or error.retryable:
+        return False
+    CONTEXT_CACHE.invalidate(body['cachedContent'])
+    return True
+
+
+def _record_usage(stage, usage, trace=None):
+    """Add one answer's usageMetadata to TOKEN_USAGE and the request trace.
+
+    cachedContentTokenCount (prompt tokens served from CONTEXT_CACHE, the
+    ones not resent) is counted as "cached" where it is non-zero.
+    """
+    if not usage:
+        return
+    prompt_tokens = int(usage.get('promptTokenCount') or 0)
+    output_tokens = int(usage.get('candidatesTokenCount') or 0)
+    cached_tokens = int(usage.get('cachedContentTokenCount') or 0)
+    with _USAGE_LOCK:
+        totals = TOKEN_USAGE.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "output_tokens": 0})
+        totals["calls"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["output_tokens"] += output_tokens
+        if cached_tokens:
+            totals["cached_tokens"] = totals.get("cached_tokens", 0) + cached_tokens
+        if trace is not None:
+            tokens = trace.setdefault("tokens", {"prompt": 0, "output": 0})
+            tokens["prompt"] += prompt_tokens
+            tokens["output"] += output_tokens
+            if cached_tokens:
+                tokens["cached"] = tokens.get("cached", 0) + cached_tokens
+
+
+def _record_context(stage, body, latency_s, usage):
+    """One finished call into CONTEXT_METRICS, as "<stage>/cached" or "<stage>/full"."""
+    if CONTEXT_CACHE is None:
+        return
+    CONTEXT_METRICS.record(
+        f"{stage}/{'cached' if 'cachedContent' in body else 'full'}",
+        latency_ms=latency_s * 1000, ok=True,
+        prompt_tokens=int((usage or {}).get('promptTokenCount') or 0),
+        output_tokens=int((usage or {}).get('candidatesTokenCount') or 0),
+    )
+
+
+def _admit(prompt, max_tokens, trace, max_wait=None):
+    """ADMISSION.acquire() for one call; returns its token estimate, or None."""
+    estimate = _estimate(prompt, max_tokens)
+    if ADMISSION.acquire(estimate, max_wait):
+        return estimate
+    _not_admitted(trace)
     return None
 
 
-def get_ai_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city=""):
-    """LLM-1: Generate gift recommendations using Gemini."""
+def _estimate(prompt, max_tokens) -> int:
+    return len(prompt) // 4 + max_tokens
 
-    gender_text = f", gender: {gender}" if gender else ""
-    notes_text = f"\nSpecial notes from user: {notes}" if notes else ""
-    city_text = f"\nBuyer's city: {city} (suggest same-day delivery options from Blinkit/Zepto where relevant)" if city else ""
 
-    # Build preference hints from gift_types but don't restrict
-    style_hints = ""
-    if gift_types and len(gift_types) < 6:
-        style_hints = f"\nUser prefers these styles: {', '.join(gift_types)} (but feel free to suggest others if they fit better)"
+def _not_admitted(trace):
+    print("Gemini call not admitted (quota or backoff); falling back")
+    if trace is not None:
+        trace["admission"] = "rejected"
 
-    prompt = f"""You are a creative Indian gift consultant who stays updated with the latest trends, viral products, and what's popular right now in {occasion} gifting.
 
-Context:
-- Recipient: {relationship}
-- Occasion: {occasion}
-- Age Group: {age_group}{gender_text}
-- Style/Vibe they like: {vibe}
-- Budget: Rs.{budget:,} INR{notes_text}{city_text}{style_hints}
+def _settle(estimate, usage):
+    if usage:
+        ADMISSION.settle(estimate, int(usage.get('promptTokenCount') or 0)
+                         + int(usage.get('candidatesTokenCount') or 0))
+
+
+def call_gemini(prompt, max_tokens=2048, timeout=None, hedge_after=None, trace=None, schema=None, stage='gemini'):
+    """Call Gemini API and return the response text.
+
+    `timeout` is the read timeout; the connect timeout is fixed by GEMINI.
+    `hedge_after` / `trace` are passed through to GeminiClient.generate();
+    `schema` turns on structured output. Token usage and the call's
+    duration (a _timing span) are recorded under `stage`.
+
+    The call first needs ADMISSION; None comes back at once if it is not
+    admitted. A 429 / 5xx starts a backoff, and is retried up to
+    GEMINI_RETRIES times while the backoff still fits in `timeout`.
+    """
+    return run(_gemini_call(prompt, max_tokens, timeout, hedge_after, trace, schema, stage), _OPS)
+
+
+def _gemini_call(prompt, max_tokens=2048, timeout=None, hedge_after=None, trace=None, schema=None, stage='gemini'):
+    """call_gemini() as _steps: yields 'admit', 'generate' and 'settle'."""
+    if not GEMINI_API_KEY:
+        return None
+    with span(stage):
+        deadline = time.monotonic() + (timeout or GEMINI.read_timeout)
+        max_wait = None
+        use_cache = True
+        attempt = 0
+        while attempt <= GEMINI_RETRIES:
+            estimate = _estimate(prompt, max_tokens)
+            if not (yield ('admit', estimate, max_wait)):
+                _not_admitted(trace)
+                return None
+            body = _gemini_body(prompt, max_tokens, schema, use_cache)
+            started = time.monotonic()
+            try:
+                result = yield ('generate', body, max(0.1, deadline - time.monotonic()), hedge_after, trace)
+            except GeminiError as e:
+                print(f"Gemini API error: {e}")
+                if _cache_rejected(body, e):
+                    yield ('settle', estimate, 0)
+                    use_cache = False          # same call again, whole; not a retry
+                    continue
+                if not e.retryable:
+                    return None
+                attempt += 1
+                yield ('settle', estimate, 0)     # rejected calls spend no tokens
+                cooldown = ADMISSION.backoff(e.retry_after)
+                # Retry only if the wait leaves the call a fair part of its budget.
+                max_wait = cooldown + 0.05
+                if deadline - time.monotonic() - cooldown < 1.0:
+                    return None
+                continue
+            except Exception as e:
+                print(f"Gemini API error: {type(e).__name__}: {e}")
+                return None
+            ADMISSION.success()
+            usage = result.get('usageMetadata')
+            if usage:
+                yield ('settle', estimate, int(usage.get('promptTokenCount') or 0)
+                       + int(usage.get('candidatesTokenCount') or 0))
+            _record_usage(stage, usage, trace)
+            _record_context(stage, body, time.monotonic() - started, usage)
+            try:
+                if 'candidates' in result and len(result['candidates']) > 0:
+                    return result['candidates'][0]['content']['parts'][0]['text']
+            except (KeyError, IndexError, TypeError) as e:
+                print(f"Gemini API error: {e}")
+            return None
+    return None
+
+
+def call_gemini_stream(prompt, max_tokens=2048, deadline=None, hedge_after=None, trace=None, schema=None,
+                       stage='gemini'):
+    """Stream Gemini output over SSE, yielding text fragments as they arrive.
 
-Generate exactly 10 UNIQUE and CREATIVE gift recommendations. Think about:
+    Stops quietly on errors or once `deadline` (a time.monotonic() value)
+    has passed; callers decide what to do with a short stream. Each event
+    carries the running usageMetadata; the last one seen is recorded.
+    Admission as for call_gemini(); a 429 / 5xx starts the backoff but is
+    not retried.
+    """
+    if not GEMINI_API_KEY:
+        return
+    if deadline is None:
+        deadline = time.monotonic() + GEMINI.read_timeout
+    estimate = _admit(prompt, max_tokens, trace)
+    if estimate is None:
+        return
+
+    usage = first_event = None
+    t0 = time.perf_counter()
+    timings = current_timings()
+    body = _gemini_body(prompt, max_tokens, schema)
+    try:
+        timeout = max(0.1, deadline - time.monotonic())
+        for event in GEMINI.stream(body, timeout=timeout, hedge_after=hedge_after, trace=trace):
+            if first_event is None:
+                first_event = time.perf_counter() - t0
+            usage = event.get('usageMetadata') or usage
+            if time.monotonic() > deadline:
+                print("Gemini stream deadline exceeded")
+                return
+            for cand in event.get('candidates', [])[:1]:
+                for part in cand.get('content', {}).get('parts', []):
+                    if part.get('text'):
+                        yield part['text']
+        ADMISSION.success()
+    except GeminiError as e:
+        print(f"Gemini stream error: {e}")
+        if e.retryable:
+            ADMISSION.backoff(e.retry_after)
+        _cache_rejected(body, e)     # not resent: the caller has its deadline
+    except Exception as e:
+        print(f"Gemini stream error: {e}")
+    finally:
+        if timings is not None:
+            # Wall time of the stream, consumer pauses between chunks included.
+            timings.add(stage, time.perf_counter() - t0)
+        _settle(estimate, usage)
+        _record_usage(stage, usage, trace)
+        if first_event is not None:
+            # Time to the first event: what a cached prefix can shorten.
+            _record_context(stage, body, first_event, usage)
+
+
+def _usable_gift(gift: dict) -> bool:
+    """A parsed LLM-1 element is worth showing if it at least names a gift."""
+    title = gift.get('title')
+    return isinstance(title, str) and bool(title.strip())
+
+
+def _clamp_price(gift: dict, budget: int) -> dict:
+    """Coerce the LLM's price to an int within (0, budget]."""
+    try:
+        p = int(float(gift.get('price', budget)))
+    except (TypeError, ValueError):
+        p = budget
+    gift['price'] = min(p if p > 0 else budget, budget)
+    return gift
+
+
+class _Prompt(str):
+    """A prompt in two parts: `instructions`, fixed for every request of its
+    kind, then `context`, the request's own recipient section.
+
+    As a str it is the whole prompt (both parts, in that order).
+    _gemini_body() sends only `context` when CONTEXT_CACHE holds the
+    instructions.
+    """
+
+    def __new__(cls, instructions: str, context: str):
+        self = super().__new__(cls, f"{instructions}\n\n{context}")
+        self.instructions = instructions
+        self.context = context
+        return self
+
+
+_REASONS_RULE = ('\n\nFor each gift also write "reasons": 2-3 short, punchy, personal reasons joined with " • " '
+                 'why the recipient will love it ("Your mom will love..."). Sound like a friend, not a sales pitch; '
+                 'mention the occasion and connect to the notes if any.')
+
+
+def _recommendation_instructions(single_pass=False) -> str:
+    """LLM-1's fixed instructions; the recipient comes after them."""
+    reasons_rule = _REASONS_RULE if single_pass else ""
+    if GEMINI_STRUCTURED:
+        # Output shape comes from GIFTS_SCHEMA; only the judgement calls stay.
+        return f"""You are a creative Indian gift consultant who knows what is trending in India right now.
+
+Suggest the number of unique gifts asked for below, each from a different category: trending products, experiences, personalized, tech, artisanal Indian brands, wellness. Be specific ("Noise ColorFit Pro 4 Smartwatch", not "Watch"); everything must be purchasable in India now. Every price must be <= the budget; aim for 50-100% of it.{reasons_rule}"""
+
+    reasons_field = ',\n    "reasons": "Reason 1 • Reason 2 • Reason 3"' if single_pass else ''
+
+    return f"""You are a creative Indian gift consultant who stays updated with the latest trends, viral products, and what's popular right now in Indian gifting.
+
+Below you will find the recipient, the occasion, their budget and how many gift recommendations to make. Think about:
 - What's trending right now in India for this occasion
 - Popular brands and products that are currently in demand
 - Unique experiential gifts (subscriptions, experiences, classes)
@@ -192,200 +660,328 @@ For each gift, provide in this EXACT JSON format (no markdown, just pure JSON ar
     "gift_type": "Formal|Funky|Romantic|Practical|Traditional|Luxury",
     "description": "Why this specific gift is perfect for them - be personal and specific",
     "price": 1500,
-    "icon": "emoji"
+    "icon": "emoji"{reasons_field}
   }}
 ]
 
 Requirements:
 - All gifts must be easily purchasable in India
-- STRICT BUDGET RULE: Every gift price MUST be less than or equal to Rs.{budget:,}. DO NOT suggest anything above this amount.
+- STRICT BUDGET RULE: Every gift price MUST be less than or equal to the budget. DO NOT suggest anything above this amount.
 - Aim for prices between 50%-100% of budget so there is room for taxes/delivery
 - Make each suggestion UNIQUE - no two gifts should be from the same category
-- Be specific with product names/types, not generic
+- Be specific with product names/types, not generic{reasons_rule}
 
 Return ONLY the JSON array, no other text."""
 
-    response = call_gemini(prompt, max_tokens=2048)
-    if response:
-        try:
-            # Clean up response - remove markdown code blocks if present
-            cleaned = response.strip()
-            if cleaned.startswith('```'):
-                cleaned = cleaned.split('\n', 1)[1] if '\n' in cleaned else cleaned[3:]
-            if cleaned.endswith('```'):
-                cleaned = cleaned.rsplit('```', 1)[0]
-            cleaned = cleaned.strip()
-            if cleaned.startswith('json'):
-                cleaned = cleaned[4:].strip()
-
-            gifts = json.loads(cleaned)
-            if isinstance(gifts, list) and len(gifts) > 0:
-                for g in gifts:
-                    try:
-                        p = int(float(g.get('price', budget)))
-                    except (TypeError, ValueError):
-                        p = budget
-                    g['price'] = min(p if p > 0 else budget, budget)
-                return gifts
-        except json.JSONDecodeError as e:
-            print(f"JSON parse error: {e}")
-    return None
 
+def _recommendation_prompt(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="",
+                           single_pass=False, count=10, exclude=()) -> _Prompt:
+    gender_text = f", gender: {gender}" if gender else ""
+    notes_text = f"\nSpecial notes from user: {notes}" if notes else ""
+    city_text = f"\nBuyer's city: {city} (suggest same-day delivery options from Blinkit/Zepto where relevant)" if city else ""
 
-def get_ai_personalization(gifts, relationship, occasion, age_group, gender, notes):
-    """LLM-2: Add personalized reasoning for each gift using Gemini."""
+    # Build preference hints from gift_types but don't restrict
+    style_hints = ""
+    if gift_types and len(gift_types) < 6:
+        style_hints = f"\nUser prefers these styles: {', '.join(gift_types)} (but feel free to suggest others if they fit better)"
+    # A "more ideas" page: the titles the user has already seen.
+    if exclude:
+        style_hints += f"\nAlready suggested (do not repeat these or close variants): {json.dumps(list(exclude), ensure_ascii=False)}"
 
-    gift_titles = [g.get('title', '') for g in gifts[:10]]
-    gender_text = f", {gender}" if gender else ""
-    notes_text = f"\nUser's note about them: {notes}" if notes else ""
+    if GEMINI_STRUCTURED:
+        context = f"""- Recipient: {relationship}
+- Occasion: {occasion}
+- Age Group: {age_group}{gender_text}
+- Style/Vibe they like: {vibe}
+- Budget: Rs.{budget:,} INR{notes_text}{city_text}{style_hints}
+
+Suggest exactly {count} gifts; every price <= Rs.{budget:,}."""
+    else:
+        context = f"""Context:
+- Recipient: {relationship}
+- Occasion: {occasion}
+- Age Group: {age_group}{gender_text}
+- Style/Vibe they like: {vibe}
+- Budget: Rs.{budget:,} INR{notes_text}{city_text}{style_hints}
 
-    prompt = f"""You are a thoughtful gift advisor. For each gift below, write a SHORT, PERSONAL reason why it's perfect for this specific person. Make it feel like advice from a friend, not a sales pitch.
+Generate exactly {count} UNIQUE and CREATIVE gift recommendations. Every price MUST be <= Rs.{budget:,}."""
+    return _Prompt(_recommendation_instructions(single_pass), context)
 
-Recipient: {relationship} ({age_group}{gender_text})
-Occasion: {occasion}{notes_text}
 
-Gifts:
-{json.dumps(gift_titles, indent=2)}
+def get_ai_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="", trace=None,
+                           exclude=(), count=10):
+    """LLM-1: Generate gift recommendations using Gemini (hedged if configured).
+
+    With `exclude` (a "more ideas" page) it asks for `count` gifts that are
+    not among those titles, with an output budget scaled to match.
+    """
+    return run(_llm1_call(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city, trace,
+                          exclude, count), _OPS)
+
+
+def _llm1_call(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="", trace=None,
+               exclude=(), count=10):
+    """get_ai_recommendations() as _steps."""
+    prompt = _recommendation_prompt(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city,
+                                    count=count, exclude=exclude)
+
+    response = yield from _gemini_call(prompt, max_tokens=max(512, 2048 * count // 10),
+                                       hedge_after=GEMINI_HEDGE_AFTER_S, trace=trace,
+                                       schema=GIFTS_SCHEMA if GEMINI_STRUCTURED else None, stage='llm1')
+    gifts = _parse_gifts(response, budget, 'LLM-1', trace)
+    if exclude:
+        gifts = _unseen(gifts, exclude)[:count]
+    return gifts or None
+
+
+def _unseen(gifts, exclude) -> list:
+    """Gifts whose titles are neither in `exclude` nor repeated, case/space-folded."""
+    seen = {_norm(t) for t in exclude}
+    out = []
+    for g in gifts:
+        title = _norm(g['title'])
+        if title not in seen:
+            seen.add(title)
+            out.append(g)
+    return out
+
+
+def _parse_gifts(response, budget, label, trace=None) -> list:
+    """Usable, budget-clamped gifts from an LLM-1 / single-pass answer."""
+    # Element-wise parse: a truncated or partly malformed answer still
+    # yields every complete gift instead of none.
+    with span('parse'):
+        return [_clamp_price(g, budget) for g in parse_array(response, label, trace) if _usable_gift(g)]
+
+
+def _single_pass_reasons(gift) -> dict:
+    reasons = gift.get('reasons')
+    return {gift['title']: reasons} if isinstance(reasons, str) and reasons.strip() else {}
+
+
+def _split_single_pass(gifts) -> tuple:
+    """Single-pass gifts -> (gifts, {title: reasons}), None for empty."""
+    reasons = {}
+    for g in gifts:
+        reasons.update(_single_pass_reasons(g))
+    return (gifts or None), (reasons or None)
+
+
+def get_single_pass_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="",
+                                    trace=None):
+    """LLM-1 and LLM-2 in one call; returns (gifts, {title: reasons})."""
+    return run(_single_pass_call(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city,
+                                 trace), _OPS)
+
+
+def _single_pass_call(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="", trace=None):
+    """get_single_pass_recommendations() as _steps."""
+    prompt = _recommendation_prompt(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city,
+                                    single_pass=True)
+
+    response = yield from _gemini_call(prompt, max_tokens=_SINGLE_PASS_MAX_TOKENS, hedge_after=GEMINI_HEDGE_AFTER_S,
+                                       trace=trace, schema=SINGLE_PASS_SCHEMA if GEMINI_STRUCTURED else None,
+                                       stage='single')
+    return _split_single_pass(_parse_gifts(response, budget, 'single-pass', trace))
+
+
+def iter_single_pass_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types,
+                                     city="", deadline=None, trace=None):
+    """Streamed single-pass call: ('gift', g) then ('reasons', {title: r}) per gift."""
+    prompt = _recommendation_prompt(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city,
+                                    single_pass=True)
+    stream = call_gemini_stream(prompt, max_tokens=_SINGLE_PASS_MAX_TOKENS, deadline=deadline,
+                                hedge_after=GEMINI_HEDGE_AFTER_S, trace=trace,
+                                schema=SINGLE_PASS_SCHEMA if GEMINI_STRUCTURED else None, stage='single')
+    count = 0
+    for gift in iter_array(stream, 'single-pass stream', trace):
+        if not _usable_gift(gift):
+            continue
+        count += 1
+        yield 'gift', _clamp_price(gift, budget)
+        reasons = _single_pass_reasons(gift)
+        if reasons:
+            yield 'reasons', reasons
+        if count >= 10:
+            break
+
+
+def _personalization_instructions() -> str:
+    """LLM-2's fixed instructions; the recipient and gift titles come after them."""
+    if GEMINI_STRUCTURED:
+        return """For each gift, write 2-3 short, punchy, personal reasons (joined with " • ") why it suits this person. Sound like a friend, not a sales pitch; mention the occasion and connect to the note if any. Use each title exactly as given."""
+
+    return """You are a thoughtful gift advisor. For each gift listed below, write a SHORT, PERSONAL reason why it's perfect for this specific person. Make it feel like advice from a friend, not a sales pitch.
 
 For each gift, write 2-3 short, punchy reasons joined with " • ". Be specific to their situation:
-- Reference their relationship naturally ("Your {relationship.lower()} will love...")
+- Reference their relationship naturally ("Your sister will love...")
 - Mention something specific about the occasion
 - If notes provided, connect to their interests/personality
 - Keep it warm and personal, not generic
 
-Return as JSON object with gift titles as keys:
-{{
+Return as JSON object with gift titles as keys, each title exactly as given:
+{
   "Gift Name 1": "Reason 1 • Reason 2 • Reason 3",
   "Gift Name 2": "Reason 1 • Reason 2"
-}}
+}
 
 Return ONLY the JSON object, no other text."""
 
-    response = call_gemini(prompt, max_tokens=1500)
-    if response:
-        try:
-            cleaned = response.strip()
-            if cleaned.startswith('```'):
-                cleaned = cleaned.split('\n', 1)[1] if '\n' in cleaned else cleaned[3:]
-            if cleaned.endswith('```'):
-                cleaned = cleaned.rsplit('```', 1)[0]
-            cleaned = cleaned.strip()
-            if cleaned.startswith('json'):
-                cleaned = cleaned[4:].strip()
-
-            reasons = json.loads(cleaned)
-            if isinstance(reasons, dict):
-                return reasons
-        except json.JSONDecodeError as e:
-            print(f"JSON parse error in personalization: {e}")
-    return None
 
+def _personalization_prompt(gifts, relationship, occasion, age_group, gender, notes) -> _Prompt:
+    gift_titles = [g.get('title', '') for g in gifts[:10]]
+    gender_text = f", {gender}" if gender else ""
+    notes_text = f"\nUser's note about them: {notes}" if notes else ""
+    titles = json.dumps(gift_titles) if GEMINI_STRUCTURED else json.dumps(gift_titles, indent=2)
 
-# Fallback data for when API is unavailable
-GIFT_DATABASE = {
-    "traditional": ["Silver Pooja Items", "Brass Diya Set", "Traditional Silk Saree", "Kurta Pajama Set", "Handcrafted Jewelry", "Silver Coins", "Copper Water Bottle", "Traditional Sweet Box"],
-    "modern": ["Smart Watch", "Bluetooth Speaker", "Power Bank", "Wireless Earbuds", "Coffee Maker", "Air Purifier", "Electric Kettle", "Grooming Kit"],
-    "personalized": ["Customized Photo Frame", "Engraved Pen Set", "Personalized Cushion", "Photo Coffee Mug", "Custom Name Plate", "Customized Diary"],
-    "luxury": ["Designer Perfume", "Premium Watch", "Leather Wallet", "Designer Sunglasses", "Branded Handbag", "Premium Tea Gift Set", "Luxury Chocolate Box"],
-    "wellness": ["Yoga Mat", "Essential Oil Diffuser", "Spa Gift Hamper", "Fitness Tracker", "Organic Skincare Set", "Meditation Kit"],
-    "festive": ["Decorative Diya Set", "Rangoli Kit", "Festival Sweet Hamper", "Pooja Thali Set", "Festive Dry Fruit Box", "Decorative Toran"],
-    "romantic": ["Couple Watches", "Heart-shaped Jewelry", "Perfume Gift Set", "Love Letter Kit", "Couple Keychains"],
-    "home": ["Wall Clock", "Decorative Showpiece", "Table Lamp", "Bedsheet Set", "Dinner Set", "Indoor Plant with Planter"],
-    "tech": ["Tablet", "Kindle E-reader", "Smart Home Device", "Gaming Accessories", "Portable Projector"],
-    "kids": ["Educational Toys", "Building Blocks Set", "Art and Craft Kit", "Remote Control Car", "Story Books Set"],
-    "kids_boys": ["Remote Control Car", "Building Blocks Set", "Gaming Accessories", "Story Books Set", "Cricket Kit", "Football"],
-    "kids_girls": ["Art and Craft Kit", "Doll House Set", "Story Books Set", "Educational Toys", "Dance Costume Set", "Jewelry Making Kit"],
-}
+    return _Prompt(_personalization_instructions(), f"""Recipient: {relationship} ({age_group}{gender_text})
+Occasion: {occasion}{notes_text}
 
-GIFT_TYPE_TAGS = {
-    "Silver Pooja Items": "Traditional", "Brass Diya Set": "Traditional", "Traditional Silk Saree": "Traditional",
-    "Kurta Pajama Set": "Formal", "Handcrafted Jewelry": "Traditional", "Silver Coins": "Formal",
-    "Copper Water Bottle": "Practical", "Traditional Sweet Box": "Traditional", "Smart Watch": "Practical",
-    "Bluetooth Speaker": "Funky", "Power Bank": "Practical", "Wireless Earbuds": "Practical",
-    "Coffee Maker": "Practical", "Air Purifier": "Practical", "Electric Kettle": "Practical", "Grooming Kit": "Practical",
-    "Customized Photo Frame": "Romantic", "Engraved Pen Set": "Formal", "Personalized Cushion": "Funky",
-    "Photo Coffee Mug": "Funky", "Custom Name Plate": "Formal", "Customized Diary": "Formal",
-    "Designer Perfume": "Luxury", "Premium Watch": "Luxury", "Leather Wallet": "Formal",
-    "Designer Sunglasses": "Luxury", "Branded Handbag": "Luxury", "Premium Tea Gift Set": "Formal",
-    "Luxury Chocolate Box": "Luxury", "Yoga Mat": "Practical", "Essential Oil Diffuser": "Practical",
-    "Spa Gift Hamper": "Luxury", "Fitness Tracker": "Practical", "Organic Skincare Set": "Luxury",
-    "Meditation Kit": "Practical", "Decorative Diya Set": "Traditional", "Rangoli Kit": "Traditional",
-    "Festival Sweet Hamper": "Traditional", "Pooja Thali Set": "Traditional", "Festive Dry Fruit Box": "Formal",
-    "Decorative Toran": "Traditional", "Couple Watches": "Romantic", "Heart-shaped Jewelry": "Romantic",
-    "Perfume Gift Set": "Romantic", "Love Letter Kit": "Romantic", "Couple Keychains": "Romantic",
-    "Wall Clock": "Practical", "Decorative Showpiece": "Formal", "Table Lamp": "Practical",
-    "Bedsheet Set": "Practical", "Dinner Set": "Formal", "Indoor Plant with Planter": "Practical",
-    "Tablet": "Practical", "Kindle E-reader": "Practical", "Smart Home Device": "Practical",
-    "Gaming Accessories": "Funky", "Portable Projector": "Practical", "Educational Toys": "Practical",
-    "Building Blocks Set": "Funky", "Art and Craft Kit": "Funky", "Remote Control Car": "Funky",
-    "Story Books Set": "Practical", "Cricket Kit": "Funky", "Football": "Funky",
-    "Doll House Set": "Funky", "Dance Costume Set": "Funky", "Jewelry Making Kit": "Funky"
-}
+Gifts:
+{titles}
+""")
 
-GIFT_ICONS = {
-    "Silver Pooja Items": "🪔", "Brass Diya Set": "🪔", "Traditional Silk Saree": "👗",
-    "Kurta Pajama Set": "👔", "Handcrafted Jewelry": "💍", "Silver Coins": "🪙",
-    "Copper Water Bottle": "🍶", "Traditional Sweet Box": "🍬", "Smart Watch": "⌚",
-    "Bluetooth Speaker": "🔊", "Power Bank": "🔋", "Wireless Earbuds": "🎧",
-    "Coffee Maker": "☕", "Air Purifier": "💨", "Electric Kettle": "🫖", "Grooming Kit": "💈",
-    "Customized Photo Frame": "🖼️", "Engraved Pen Set": "🖊️", "Personalized Cushion": "🛋️",
-    "Photo Coffee Mug": "☕", "Custom Name Plate": "🏷️", "Customized Diary": "📔",
-    "Designer Perfume": "🧴", "Premium Watch": "⌚", "Leather Wallet": "👛",
-    "Designer Sunglasses": "🕶️", "Branded Handbag": "👜", "Premium Tea Gift Set": "🍵",
-    "Luxury Chocolate Box": "🍫", "Yoga Mat": "🧘", "Essential Oil Diffuser": "🌸",
-    "Spa Gift Hamper": "🧖", "Fitness Tracker": "📱", "Organic Skincare Set": "🧴",
-    "Meditation Kit": "🧘", "Decorative Diya Set": "🪔", "Rangoli Kit": "🎨",
-    "Festival Sweet Hamper": "🍬", "Pooja Thali Set": "🪔", "Festive Dry Fruit Box": "🥜",
-    "Decorative Toran": "🎊", "Couple Watches": "⌚", "Heart-shaped Jewelry": "💝",
-    "Perfume Gift Set": "🧴", "Love Letter Kit": "💌", "Couple Keychains": "🔑",
-    "Wall Clock": "🕐", "Decorative Showpiece": "🏺", "Table Lamp": "💡",
-    "Bedsheet Set": "🛏️", "Dinner Set": "🍽️", "Indoor Plant with Planter": "🪴",
-    "Tablet": "📱", "Kindle E-reader": "📚", "Smart Home Device": "🏠",
-    "Gaming Accessories": "🎮", "Portable Projector": "📽️", "Educational Toys": "🧩",
-    "Building Blocks Set": "🧱", "Art and Craft Kit": "🎨", "Remote Control Car": "🚗",
-    "Story Books Set": "📚", "Cricket Kit": "🏏", "Football": "⚽",
-    "Doll House Set": "🏠", "Dance Costume Set": "💃", "Jewelry Making Kit": "💎"
-}
 
-RELATIONSHIPS = {
-    "mother": "immediate_family", "father": "immediate_family", "brother": "immediate_family",
-    "sister": "immediate_family", "wife": "immediate_family", "husband": "immediate_family",
-    "son": "immediate_family", "daughter": "immediate_family", "grandparent": "immediate_family",
-    "grandchild": "immediate_family", "uncle": "extended_family", "aunt": "extended_family",
-    "cousin": "extended_family", "nephew": "extended_family", "niece": "extended_family",
-    "boss": "professional", "colleague": "professional", "friend": "social",
-    "boyfriend": "romantic", "girlfriend": "romantic", "saali": "family"
-}
+def _reasons_from_pairs(pairs) -> dict:
+    """REASONS_SCHEMA answer ([{title, reason}]) -> {title: reason}."""
+    return {p['title']: p['reason'] for p in pairs
+            if isinstance(p.get('title'), str) and isinstance(p.get('reason'), str)}
 
-OCCASIONS = {
-    "diwali": "festival", "holi": "festival", "raksha bandhan": "festival",
-    "durga puja": "festival", "ganesh chaturthi": "festival", "navratri": "festival",
-    "eid": "festival", "christmas": "festival", "pongal": "festival", "onam": "festival",
-    "new year": "celebration", "birthday": "celebration", "anniversary": "milestone",
-    "wedding": "milestone", "graduation": "milestone", "promotion": "milestone",
-    "baby shower": "milestone", "house warming": "milestone", "retirement": "milestone",
-    "valentine's day": "romantic", "karva chauth": "festival", "mother's day": "celebration",
-    "father's day": "celebration"
-}
 
-PRO_TIPS = {
-    "diwali": "Always include a handwritten card with Diwali wishes. Avoid black colored gifts.",
-    "raksha bandhan": "Present the gift after the rakhi ceremony. Include sweets for tradition.",
-    "wedding": "Gifts in odd numbers are considered auspicious. Include shagun envelope.",
-    "birthday": "Personalized gifts show extra thought. Consider their hobbies and interests.",
-    "anniversary": "Gifts symbolizing togetherness work best. Avoid sharp objects like knives.",
-    "professional": "Keep professional gifts neutral and practical. Avoid overly personal items.",
-    "default": "Present with both hands as a sign of respect. Include a personalized message."
-}
+def get_ai_personalization(gifts, relationship, occasion, age_group, gender, notes, timeout=None, trace=None):
+    """LLM-2: Add personalized reasoning for each gift using Gemini."""
+    return run(_llm2_call(gifts, relationship, occasion, age_group, gender, notes, timeout, trace), _OPS)
+
+
+def _llm2_call(gifts, relationship, occasion, age_group, gender, notes, timeout=None, trace=None):
+    """get_ai_personalization() as _steps."""
+    prompt = _personalization_prompt(gifts, relationship, occasion, age_group, gender, notes)
+
+    response = yield from _gemini_call(prompt, max_tokens=1500, timeout=timeout, trace=trace,
+                                       schema=REASONS_SCHEMA if GEMINI_STRUCTURED else None, stage='llm2')
+    return _parse_reasons(response, trace) or None
+
 
+def _parse_reasons(response, trace=None) -> dict:
+    """{title: reason} from an LLM-2 answer, structured or free-form."""
+    with span('parse'):
+        if GEMINI_STRUCTURED:
+            return _reasons_from_pairs(parse_array(response, 'LLM-2', trace))
+        return {t: why for t, why in parse_object(response, 'LLM-2', trace).items() if isinstance(why, str)}
 
-def get_fallback_recommendations(relationship, occasion, age_group, vibe, budget, gender="", notes="", gift_types=None):
-    """Fallback to rule-based recommendations when AI is unavailable."""
+
+def iter_pipelined_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="",
+                                   deadline=None, trace=None):
+    """LLM-1 streamed into LLM-2 under one shared deadline.
+
+    Gifts are parsed out of the streaming LLM-1 response one at a time and
+    handed to LLM-2 in batches of _PIPELINE_BATCH, so personalization of the
+    first gifts overlaps generation of the rest. Yields ('gift', gift) as
+    each gift parses and ('reasons', {title: reason}) as each LLM-2 batch
+    lands; batches that miss the deadline are simply left out. `deadline`
+    can only tighten GEMINI_PIPELINE_DEADLINE.
+    """
+    deadline = min(deadline or float('inf'), time.monotonic() + _PIPELINE_DEADLINE_S)
+    prompt = _recommendation_prompt(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city)
+
+    from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+    count, batch, pending = 0, [], []
+    pool = ThreadPoolExecutor(max_workers=-(-10 // _PIPELINE_BATCH))
+
+    def personalize(batch):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        return INFLIGHT.do(
+            _personalization_key(batch, relationship, occasion, age_group, gender, notes),
+            get_ai_personalization, batch, relationship, occasion, age_group, gender, notes, timeout=remaining,
+            deadline=deadline, trace=trace,
+        )
+
+    def drain(block):
+        while pending and (block or pending[0].done()):
+            try:
+                reasons = pending[0].result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeout:
+                print("Personalization missed the pipeline deadline")
+                pending.clear()
+                return
+            pending.pop(0)
+            if reasons:
+                yield 'reasons', reasons
+
+    try:
+        stream = call_gemini_stream(prompt, max_tokens=2048, deadline=deadline,
+                                    hedge_after=GEMINI_HEDGE_AFTER_S, trace=trace,
+                                    schema=GIFTS_SCHEMA if GEMINI_STRUCTURED else None, stage='llm1')
+        for gift in iter_array(stream, 'LLM-1 stream', trace):
+            if not _usable_gift(gift):
+                continue
+            count += 1
+            batch.append(_clamp_price(gift, budget))
+            yield 'gift', gift
+            if len(batch) >= _PIPELINE_BATCH or count >= 10:
+                pending.append(pool.submit(bind(personalize), batch))
+                batch = []
+            yield from drain(block=False)
+            if count >= 10:
+                break
+        if batch:
+            pending.append(pool.submit(bind(personalize), batch))
+        yield from drain(block=True)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_pipelined_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="",
+                                  deadline=None, trace=None):
+    """Collect iter_pipelined_recommendations() into (gifts, reasons)."""
+    gifts, personalization = [], {}
+    for kind, value in iter_pipelined_recommendations(
+        relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city, deadline, trace
+    ):
+        if kind == 'gift':
+            gifts.append(value)
+        else:
+            personalization.update(value)
+    return (gifts or None), (personalization or None)
+
+
+# Fallback catalog for when API is unavailable: data/gift_catalog.bin (mmap,
+# compiled from data/gift_catalog.json by tools/build_catalog.py). Opened on
+# first use rather than at import, so cold-start cost lands in the first
+# request that needs it. Relationship / occasion maps and pro tips live in it
+# too.
+def __getattr__(name):
+    # Keeps recommend.CATALOG / RELATIONSHIPS / ... importable without
+    # loading the catalog at import time.
+    if name == 'CATALOG':
+        return get_catalog()
+    if name in ('RELATIONSHIPS', 'OCCASIONS', 'PRO_TIPS'):
+        return getattr(get_catalog(), name.lower())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@timed('fallback')
+def get_fallback_recommendations(relationship, occasion, age_group, vibe, budget, gender="", notes="", gift_types=None,
+                                 exclude=(), count=10, start=0):
+    """Fallback to rule-based recommendations when AI is unavailable.
+
+    Items come from the catalog's price index: only the requested
+    gift_types, for the recipient's audience, those whose typical price is
+    50-100% of `budget` first, ranked by Catalog.select's score. Each is
+    shown at the price in its range nearest the budget (Catalog.price_for). For a continuation page, `exclude` holds the
+    titles already shown: their catalog items count as used, so the
+    selection picks up where the earlier pages left off. Ids are numbered
+    from `start` + 1.
+    """
     if gift_types is None:
         gift_types = ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"]
 
-    rel_type = RELATIONSHIPS.get(relationship.lower(), "general")
-    occ_type = OCCASIONS.get(occasion.lower(), "celebration")
+    catalog = get_catalog()
+    rel_type = catalog.relationships.get(relationship.lower(), "general")
+    occ_type = catalog.occasions.get(occasion.lower(), "celebration")
 
     if rel_type == "immediate_family":
         categories = ["personalized", "luxury", "wellness"]
@@ -417,133 +1013,120 @@ def get_fallback_recommendations(relationship, occasion, age_group, vibe, budget
         else:
             categories = ["kids", "personalized"] + categories
 
-    recommendations = []
-    used = set()
-    attempt = 0
-
-    while len(recommendations) < 10 and attempt < 50:
-        cat = categories[attempt % len(categories)]
-        items = [x for x in GIFT_DATABASE.get(cat, GIFT_DATABASE["modern"])
-                 if x not in used and GIFT_TYPE_TAGS.get(x, "Practical") in gift_types]
-        if not items:
-            items = [x for v in GIFT_DATABASE.values() for x in v
-                     if x not in used and GIFT_TYPE_TAGS.get(x, "Practical") in gift_types]
-        if items:
-            random.seed(hash(f"{relationship}{occasion}{vibe}{gender}{attempt}"))
-            item = random.choice(items)
-            used.add(item)
-            price = (int(budget * random.uniform(0.6, 1.0)) // 50) * 50
-
-            descriptions = [
-                f"Perfect for {relationship} on {occasion}, combines thoughtfulness with utility",
-                f"Culturally appropriate choice that honors the {occasion} celebration",
-                f"Shows respect and affection, ideal for {relationship}",
-                f"Meaningful gift that celebrates {occasion} with traditional values",
-                f"Thoughtful present that strengthens your bond"
-            ]
-
-            why_reasons = []
-            if rel_type == "immediate_family":
-                why_reasons.append(f"Your {relationship} deserves something special that shows deep appreciation")
-            elif rel_type == "romantic":
-                why_reasons.append(f"Perfect for expressing love and affection to your {relationship}")
-            elif rel_type == "professional":
-                why_reasons.append(f"Maintains appropriate professional boundaries while showing respect")
-            else:
-                why_reasons.append(f"Thoughtful choice that strengthens your bond with your {relationship}")
+    if age_group and age_group.lower() == "child":
+        audience = {"male": "child_male", "female": "child_female"}.get((gender or "").lower(), "child")
+    else:
+        audience = "adult"
+
+    # Deterministic per request, independent of PYTHONHASHSEED and of the
+    # global `random` state.
+    rng = random.Random(zlib.crc32(f"{relationship}|{occasion}|{vibe}|{gender}".encode('utf-8')))
+    used = [i for i in map(catalog.id_of, exclude) if i is not None]
+    picked = catalog.select(int(budget), categories, gift_types, rng, occasion=occ_type, audience=audience,
+                            count=count, exclude=used)
+
+    descriptions = [
+        f"Perfect for {relationship} on {occasion}, combines thoughtfulness with utility",
+        f"Culturally appropriate choice that honors the {occasion} celebration",
+        f"Shows respect and affection, ideal for {relationship}",
+        f"Meaningful gift that celebrates {occasion} with traditional values",
+        f"Thoughtful present that strengthens your bond"
+    ]
+
+    why_reasons = []
+    if rel_type == "immediate_family":
+        why_reasons.append(f"Your {relationship} deserves something special that shows deep appreciation")
+    elif rel_type == "romantic":
+        why_reasons.append(f"Perfect for expressing love and affection to your {relationship}")
+    elif rel_type == "professional":
+        why_reasons.append(f"Maintains appropriate professional boundaries while showing respect")
+    else:
+        why_reasons.append(f"Thoughtful choice that strengthens your bond with your {relationship}")
 
-            if occ_type == "festival":
-                why_reasons.append(f"Aligns beautifully with the spirit and traditions of {occasion}")
-            elif occ_type == "milestone":
-                why_reasons.append(f"Commemorates this important {occasion} milestone meaningfully")
-            else:
-                why_reasons.append(f"Ideal for celebrating {occasion}")
-
-            if notes and notes.strip():
-                why_reasons.append(f"Considering your note: {notes.strip()[:50]}")
-
-            why_applicable = " • ".join(why_reasons[:3])
-            gift_type_tag = GIFT_TYPE_TAGS.get(item, "Practical")
-            icon = GIFT_ICONS.get(item, "🎁")
-            encoded_item = quote_plus(item)
-
-            recommendations.append({
-                "id": len(recommendations) + 1,
-                "title": item,
-                "icon": icon,
-                "gift_type": gift_type_tag,
-                "description": descriptions[len(recommendations) % len(descriptions)],
-                "why_applicable": why_applicable,
-                "approx_price_inr": f"Rs.{price:,}",
-                "purchase_links": add_affiliate_tags({
-                    "amazon": f"https://www.amazon.in/s?k={encoded_item}",
-                    "flipkart": f"https://www.flipkart.com/search?q={encoded_item}",
-                    "myntra": f"https://www.myntra.com/{encoded_item}",
-                    "shoppersstop": f"https://www.shoppersstop.com/search?q={encoded_item}",
-                    "blinkit": f"https://blinkit.com/s/?q={encoded_item}",
-                    "meesho": f"https://www.meesho.com/search?q={encoded_item}"
-                })
-            })
-        attempt += 1
+    if occ_type == "festival":
+        why_reasons.append(f"Aligns beautifully with the spirit and traditions of {occasion}")
+    elif occ_type == "milestone":
+        why_reasons.append(f"Commemorates this important {occasion} milestone meaningfully")
+    else:
+        why_reasons.append(f"Ideal for celebrating {occasion}")
+
+    if notes and notes.strip():
+        why_reasons.append(f"Considering your note: {notes.strip()[:50]}")
+
+    why_applicable = " • ".join(why_reasons[:3])
+
+    recommendations = []
+    for n, i in enumerate(picked):
+        item = catalog.titles[i]
+        price = max(50, catalog.price_for(i, int(budget)) // 50 * 50)
+
+        recommendations.append({
+            "id": start + n + 1,
+            "title": item,
+            "icon": catalog.icons[i],
+            "gift_type": catalog.tag_of(i),
+            "description": descriptions[n % len(descriptions)],
+            "why_applicable": why_applicable,
+            "approx_price_inr": f"Rs.{price:,}",
+            "purchase_links": PURCHASE_LINKS.links(item),
+        })
 
     return recommendations
 
 
-def get_recommendations(relationship, occasion, age_group, vibe, budget, gender="", notes="", gift_types=None, city=""):
-    """Main function that uses dual-LLM approach with fallback."""
-    if gift_types is None:
-        gift_types = ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"]
+def _ai_recommendation(index, gift, relationship, budget, why_applicable):
+    """Shape one LLM-1 gift into the response dict the frontend renders.
 
-    rel_type = RELATIONSHIPS.get(relationship.lower(), "general")
-    occ_type = OCCASIONS.get(occasion.lower(), "celebration")
+    purchase_links are left unwrapped so the dict can be cached; run it
+    through _with_affiliate() before it leaves the process.
+    """
+    title = gift.get('title', 'Gift')
+    return {
+        "id": index + 1,
+        "title": title,
+        "icon": gift.get('icon', '🎁'),
+        "gift_type": gift.get('gift_type', 'Practical'),
+        "description": gift.get('description', f"Perfect gift for {relationship}"),
+        "why_applicable": why_applicable,
+        "approx_price_inr": f"Rs.{gift.get('price', budget):,}",
+        "purchase_links": SEARCH_LINKS.links(title),
+    }
 
-    ai_powered = False
-    recommendations = []
 
-    # Try AI-powered recommendations if API key is available
-    if GEMINI_API_KEY:
-        # LLM-1: Generate gift ideas
-        ai_gifts = get_ai_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city)
-
-        if ai_gifts:
-            # LLM-2: Add personalized reasoning
-            personalization = get_ai_personalization(ai_gifts, relationship, occasion, age_group, gender, notes)
-
-            for i, gift in enumerate(ai_gifts[:10]):
-                title = gift.get('title', 'Gift')
-                encoded_item = quote_plus(title)
-
-                # Get personalized reason from LLM-2, or use LLM-1's description
-                why_applicable = gift.get('description', '')
-                if personalization and title in personalization:
-                    why_applicable = personalization[title]
-
-                recommendations.append({
-                    "id": i + 1,
-                    "title": title,
-                    "icon": gift.get('icon', '🎁'),
-                    "gift_type": gift.get('gift_type', 'Practical'),
-                    "description": gift.get('description', f"Perfect gift for {relationship}"),
-                    "why_applicable": why_applicable,
-                    "approx_price_inr": f"Rs.{gift.get('price', budget):,}",
-                    "purchase_links": add_affiliate_tags({
-                        "amazon": f"https://www.amazon.in/s?k={encoded_item}",
-                        "flipkart": f"https://www.flipkart.com/search?q={encoded_item}",
-                        "myntra": f"https://www.myntra.com/{encoded_item}",
-                        "shoppersstop": f"https://www.shoppersstop.com/search?q={encoded_item}",
-                        "blinkit": f"https://blinkit.com/s/?q={encoded_item}",
-                        "meesho": f"https://www.meesho.com/search?q={encoded_item}"
-                    })
-                })
-            ai_powered = True
-
-    # Fallback to rule-based if AI failed or no API key
-    if not recommendations:
-        recommendations = get_fallback_recommendations(
-            relationship, occasion, age_group, vibe, budget, gender, notes, gift_types
-        )
+@timed('links')
+def _with_affiliate(rec: dict) -> dict:
+    # Rebuilt from the title: one memo lookup instead of re-wrapping six URLs.
+    out = {**rec, "purchase_links": PURCHASE_LINKS.links(rec.get("title", "Gift"))}
+    products = out.pop("products", None)
+    if products:
+        # Resolved product pages (_enrich_links) replace their search URLs.
+        out["purchase_links"].update(add_affiliate_tags({m: p["url"] for m, p in products.items()}))
+        out["prices_inr"] = {m: p["price_inr"] for m, p in products.items() if p.get("price_inr")}
+    return out
+
+
+@timed('enrich')
+def _enrich_links(recs, meta, deadline_s=None):
+    """recs with resolved product pages, when LINK_ENRICHER is configured.
+
+    Waits at most PRODUCT_RESOLVER_DEADLINE (or `deadline_s`; 0 = cache
+    only); meta["links"] says how many links resolved and how many were
+    still pending. The products ride along to _with_affiliate().
+    """
+    if LINK_ENRICHER is None or not recs:
+        return recs
+    recs, meta["links"] = LINK_ENRICHER.enrich(recs, deadline_s)
+    return recs
 
-    pro_tip = PRO_TIPS.get(occasion.lower(), PRO_TIPS.get("professional" if rel_type == "professional" else "default", PRO_TIPS["default"]))
+
+def _summary(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, ai_powered):
+    """thinking_trace + pro_tip for a finished recommendation set."""
+    catalog = get_catalog()
+    rel_type = catalog.relationships.get(relationship.lower(), "general")
+    occ_type = catalog.occasions.get(occasion.lower(), "celebration")
+
+    tips = catalog.pro_tips
+    pro_tip = tips.get(occasion.lower(), tips.get("professional" if rel_type == "professional" else "default", tips["default"]))
 
     gender_text = f", {gender} gender" if gender else ""
     notes_text = f", with special note: '{notes[:30]}...'" if notes and len(notes) > 30 else (f", with note: '{notes}'" if notes else "")
@@ -552,36 +1135,755 @@ def get_recommendations(relationship, occasion, age_group, vibe, budget, gender=
 
     return {
         "thinking_trace": f"Analyzing gift for {relationship} on {occasion}. Considering {rel_type} relationship type, {occ_type} occasion, {age_group} age group{gender_text}, {vibe} style preference, and Rs.{budget:,} budget{notes_text}{types_text}.{ai_text}",
-        "recommendations": recommendations,
         "pro_tip": pro_tip,
-        "ai_powered": ai_powered
     }
 
 
+def _shape_recommendations(ai_gifts, personalization, relationship, budget, start=0):
+    recommendations = []
+    for i, gift in enumerate(ai_gifts[:10], start):
+        # Get personalized reason from LLM-2, or use LLM-1's description
+        why_applicable = gift.get('description', '')
+        title = gift.get('title', 'Gift')
+        if personalization and title in personalization:
+            why_applicable = personalization[title]
+        recommendations.append(_ai_recommendation(i, gift, relationship, budget, why_applicable))
+    return recommendations
+
+
+def _warm_lookup(key, meta):
+    """Recommendations for `key` from the offline warm set (see _warmset), if fresh.
+
+    A hit sets meta cache="warm", reason="warm_set" and the artifact's
+    freshness under meta["warm"].
+    """
+    warm_set = get_warm_set()
+    found = warm_set.get(key) if warm_set is not None else None
+    if found is None:
+        return None
+    recs, freshness = found
+    meta.update(cache="warm", path="ai", reason="warm_set", warm=freshness)
+    return recs
+
+
+def _generation_mode(key, requested=''):
+    """'single' or 'dual' for a request: explicit choice, else the A/B split."""
+    if requested in ('single', 'dual'):
+        return requested
+    if GEMINI_SINGLE_PASS_PCT and zlib.crc32(key.encode('utf-8')) % 100 < GEMINI_SINGLE_PASS_PCT:
+        return 'single'
+    return 'dual'
+
+
+def _mode_key(key, mode) -> str:
+    """Cache key for `key`'s set generated in `mode`.
+
+    The profile key itself holds dual-LLM sets only (the warm set, batch
+    packs and continuation pages are all dual); single-pass sets get a key
+    of their own, so neither mode is ever served the other's answer.
+    """
+    return key + ':single' if mode == 'single' else key
+
+
+def _record_mode(mode, started, recs, trace):
+    """One finished generation into MODE_METRICS."""
+    tokens = trace.get("tokens") or {}
+    MODE_METRICS.record(
+        mode, latency_ms=(time.monotonic() - started) * 1000, ok=bool(recs),
+        parse_issues=trace.get("parse_errors", 0),
+        prompt_tokens=tokens.get("prompt", 0), output_tokens=tokens.get("output", 0),
+    )
+
+
+def _ab_meta(meta):
+    """While an A/B split or the context cache is live, every response
+    carries the comparison (meta["ab"], meta["context_cache"])."""
+    if 0 < GEMINI_SINGLE_PASS_PCT < 100:
+        meta["ab"] = MODE_METRICS.snapshot()
+    if CONTEXT_CACHE is not None:
+        meta["context_cache"] = {**CONTEXT_CACHE.stats(), "calls": CONTEXT_METRICS.snapshot()}
+
+
+def _generate_ai_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="",
+                                 deadline=None, trace=None, on_gifts=None, mode='dual', more=None):
+    """Run LLM-1 + LLM-2 (or one single-pass call) and shape the result.
+
+    Returns None if Gemini gave nothing. Every stage goes through INFLIGHT,
+    so concurrent identical requests share the upstream calls (and their
+    trace), waiting for another request's call until `deadline`. `on_gifts`
+    is called with the LLM-1-only set as soon as it exists, before LLM-2
+    starts (dual, non-pipelined mode).
+
+    `more` is a continuation page's (shown titles, count, shown so far), as
+    get_fallback_recommendations takes them: LLM-1 asks for `count` new
+    gifts and LLM-2 personalizes only those, in the two-call mode whatever
+    `mode` says.
+    """
+    return run(_generation(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city,
+                           deadline, trace, on_gifts, mode, more, pipeline=GEMINI_PIPELINE), _OPS)
+
+
+def _generation(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city="", deadline=None,
+                trace=None, on_gifts=None, mode='dual', more=None, pipeline=False):
+    """_generate_ai_recommendations() as _steps: yields 'flight' per stage,
+    or 'pipelined' when `pipeline` (threaded callers only)."""
+    key = _cache_key(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city)
+    exclude, count, start = more or ((), 10, 0)
+    if more:
+        key = _more_key(key, exclude, count)
+        mode = 'dual'
+    if mode == 'single':
+        ai_gifts, personalization = yield (
+            'flight', 'single:' + key, _single_pass_call,
+            (relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city), {}, deadline, trace,
+        )
+    elif pipeline and not more:
+        # LLM-1 and LLM-2 overlapped under one deadline
+        ai_gifts, personalization = yield (
+            'pipelined', 'pipe:' + key,
+            (relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city), deadline, trace,
+        )
+    else:
+        # LLM-1: Generate gift ideas
+        ai_gifts = yield (
+            'flight', 'llm1:' + key, _llm1_call,
+            (relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city),
+            {"exclude": exclude, "count": count}, deadline, trace,
+        )
+        if ai_gifts and on_gifts is not None:
+            on_gifts(_shape_recommendations(ai_gifts, None, relationship, budget, start))
+        # LLM-2: Add personalized reasoning
+        personalization = (yield (
+            'flight', _personalization_key(ai_gifts, relationship, occasion, age_group, gender, notes), _llm2_call,
+            (ai_gifts, relationship, occasion, age_group, gender, notes), {}, deadline, trace,
+        )) if ai_gifts else None
+
+    if not ai_gifts:
+        return None
+    return _shape_recommendations(ai_gifts, personalization, relationship, budget, start)
+
+
+def _race_generation(key, args, deadline, trace, on_gifts, mode, more, started, pipeline=False):
+    """The generating side of the deadline race as _steps: _generation(),
+    then 'cache_set' for what it made. Records MODE_METRICS; never raises."""
+    recs = None
+    try:
+        recs = yield from _generation(*args, deadline=deadline, trace=trace, on_gifts=on_gifts, mode=mode, more=more,
+                                      pipeline=pipeline)
+        if recs:
+            yield ('cache_set', key, recs)
+    except Exception as exc:
+        print(f"AI generation error: {type(exc).__name__}: {exc}")
+    finally:
+        _record_mode(mode, started, recs, trace)
+    return recs
+
+
+def _race_outcome(meta, trace, finished, recs, partial, fallback):
+    """What the race returns at its deadline (see _race_ai_recommendations)."""
+    if trace.get("hedge"):
+        meta["hedge"] = trace["hedge"]
+    if trace.get("tokens"):
+        meta["tokens"] = dict(trace["tokens"])   # calls finished so far
+    if finished and recs:
+        meta.update(path="ai", reason="complete")
+        return recs, fallback
+    if partial:
+        meta.update(path="ai", reason="personalization_late")
+        return partial[0], fallback
+    if trace.get("admission") == "rejected":
+        meta.update(path="fallback", reason="rate_limited")
+    else:
+        meta.update(path="fallback", reason="ai_failed" if finished else "deadline")
+    return None, fallback
+
+
+def _race_ai_recommendations(key, relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city, meta,
+                             mode='dual', more=None):
+    """AI generation raced against RECOMMEND_DEADLINE_S.
+
+    Generation runs on a background thread and caches its own result, so a
+    late answer is not wasted. Meanwhile this thread computes the rule-based
+    set. At the deadline the best thing ready wins:
+
+    complete AI set > LLM-1 gifts with their own descriptions > fallback.
+
+    Returns (recommendations, fallback) and records meta["path"] / ["reason"].
+    The generation itself is recorded in MODE_METRICS when it finishes,
+    deadline or not. `more` is passed through for a continuation page
+    (see _generate_ai_recommendations); its fallback continues likewise.
+    """
+    started = time.monotonic()
+    deadline = started + RECOMMEND_DEADLINE_S
+    trace = {}
+    partial = []
+    done = threading.Event()
+    result = {}
+    args = (relationship, occasion, age_group, vibe, _budget_band(budget), gender, notes, gift_types, city)
+
+    def generate():
+        try:
+            result["recs"] = run(_race_generation(key, args, deadline, trace, partial.append, mode, more, started,
+                                                  pipeline=GEMINI_PIPELINE), _OPS)
+        finally:
+            done.set()
+
+    threading.Thread(target=bind(generate), name='recommend-ai', daemon=True).start()
+    fallback = get_fallback_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types,
+                                            *(more or ()))
+    finished = done.wait(max(0.0, deadline - time.monotonic()))
+    return _race_outcome(meta, trace, finished, result.get("recs"), partial, fallback)
+
+
+def get_recommendations(relationship, occasion, age_group, vibe, budget, gender="", notes="", gift_types=None, city="",
+                        mode=''):
+    """Main function that uses dual-LLM approach with fallback.
+
+    AI results are cached per _cache_key(); a hit skips both Gemini calls.
+    Generation uses the budget band floor so a cached set stays within
+    budget for every request in the band. A miss is raced against
+    RECOMMEND_DEADLINE_S (see _race_ai_recommendations), unless the offline
+    warm set has the profile (see _warm_lookup); meta reports
+    which path won and why. `mode` ('single' | 'dual' | '') picks the
+    generation mode, '' leaving it to the GEMINI_SINGLE_PASS split.
+    """
+    return run(_recommendation_steps(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city,
+                                     mode), _OPS)
+
+
+def _recommendation_steps(relationship, occasion, age_group, vibe, budget, gender="", notes="", gift_types=None,
+                          city="", mode=''):
+    """get_recommendations() as _steps: yields 'cache_get', 'race', 'enrich' and 'fallback'."""
+    if gift_types is None:
+        gift_types = ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"]
+
+    started = time.monotonic()
+    meta = {"cache": "bypass"}
+    recommendations = fallback = None
+
+    # Try AI-powered recommendations if API key is available
+    if GEMINI_API_KEY:
+        key = _cache_key(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city)
+        meta["mode"] = _generation_mode(key, mode)
+        key = _mode_key(key, meta["mode"])
+        recommendations = yield ('cache_get', key)
+        meta["cache"] = "hit" if recommendations else "miss"
+        if recommendations:
+            meta.update(path="ai", reason="cache_hit")
+        elif meta["mode"] == 'dual':
+            recommendations = _warm_lookup(key, meta)
+        if not recommendations:
+            recommendations, fallback = yield (
+                'race', key, (relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city), meta,
+                meta["mode"],
+            )
+        if recommendations and LINK_ENRICHER is not None:
+            recommendations = yield ('enrich', recommendations, meta)
+        _ab_meta(meta)
+
+    meta["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+    if not recommendations and fallback is None:
+        fallback = yield ('fallback', relationship, occasion, age_group, vibe, budget, gender, notes, gift_types)
+    return _response(recommendations, relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, meta,
+                     fallback=fallback, city=city)
+
+
+def _flight(key, stage, args, kwargs, deadline, trace):
+    """One _steps stage through INFLIGHT, run on this thread."""
+    return INFLIGHT.do(key, lambda *a, **kw: run(stage(*a, **kw), _OPS), *args, deadline=deadline, trace=trace,
+                       **kwargs)
+
+
+# How the threaded handler does each I/O step of the _steps generators above.
+_OPS = {
+    'admit': ADMISSION.acquire,
+    'generate': lambda body, timeout, hedge_after, trace: GEMINI.generate(
+        body, timeout=timeout, hedge_after=hedge_after, trace=trace),
+    'settle': ADMISSION.settle,
+    'flight': _flight,
+    'pipelined': lambda key, args, deadline, trace: INFLIGHT.do(
+        key, get_pipelined_recommendations, *args, deadline, deadline=deadline, trace=trace),
+    'cache_get': RESPONSE_CACHE.get,
+    'cache_set': RESPONSE_CACHE.set,
+    'race': lambda key, args, meta, mode: _race_ai_recommendations(key, *args, meta, mode=mode),
+    'enrich': _enrich_links,
+    'fallback': get_fallback_recommendations,
+}
+
+
+def _response(recommendations, relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, meta,
+              fallback=None, city="", more=None):
+    """Final response dict: wrap cached/fresh AI recs, or fall back to rules.
+
+    `fallback` is a rule-based set the caller already computed, if any.
+    `continuation` asks for the next page (see get_more_recommendations);
+    `more` is this page's (shown titles, count, shown so far), if it is one.
+    """
+    if gift_types is None:
+        gift_types = ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"]
+
+    ai_powered = bool(recommendations)
+    if ai_powered:
+        recommendations = [_with_affiliate(r) for r in recommendations]
+        meta.setdefault("path", "ai")
+    else:
+        # Fallback to rule-based if AI failed or no API key
+        recommendations = fallback if fallback is not None else get_fallback_recommendations(
+            relationship, occasion, age_group, vibe, budget, gender, notes, gift_types
+        )
+        meta.setdefault("path", "fallback")
+        meta.setdefault("reason", "ai_failed" if GEMINI_API_KEY else "no_api_key")
+
+    summary = _summary(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, ai_powered)
+    profile = (relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city)
+    return {
+        "thinking_trace": summary["thinking_trace"],
+        "recommendations": recommendations,
+        "pro_tip": summary["pro_tip"],
+        "ai_powered": ai_powered,
+        "continuation": continuation_token(profile, [r["title"] for r in recommendations], more),
+        "meta": meta,
+    }
+
+
+# Continuation tokens carry the whole session, so "more ideas" needs no
+# server-side state: the profile as _request_args() returns it, the titles
+# shown so far (newest _MORE_MAX_SHOWN) and how many that was in all, as
+# compact JSON, deflated and base64url-encoded. A token is not signed; it
+# is re-sanitized on the way in and can only ask for what a POST could.
+
+def continuation_token(profile, titles, more=None) -> str:
+    """Token for the page after one that showed `titles` (see _response)."""
+    shown, _, total = more or ((), 0, 0)
+    state = {
+        "p": list(profile),
+        "s": (list(shown) + list(titles))[-_MORE_MAX_SHOWN:],
+        "n": total + len(titles),
+    }
+    raw = zlib.compress(json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def read_continuation(token) -> tuple:
+    """(sanitized payload, shown titles, shown count) from a token; ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        inflate = zlib.decompressobj()
+        state = json.loads(inflate.decompress(raw, _MAX_REQUEST_BYTES))
+        if inflate.unconsumed_tail:
+            raise ValueError("token too large")
+        profile, shown, total = state['p'], state['s'], int(state['n'])
+        if len(profile) != len(_PROFILE_FIELDS) or not isinstance(shown, list):
+            raise ValueError("bad token shape")
+    except (TypeError, ValueError, KeyError, zlib.error) as e:
+        raise ValueError("invalid continuation token") from e
+    shown = [t[:120] for t in shown if isinstance(t, str)][-_MORE_MAX_SHOWN:]
+    return _sanitize_inputs(dict(zip(_PROFILE_FIELDS, profile))), shown, max(total, len(shown))
+
+
+def get_more_recommendations(token, count=None):
+    """The next "more ideas" page for a `continuation` token.
+
+    Only `count` (default MORE_COUNT) new gifts are generated: LLM-1 is
+    told which titles were already shown and LLM-2 personalizes just the
+    new ones, so a page costs a fraction of a full set. Without Gemini,
+    or if it misses the deadline, the rule-based selection continues past
+    the catalog items already shown. Pages are cached like first pages,
+    keyed by the profile and the shown titles. Raises ValueError for a
+    bad token.
+    """
+    clean, shown, total = read_continuation(token)
+    args = _request_args(clean)
+    relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city = args
+    if gift_types is None:
+        gift_types = ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"]
+    try:
+        count = max(1, min(10, int(count or MORE_COUNT)))
+    except (TypeError, ValueError):
+        count = MORE_COUNT
+    more = (shown, count, total)
+
+    started = time.monotonic()
+    meta = {"cache": "bypass", "page": {"shown": total, "count": count}}
+    recommendations = fallback = None
+
+    if GEMINI_API_KEY:
+        key = _more_key(_cache_key(*args), shown, count)
+        recommendations = RESPONSE_CACHE.get(key)
+        meta["cache"] = "hit" if recommendations else "miss"
+        if recommendations:
+            meta.update(path="ai", reason="cache_hit")
+        else:
+            meta["mode"] = 'dual'
+            recommendations, fallback = _race_ai_recommendations(
+                key, relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city, meta, more=more,
+            )
+    if not recommendations and fallback is None:
+        fallback = get_fallback_recommendations(
+            relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, *more
+        )
+
+    meta["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+    return _response(recommendations, relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, meta,
+                     fallback=fallback, city=city, more=more)
+
+
+def iter_recommendation_events(relationship, occasion, age_group, vibe, budget, gender="", notes="", gift_types=None, city="",
+                               mode=''):
+    """Streaming counterpart of get_recommendations().
+
+    Yields NDJSON-ready events in order:
+    - {"type": "gift", "recommendation": {...}} as soon as each gift parses
+      (same dict shape as get_recommendations builds);
+    - {"type": "reasons", "updates": [{"id", "why_applicable"}]} patches as
+      LLM-2 batches land;
+    - one final {"type": "done", "thinking_trace", "pro_tip", "ai_powered", "continuation", "meta"}.
+    Cache hits replay the stored set at once; a completed stream is cached.
+    Falls back to rule-based gifts if the stream produced nothing by
+    RECOMMEND_DEADLINE_S; meta["path"] / ["reason"] say which happened.
+    A gift is never held back for product lookups: it gets the product
+    pages LINK_ENRICHER already knows, and the rest are looked up for next
+    time.
+    """
+    if gift_types is None:
+        gift_types = ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"]
+
+    started = time.monotonic()
+    deadline = started + RECOMMEND_DEADLINE_S
+    meta = {"cache": "bypass"}
+    recs, ids_by_title = [], {}
+    if GEMINI_API_KEY:
+        key = _cache_key(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city)
+        meta["mode"] = _generation_mode(key, mode)
+        key = _mode_key(key, meta["mode"])
+        cached = RESPONSE_CACHE.get(key)
+        meta["cache"] = "hit" if cached else "miss"
+        if cached:
+            meta.update(path="ai", reason="cache_hit")
+        elif meta["mode"] == 'dual':
+            cached = _warm_lookup(key, meta)
+        if cached:
+            recs = cached
+            for rec in _enrich_links(cached, meta, 0):
+                yield {"type": "gift", "recommendation": _with_affiliate(rec)}
+        else:
+            band = _budget_band(budget)
+            trace = {}
+            events = iter_single_pass_recommendations if meta["mode"] == 'single' else iter_pipelined_recommendations
+            for kind, value in events(
+                relationship, occasion, age_group, vibe, band, gender, notes, gift_types, city, deadline, trace
+            ):
+                if kind == 'gift':
+                    rec = _ai_recommendation(len(recs), value, relationship, band, value.get('description', ''))
+                    recs.append(rec)
+                    ids_by_title.setdefault(rec["title"], rec["id"])
+                    shown = _enrich_links([rec], {}, 0)[0]
+                    yield {"type": "gift", "recommendation": _with_affiliate(shown)}
+                else:
+                    updates = [{"id": ids_by_title[t], "why_applicable": why}
+                               for t, why in value.items() if t in ids_by_title]
+                    for u in updates:
+                        recs[u["id"] - 1]["why_applicable"] = u["why_applicable"]
+                    if updates:
+                        yield {"type": "reasons", "updates": updates}
+            if recs:
+                RESPONSE_CACHE.set(key, recs)
+                meta.update(path="ai", reason="complete")
+            elif trace.get("admission") == "rejected":
+                meta.update(path="fallback", reason="rate_limited")
+            else:
+                meta.update(path="fallback", reason="deadline" if time.monotonic() >= deadline else "ai_failed")
+            if trace.get("hedge"):
+                meta["hedge"] = trace["hedge"]
+            if trace.get("tokens"):
+                meta["tokens"] = dict(trace["tokens"])
+            _record_mode(meta["mode"], started, recs, trace)
+        _ab_meta(meta)
+    else:
+        meta.update(path="fallback", reason="no_api_key")
+
+    ai_powered = bool(recs)
+    if not ai_powered:
+        recs = get_fallback_recommendations(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types)
+        for rec in recs:
+            yield {"type": "gift", "recommendation": rec}
+
+    meta["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+    summary = _summary(relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, ai_powered)
+    profile = (relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city)
+    yield {"type": "done", **summary, "ai_powered": ai_powered,
+           "continuation": continuation_token(profile, [r["title"] for r in recs]), "meta": meta}
+
+
 _MAX_REQUEST_BYTES = 8 * 1024  # 8KB is more than enough for our payload
 _PRODUCTION_ORIGIN = 'https://gifting-idea.vercel.app'
 
+# GET /api/recommend?<canonical query> answers like a POST but is cacheable
+# by Vercel's edge (s-maxage, stale-while-revalidate) and by browsers
+# (max-age, ETag / 304). A fallback served because Gemini failed or ran
+# late is cached for RECOMMEND_CDN_FALLBACK_MAX_AGE only, so the edge asks
+# again soon. Bodies are deterministic per query: rule-based picks are
+# seeded from the request, and affiliate links are a pure function of the
+# title (PURCHASE_LINKS), so a cached body never goes stale on its own. The
+# exception is product enrichment: an answer sent while some lookups were
+# still pending is cached briefly too, so the next one carries their pages.
+# A query with notes is answered but never stored (see _cache_control); the
+# frontend sends those as a POST.
+CDN_MAX_AGE = int(os.environ.get('RECOMMEND_CDN_MAX_AGE', '3600'))
+CDN_FALLBACK_MAX_AGE = int(os.environ.get('RECOMMEND_CDN_FALLBACK_MAX_AGE', '60'))
+CDN_STALE_S = int(os.environ.get('RECOMMEND_CDN_SWR', '86400'))
+BROWSER_MAX_AGE = int(os.environ.get('RECOMMEND_BROWSER_MAX_AGE', '300'))
+_QUERY_FIELDS = ('age_group', 'budget', 'city', 'gender', 'gift_types', 'mode', 'notes', 'occasion', 'relationship',
+                 'vibe')
+_ALL_GIFT_TYPES = 6
+
+
+def _query_inputs(query: str) -> dict:
+    """POST-shaped payload from a GET query (gift_types comma-separated)."""
+    data = {k: v[-1] for k, v in parse_qs(query).items() if k in _QUERY_FIELDS}
+    if 'gift_types' in data:
+        data['gift_types'] = [t for t in data['gift_types'].split(',') if t]
+    return data
+
+
+def canonical_query(clean: dict) -> str:
+    """The one query string for a sanitized request, keys sorted.
+
+    Defaults filled in, whitespace folded, choice fields capitalized,
+    budget at its band floor, gift_types sorted (omitted when all are
+    allowed), empty fields dropped. Requests that differ only in those
+    respects share one URL, hence one edge cache entry.
+    """
+    relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city = _request_args(clean)
+    fields = {
+        'relationship': relationship, 'occasion': occasion, 'age_group': age_group, 'vibe': vibe,
+        'gender': gender, 'city': city,
+    }
+    params = {k: string.capwords(v) for k, v in fields.items() if v}
+    params['budget'] = str(_budget_band(budget))
+    if gift_types and len(set(gift_types)) < _ALL_GIFT_TYPES:
+        params['gift_types'] = ','.join(sorted(set(gift_types)))
+    if notes:
+        params['notes'] = ' '.join(notes.split())
+    if clean.get('mode'):
+        params['mode'] = clean['mode']
+    return urlencode(sorted(params.items()), quote_via=quote)
+
+
+def _cache_control(payload: 'dict | None', clean: dict) -> str:
+    """Cache-Control for a GET answer: long for a real answer, short for a stopgap.
+
+    `payload` None is the 308 to the canonical query. A query with notes
+    (personal free text) is never stored: not by the edge, whose cache
+    key it would become, and not by the browser.
+    """
+    if clean.get('notes'):
+        return 'private, no-store'
+    if payload is None:
+        return f"public, max-age={CDN_STALE_S}, s-maxage={CDN_STALE_S}"
+    meta = payload.get('meta') or {}
+    stopgap = (meta.get('reason') in ('ai_failed', 'deadline', 'rate_limited', 'personalization_late')
+               or bool((meta.get('links') or {}).get('late')))
+    s_maxage = CDN_FALLBACK_MAX_AGE if stopgap else CDN_MAX_AGE
+    return (f"public, max-age={min(BROWSER_MAX_AGE, s_maxage)}, s-maxage={s_maxage}, "
+            f"stale-while-revalidate={CDN_STALE_S}")
+
+
+def _etag(payload: dict) -> str:
+    """Weak ETag over everything but meta (timings and cache status vary per call)."""
+    body = json.dumps({k: v for k, v in payload.items() if k != 'meta'}, sort_keys=True, separators=(',', ':'))
+    return 'W/"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match against `etag`, weak comparison (RFC 9110 13.1.2)."""
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == opaque:
+            return True
+    return False
+
+
+def _has_answer(args, mode='') -> bool:
+    """Whether get_recommendations(*args, mode=mode) is answered without Gemini (cache, warm set or no key)."""
+    if not GEMINI_API_KEY:
+        return True
+    key = _cache_key(*args)
+    mode = _generation_mode(key, mode)
+    key = _mode_key(key, mode)
+    return RESPONSE_CACHE.get(key) is not None or (mode == 'dual' and _warm_lookup(key, {}) is not None)
+
+
+def cors_origin(origin: str) -> 'str | None':
+    """`origin` if it may call the API cross-origin, else None."""
+    if origin == _PRODUCTION_ORIGIN or origin.endswith('.vercel.app'):
+        return origin
+    return None
+
+
+def _log_request(event, timings, outcome, profiler=None, warm_profile=None):
+    """The one structured log line per request: outcome, stage timings, tokens.
+
+    "warm_profile" is the request's _warm_profile() (read back by
+    tools/build_warmset.py); "profiler" is a sampled request's profile.
+    "inflight" and "response_cache" are the process's INFLIGHT and
+    RESPONSE_CACHE counters so far.
+    """
+    meta = outcome.get("meta") or {}
+    line = {
+        "event": event,
+        "status": outcome.get("status"),
+        "stream": outcome.get("stream", False),
+        "cache": meta.get("cache"),
+        "path": meta.get("path"),
+        "reason": meta.get("reason"),
+        "mode": meta.get("mode"),
+        "tokens": meta.get("tokens"),
+        "warm_profile": warm_profile,
+        "ms": timings.as_dict(),
+        "inflight": INFLIGHT.stats(),
+        "response_cache": RESPONSE_CACHE.stats(),
+    }
+    if profiler is not None:
+        line["profiler"] = {"samples": profiler.samples, "interval_ms": profiler.interval * 1000,
+                           "top": profiler.top()}
+    print(json.dumps({k: v for k, v in line.items() if v is not None}))
+
 
 class handler(BaseHTTPRequestHandler):
+    log_event = 'recommend'
+    allow_methods = 'GET, POST, OPTIONS'
+
     def _cors_origin(self) -> 'str | None':
-        origin = self.headers.get('Origin', '')
-        if origin == _PRODUCTION_ORIGIN or origin.endswith('.vercel.app'):
-            return origin
-        return None
+        return cors_origin(self.headers.get('Origin', ''))
 
-    def _send_json(self, status: int, payload: dict) -> None:
-        body = json.dumps(payload).encode('utf-8')
+    def _send_json(self, status: int, payload: dict, headers: 'dict | None' = None) -> None:
+        with span('serialize'):
+            body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self._outcome = {"status": status, "meta": (payload or {}).get('meta')}
         self.send_response(status)
-        self.send_header('Content-Type', 'application/json')
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json')
+        cache_status = ((payload or {}).get('meta') or {}).get('cache')
+        if cache_status:
+            self.send_header('X-Cache', cache_status.upper())
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        timings = current_timings()
+        if timings is not None:
+            self.send_header('Server-Timing', timings.header())
         cors = self._cors_origin()
         if cors:
             self.send_header('Access-Control-Allow-Origin', cors)
             self.send_header('Vary', 'Origin')
-        self.send_header('Content-Length', str(len(body)))
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
         self.end_headers()
         self.wfile.write(body)
 
+    def _send_cacheable(self, payload: dict, clean: dict) -> None:
+        """A GET answer with Cache-Control and ETag, or 304 if the client has it."""
+        etag = _etag(payload)
+        headers = {'Cache-Control': _cache_control(payload, clean), 'ETag': etag}
+        if _etag_matches(self.headers.get('If-None-Match', ''), etag):
+            self._send_json(304, None, headers)
+            self._outcome["meta"] = payload.get('meta')
+            return
+        self._send_json(200, payload, headers)
+
+    def _wants_stream(self) -> bool:
+        if 'application/x-ndjson' in self.headers.get('Accept', ''):
+            return True
+        return parse_qs(urlparse(self.path).query).get('stream') == ['1']
+
+    def _send_stream(self, events) -> None:
+        """Write events as NDJSON, flushing each line as it is produced.
+
+        No Content-Length: the body is delimited by connection close, which
+        BaseHTTPRequestHandler's default HTTP/1.0 gives us for free.
+        """
+        self._outcome = {"status": 200, "stream": True}
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('X-Accel-Buffering', 'no')
+        cors = self._cors_origin()
+        if cors:
+            self.send_header('Access-Control-Allow-Origin', cors)
+            self.send_header('Vary', 'Origin')
+        self.end_headers()
+        try:
+            for event in events:
+                self.wfile.write(json.dumps(event).encode('utf-8') + b'\n')
+                self.wfile.flush()
+                if event.get("type") == "done":
+                    self._outcome["meta"] = event.get("meta")
+        except (BrokenPipeError, ConnectionResetError):
+            print("recommend stream: client went away")
+        except Exception as exc:
+            # Headers are already out; report in-band instead of a 500.
+            print(f"recommend stream error: {type(exc).__name__}: {exc}")
+            try:
+                self.wfile.write(b'{"type": "error", "error": "internal error"}\n')
+            except OSError:
+                pass
+        self.close_connection = True
+
     def do_POST(self):
+        self._timed(self._do_post)
+
+    def do_GET(self):
+        self._timed(self._do_get)
+
+    def _timed(self, serve):
+        """Time the request (see _timing) and log it once it is answered."""
+        timings = Timings()
+        profiler = maybe_profile()
+        self._outcome = {}
+        self._profile = None
+        with activate(timings):
+            try:
+                serve()
+            finally:
+                if profiler is not None:
+                    profiler.stop()
+                _log_request(self.log_event, timings, self._outcome, profiler, self._profile)
+
+    def _do_get(self):
+        """GET /api/recommend?relationship=...: see canonical_query() and CDN_MAX_AGE.
+
+        A non-canonical query is redirected (308, itself cacheable) to the
+        canonical one. A stream-capable client (Accept: application/x-ndjson)
+        whose request is not answered yet gets the uncacheable NDJSON stream;
+        everything else gets cacheable JSON.
+        """
+        parsed = urlparse(self.path)
+        clean = _sanitize_inputs(_query_inputs(parsed.query))
+        canonical = canonical_query(clean)
+        if parsed.query != canonical:
+            self._send_json(308, None, {
+                'Location': f"{parsed.path}?{canonical}",
+                'Cache-Control': _cache_control(None, clean),
+            })
+            return
+
+        args = _request_args(clean)
+        self._profile = _warm_profile(*args)
+        if 'application/x-ndjson' in self.headers.get('Accept', '') and not _has_answer(args, clean['mode']):
+            self._send_stream(iter_recommendation_events(*args, mode=clean['mode']))
+            return
+        try:
+            result = get_recommendations(*args, mode=clean['mode'])
+        except Exception as exc:
+            print(f"recommend error: {type(exc).__name__}: {exc}")
+            self._send_json(500, {"error": "internal error"}, {'Cache-Control': 'no-store'})
+            return
+        self._send_cacheable(result, clean)
+
+    def _do_post(self):
         try:
             content_length = int(self.headers.get('Content-Length', 0) or 0)
         except (TypeError, ValueError):
@@ -604,20 +1906,20 @@ class handler(BaseHTTPRequestHandler):
             self._send_json(400, {"error": "invalid request body"})
             return
 
+        if 'continuation' in data:
+            self._send_more(data)
+            return
+
         clean = _sanitize_inputs(data)
+        args = _request_args(clean)
+        self._profile = _warm_profile(*args)
+
+        if self._wants_stream():
+            self._send_stream(iter_recommendation_events(*args, mode=clean['mode']))
+            return
 
         try:
-            result = get_recommendations(
-                clean['relationship'] or 'Friend',
-                clean['occasion'] or 'Birthday',
-                clean['age_group'] or 'Adult',
-                clean['vibe'] or 'Traditional',
-                clean['budget'],
-                clean['gender'],
-                clean['notes'],
-                clean['gift_types'],
-                clean.get('city', ''),
-            )
+            result = get_recommendations(*args, mode=clean['mode'])
         except Exception as exc:
             # Last-resort guard. Log to Vercel function logs but don't leak details.
             print(f"recommend error: {type(exc).__name__}: {exc}")
@@ -626,12 +1928,25 @@ class handler(BaseHTTPRequestHandler):
 
         self._send_json(200, result)
 
+    def _send_more(self, data: dict) -> None:
+        """POST {"continuation": token, "count": n}: the next page, always plain JSON."""
+        try:
+            result = get_more_recommendations(str(data['continuation'] or ''), data.get('count'))
+        except ValueError:
+            self._send_json(400, {"error": "invalid continuation token"})
+            return
+        except Exception as exc:
+            print(f"recommend error: {type(exc).__name__}: {exc}")
+            self._send_json(500, {"error": "internal error"})
+            return
+        self._send_json(200, result)
+
     def do_OPTIONS(self):
         self.send_response(204)
         cors = self._cors_origin()
         if cors:
             self.send_header('Access-Control-Allow-Origin', cors)
-            self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+            self.send_header('Access-Control-Allow-Methods', self.allow_methods)
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
             self.send_header('Access-Control-Max-Age', '86400')
             self.send_header('Vary', 'Origin')
@@ -0,0 +1,316 @@
+"""Batch endpoint: recommendations for many recipients in one request.
+
+POST /api/recommend_batch with {"items": [payload, ...]} (or a bare array),
+each payload shaped like a /api/recommend body. Returns
+{"results": [{"index", "ok", "result" | "error"}], "stats": {...}} with one
+entry per input, in input order.
+
+Cost controls, in order:
+1. identical profiles (same cache key) are generated once;
+2. the response cache answers whatever it already has;
+3. the rest are packed BATCH_PACK_SIZE recipients per Gemini prompt (one
+   LLM-1 + one LLM-2 call per pack instead of two calls per recipient);
+4. packs run on at most BATCH_CONCURRENCY threads.
+A recipient the packed answer misses gets the rule-based fallback, the same
+as a failed single request.
+
+The whole batch answers within BATCH_DEADLINE seconds: each Gemini call
+gets only the time left, a pack that cannot start its LLM-1 call in time
+is not sent, and one whose LLM-2 call would not fit keeps LLM-1's own
+descriptions. At the deadline every recipient still without gifts gets the
+fallback (meta reason "deadline"). A pack whose LLM-2 call is already
+under way at the deadline still fills the response cache when it lands.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import recommend  # noqa: E402
+from recommend import (  # noqa: E402
+    GIFTS_SCHEMA,
+    REASONS_SCHEMA,
+    RESPONSE_CACHE,
+    _ai_recommendation,
+    _budget_band,
+    _cache_key,
+    _clamp_price,
+    _reasons_from_pairs,
+    _request_args,
+    _response,
+    _sanitize_inputs,
+    _usable_gift,
+    call_gemini,
+)
+from _jsonstream import parse_object  # noqa: E402
+
+_MAX_BATCH_BYTES = 512 * 1024   # ~500 recipients with full notes
+_MAX_BATCH_ITEMS = 500
+_BATCH_PACK_SIZE = max(1, int(os.environ.get('BATCH_PACK_SIZE', '3')))
+_BATCH_CONCURRENCY = max(1, int(os.environ.get('BATCH_CONCURRENCY', '4')))
+# Gemini 1.5 Flash caps output at 8192 tokens; ten gifts need ~2k.
+_TOKENS_PER_RECIPIENT = 2048
+_MAX_OUTPUT_TOKENS = 8192
+# Under the platform's function timeout, so the response is always sent.
+_BATCH_DEADLINE_S = float(os.environ.get('BATCH_DEADLINE', '45'))
+_MIN_CALL_S = 2.0       # no Gemini call is started with less time left
+
+
+def _recipient_line(rid, args) -> str:
+    relationship, occasion, age_group, vibe, budget, gender, notes, gift_types, city = args
+    parts = [f"Recipient: {relationship}", f"Occasion: {occasion}", f"Age Group: {age_group}"]
+    if gender:
+        parts.append(f"Gender: {gender}")
+    parts += [f"Style/Vibe: {vibe}", f"Budget: Rs.{budget:,} INR"]
+    if gift_types and len(gift_types) < 6:
+        parts.append(f"Preferred styles: {', '.join(gift_types)}")
+    if city:
+        parts.append(f"Buyer's city: {city}")
+    if notes:
+        parts.append(f"Notes: {notes}")
+    return f"[{rid}] " + " | ".join(parts)
+
+
+def _packed_schema(pack, per_recipient: dict) -> dict:
+    """Structured-output schema: one `per_recipient` value per pack id."""
+    rids = [rid for rid, _ in pack]
+    return {"type": "OBJECT", "properties": {rid: per_recipient for rid in rids},
+            "required": rids, "propertyOrdering": rids}
+
+
+def _packed_recommendation_prompt(pack) -> str:
+    lines = "\n".join(_recipient_line(rid, args) for rid, args in pack)
+    if recommend.GEMINI_STRUCTURED:
+        return f"""You are a creative Indian gift consultant who knows what is trending in India right now.
+
+Recipients:
+{lines}
+
+For EACH recipient id, suggest exactly 10 unique gifts, each from a different category. Be specific ("Noise ColorFit Pro 4 Smartwatch", not "Watch"); everything must be purchasable in India now. Every price must be <= that recipient's budget; aim for 50-100% of it."""
+    return f"""You are a creative Indian gift consultant who stays updated with the latest trends, viral products, and what's popular right now in India.
+
+Recipients:
+{lines}
+
+For EACH recipient, generate exactly 10 UNIQUE and CREATIVE gift recommendations:
+- Be SPECIFIC (e.g. "Noise ColorFit Pro 4 Smartwatch", not "Watch")
+- Mix categories; no two gifts for the same recipient from the same category
+- All gifts must be easily purchasable in India right now
+- STRICT BUDGET RULE: every price MUST be <= that recipient's budget; aim for 50%-100% of it
+
+Return ONLY a JSON object mapping each recipient id to its array, no other text:
+{{
+  "r1": [
+    {{"title": "Specific Gift Name", "gift_type": "Formal|Funky|Romantic|Practical|Traditional|Luxury", "description": "Why it suits them", "price": 1500, "icon": "emoji"}}
+  ]
+}}"""
+
+
+def _packed_personalization_prompt(pack, gifts_by_rid) -> str:
+    blocks = []
+    for rid, args in pack:
+        relationship, occasion, age_group, _vibe, _budget, gender, notes, _types, _city = args
+        who = f"{relationship} ({age_group}{', ' + gender if gender else ''}), occasion: {occasion}"
+        if notes:
+            who += f", note: {notes}"
+        titles = [g.get('title', '') for g in gifts_by_rid[rid][:10]]
+        blocks.append(f"[{rid}] {who}\nGifts: {json.dumps(titles, ensure_ascii=False)}")
+    recipients = "\n\n".join(blocks)
+    if recommend.GEMINI_STRUCTURED:
+        return f"""For each recipient id and each of their gifts, write 2-3 short, punchy, personal reasons joined with " • ". Sound like a friend, not a sales pitch; reference the relationship and occasion. Use each title exactly as given.
+
+{recipients}
+"""
+    return f"""You are a thoughtful gift advisor. For each recipient below and each of their gifts, write 2-3 short, punchy, personal reasons joined with " • ". Sound like a friend, not a sales pitch; reference the relationship and occasion.
+
+{recipients}
+
+Return ONLY a JSON object keyed by recipient id, then by exact gift title, no other text:
+{{"r1": {{"Gift Name": "Reason 1 • Reason 2"}}}}"""
+
+
+def _generate_pack(pack, deadline: float) -> tuple:
+    """Run one packed LLM-1 + LLM-2 round trip before `deadline` (a
+    time.monotonic() value).
+
+    Returns ({rid: [recs]}, reason), reason being "complete",
+    "personalization_late" (LLM-2 did not fit; recs carry LLM-1's
+    descriptions), "deadline" (LLM-1 did not fit) or "ai_failed".
+    """
+    max_tokens = min(_MAX_OUTPUT_TOKENS, _TOKENS_PER_RECIPIENT * len(pack))
+    budgets = {rid: args[4] for rid, args in pack}
+
+    # A pack answer that hits the token cap still gives the earlier
+    # recipients (and the complete gifts of the cut-off one).
+    structured = recommend.GEMINI_STRUCTURED
+    gifts_by_rid = {}
+    left = deadline - time.monotonic()
+    if left < _MIN_CALL_S:
+        return {}, "deadline"
+    response = call_gemini(_packed_recommendation_prompt(pack), max_tokens=max_tokens, timeout=left, stage='batch_llm1',
+                           schema=_packed_schema(pack, GIFTS_SCHEMA) if structured else None)
+    parsed = parse_object(response, 'batch LLM-1')
+    for rid, _ in pack:
+        gifts = parsed.get(rid)
+        if isinstance(gifts, list):
+            gifts = [_clamp_price(g, budgets[rid]) for g in gifts if isinstance(g, dict) and _usable_gift(g)]
+            if gifts:
+                gifts_by_rid[rid] = gifts[:10]
+    if not gifts_by_rid:
+        return {}, "ai_failed"
+
+    live = [(rid, args) for rid, args in pack if rid in gifts_by_rid]
+    reasons, reason = {}, "personalization_late"
+    left = deadline - time.monotonic()
+    if left >= _MIN_CALL_S:
+        response = call_gemini(_packed_personalization_prompt(live, gifts_by_rid),
+                               max_tokens=min(_MAX_OUTPUT_TOKENS, 1500 * len(live)), timeout=left, stage='batch_llm2',
+                               schema=_packed_schema(live, REASONS_SCHEMA) if structured else None)
+        reasons, reason = parse_object(response, 'batch LLM-2'), "complete"
+        if structured:
+            reasons = {rid: _reasons_from_pairs(p for p in pairs if isinstance(p, dict))
+                       for rid, pairs in reasons.items() if isinstance(pairs, list)}
+
+    out = {}
+    for rid, args in live:
+        relationship = args[0]
+        why = reasons.get(rid) if isinstance(reasons.get(rid), dict) else {}
+        out[rid] = [
+            _ai_recommendation(i, g, relationship, budgets[rid], why.get(g.get('title', 'Gift')) or g.get('description', ''))
+            for i, g in enumerate(gifts_by_rid[rid])
+        ]
+    return out, reason
+
+
+def get_batch_recommendations(items: list, deadline_s: 'float | None' = None) -> dict:
+    """Recommendations for every payload in `items`; see module docstring.
+
+    `deadline_s` overrides BATCH_DEADLINE.
+    """
+    deadline = time.monotonic() + (_BATCH_DEADLINE_S if deadline_s is None else deadline_s)
+    results = [None] * len(items)
+    profiles = {}            # cache key -> (args, [indexes])
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "ok": False, "error": "item is not an object"}
+            continue
+        args = _request_args(_sanitize_inputs(item))
+        key = _cache_key(*args)
+        profiles.setdefault(key, (args, []))[1].append(index)
+
+    generated = {}           # cache key -> [recs] or None
+    meta = {}                # cache key -> meta dict
+    todo = []
+    for key, (args, _) in profiles.items():
+        if not recommend.GEMINI_API_KEY:
+            generated[key], meta[key] = None, {"cache": "bypass"}
+            continue
+        cached = RESPONSE_CACHE.get(key)
+        if cached:
+            generated[key], meta[key] = cached, {"cache": "hit"}
+        else:
+            todo.append(key)
+
+    packs = [todo[i:i + _BATCH_PACK_SIZE] for i in range(0, len(todo), _BATCH_PACK_SIZE)]
+
+    def run(pack_keys):
+        pack = []
+        for n, key in enumerate(pack_keys):
+            args = profiles[key][0]
+            # Generate at the band floor so the result is cacheable (see get_recommendations).
+            pack.append((f"r{n + 1}", args[:4] + (_budget_band(args[4]),) + args[5:]))
+        try:
+            by_rid, reason = _generate_pack(pack, deadline)
+        except Exception as exc:
+            print(f"batch pack error: {type(exc).__name__}: {exc}")
+            by_rid, reason = {}, "ai_failed"
+        done = {key: by_rid.get(rid) for key, (rid, _) in zip(pack_keys, pack)}
+        if reason == "complete":
+            for key, recs in done.items():
+                if recs:
+                    RESPONSE_CACHE.set(key, recs)
+        return done, reason
+
+    # Not a `with` block: its exit would wait for packs past the deadline.
+    pool = ThreadPoolExecutor(max_workers=_BATCH_CONCURRENCY)
+    futures = [pool.submit(run, pack_keys) for pack_keys in packs]
+    finished = wait(futures, timeout=max(0.0, deadline - time.monotonic()))[0]
+    pool.shutdown(wait=False, cancel_futures=True)
+    late = 0
+    for pack_keys, fut in zip(packs, futures):
+        done, reason = fut.result() if fut in finished else (dict.fromkeys(pack_keys), "deadline")
+        late += reason in ("deadline", "personalization_late")
+        for key, recs in done.items():
+            generated[key], meta[key] = recs, {"cache": "miss", "batched": True}
+            if recs and reason != "complete":
+                meta[key].update(path="ai", reason=reason)
+            elif not recs:
+                meta[key].update(path="fallback", reason="deadline" if reason == "deadline" else "ai_failed")
+
+    for key, (args, indexes) in profiles.items():
+        for index in indexes:
+            try:
+                result = _response(generated[key], *args[:8], dict(meta[key]), city=args[8])
+                results[index] = {"index": index, "ok": True, "result": result}
+            except Exception as exc:
+                print(f"batch item error: {type(exc).__name__}: {exc}")
+                results[index] = {"index": index, "ok": False, "error": "internal error"}
+
+    return {
+        "results": results,
+        "stats": {
+            "items": len(items),
+            "unique_profiles": len(profiles),
+            "cache_hits": sum(1 for m in meta.values() if m["cache"] == "hit"),
+            "packs": len(packs),
+            "late_packs": late,
+        },
+    }
+
+
+class handler(recommend.handler):
+    """Reuses CORS + JSON helpers, timing and logging from the single-recipient handler."""
+
+    log_event = 'recommend_batch'
+    allow_methods = 'POST, OPTIONS'
+
+    def _do_get(self):
+        self._send_json(405, {"error": "method not allowed"}, {'Allow': self.allow_methods})
+
+    def _do_post(self):
+        try:
+            content_length = int(self.headers.get('Content-Length', 0) or 0)
+        except (TypeError, ValueError):
+            self._send_json(400, {"error": "invalid content-length"})
+            return
+
+        if content_length <= 0:
+            self._send_json(400, {"error": "request body is required"})
+            return
+        if content_length > _MAX_BATCH_BYTES:
+            self._send_json(413, {"error": "request too large"})
+            return
+
+        try:
+            data = json.loads(self.rfile.read(content_length))
+            items = data.get('items') if isinstance(data, dict) else data
+            if not isinstance(items, list) or not items:
+                raise ValueError("items must be a non-empty array")
+        except (json.JSONDecodeError, ValueError, UnicodeDecodeError):
+            self._send_json(400, {"error": "invalid request body"})
+            return
+        if len(items) > _MAX_BATCH_ITEMS:
+            self._send_json(413, {"error": f"at most {_MAX_BATCH_ITEMS} items per batch"})
+            return
+
+        try:
+            result = get_batch_recommendations(items)
+        except Exception as exc:
+            print(f"recommend_batch error: {type(exc).__name__}: {exc}")
+            self._send_json(500, {"error": "internal error"})
+            return
+
+        self._send_json(200, result)
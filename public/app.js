@@ -79,6 +79,7 @@
     notes: "",
     city: "",
     gift_types: ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"],
+    continuation: "",
     saved: loadSaved()
   };
 
@@ -128,6 +129,7 @@
     proTipText:     $("#proTipText"),
     refineBtn:      $("#refineBtn"),
     shareBtn:       $("#shareBtn"),
+    moreBtn:        $("#moreBtn"),
     fab:            $("#fab"),
     fabBadge:       $("#fabBadge"),
     errstateText:   $("#errstateText"),
@@ -354,18 +356,8 @@
         gift_types:   state.gift_types
       };
 
-      const res = await fetch("/api/recommend", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(payload)
-      });
-
+      await fetchStreaming(payload, phaseInterval);
       clearInterval(phaseInterval);
-
-      if (!res.ok) throw new Error(`API ${res.status}`);
-      const data = await res.json();
-      renderResults(data);
-      showStep(7);
     } catch (err) {
       clearInterval(phaseInterval);
       console.error("Submit failed:", err);
@@ -374,6 +366,105 @@
     }
   }
 
+  // The query string canonical_query() (api/recommend.py) builds for these
+  // answers: defaults filled in, whitespace folded, words capitalized,
+  // budget at its band floor, gift_types sorted and omitted when all are
+  // allowed, keys sorted. Sending it as-is skips the API's 308 to it.
+  const QUERY_DEFAULTS = { relationship: "Friend", occasion: "Birthday", age_group: "Adult", vibe: "Traditional" };
+  const QUERY_LIMITS   = { relationship: 50, occasion: 50, age_group: 50, vibe: 50, gender: 30, city: 50 };
+  const BAND_STEPS     = [100, 125, 160, 200, 250, 320, 400, 500, 640, 800];
+  const ALL_GIFT_TYPES = ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"];
+
+  function budgetBand(budget) {
+    let scale = 1;
+    while (budget >= 1000 * scale) scale *= 10;
+    const steps = BAND_STEPS.map(s => s * scale).filter(s => s <= budget);
+    return steps.length ? steps[steps.length - 1] : budget;
+  }
+
+  function capWords(s) {
+    return s.split(/\s+/).filter(Boolean)
+      .map(w => w.charAt(0).toUpperCase() + w.slice(1).toLowerCase()).join(" ");
+  }
+
+  function canonicalQuery(payload) {
+    const params = {};
+    for (const [key, cap] of Object.entries(QUERY_LIMITS)) {
+      const v = String(payload[key] || "").trim().slice(0, cap) || QUERY_DEFAULTS[key] || "";
+      if (v) params[key] = capWords(v);
+    }
+    const budget = parseInt(payload.budget, 10);
+    params.budget = String(budgetBand(Math.max(100, Math.min(isNaN(budget) ? 2000 : budget, 10000000))));
+    const types = [...new Set((payload.gift_types || []).filter(t => ALL_GIFT_TYPES.includes(t)))].sort();
+    if (types.length && types.length < ALL_GIFT_TYPES.length) params.gift_types = types.join(",");
+    // Python's quote(safe=''): encodeURIComponent plus !'()*
+    const quote = (v) => encodeURIComponent(v).replace(/[!'()*]/g, c => "%" + c.charCodeAt(0).toString(16).toUpperCase());
+    return Object.keys(params).sort().map(k => k + "=" + quote(params[k])).join("&");
+  }
+
+  // GET /api/recommend with the answers in the canonical query, so the CDN
+  // can serve repeat profiles. Notes are personal free text and stay out
+  // of URLs (CDN cache keys, proxy logs, Referer): a request with notes is
+  // a POST. Reads the NDJSON stream when the answer is being generated:
+  // cards render as each gift arrives, "reasons" events patch the why-text
+  // in place, and "done" carries the thinking trace + pro tip. A cached
+  // answer comes back as a plain JSON body instead.
+  async function fetchStreaming(payload, phaseInterval) {
+    const accept = { "Accept": "application/x-ndjson" };
+    const res = String(payload.notes || "").trim()
+      ? await fetch("/api/recommend?stream=1", {
+          method: "POST",
+          headers: { ...accept, "Content-Type": "application/json" },
+          body: JSON.stringify(payload)
+        })
+      : await fetch("/api/recommend?" + canonicalQuery(payload), { headers: accept });
+
+    if (!res.ok) throw new Error(`API ${res.status}`);
+
+    const type = res.headers.get("Content-Type") || "";
+    if (!res.body || !type.includes("ndjson")) {
+      clearInterval(phaseInterval);
+      renderResults(await res.json());
+      showStep(7);
+      return;
+    }
+
+    let shown = 0;
+    const handle = (ev) => {
+      if (ev.type === "gift") {
+        if (shown === 0) {
+          clearInterval(phaseInterval);
+          startResults();
+          showStep(7);
+        }
+        appendCard(ev.recommendation, shown++);
+      } else if (ev.type === "reasons") {
+        patchReasons(ev.updates || []);
+      } else if (ev.type === "done") {
+        renderResultsMeta(ev);
+      } else if (ev.type === "error" && shown === 0) {
+        throw new Error("stream error");
+      }
+    };
+
+    const reader  = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = "";
+    for (;;) {
+      const { value, done } = await reader.read();
+      buf += decoder.decode(value || new Uint8Array(), { stream: !done });
+      let nl;
+      while ((nl = buf.indexOf("\n")) >= 0) {
+        const line = buf.slice(0, nl).trim();
+        buf = buf.slice(nl + 1);
+        if (line) handle(JSON.parse(line));
+      }
+      if (done) break;
+    }
+
+    if (shown === 0) throw new Error("empty stream");
+  }
+
   els.retryBtn.addEventListener("click", submit);
 
   const step5Form = $("#step5Form");
@@ -390,11 +481,21 @@
      10. RESULTS RENDER
      ---------------------------------------------------------------------- */
 
-  function renderResults(data) {
+  function startResults() {
     els.rsRelationship.textContent = (state.relationship || "friend").toLowerCase();
     els.rsOccasion.textContent     = state.occasion || "this occasion";
     els.rsBudget.textContent       = formatBudget(state.budget) + " budget";
-    els.thinkingText.textContent   = data.thinking_trace || "";
+    els.thinkingText.textContent   = "";
+    els.proTip.hidden = true;
+    els.resultsGrid.innerHTML = "";
+    state.continuation = "";
+    els.moreBtn.hidden = true;
+  }
+
+  function renderResultsMeta(data) {
+    els.thinkingText.textContent = data.thinking_trace || "";
+    state.continuation = data.continuation || "";
+    els.moreBtn.hidden = !state.continuation;
 
     if (data.pro_tip) {
       els.proTipText.textContent = data.pro_tip;
@@ -402,17 +503,59 @@
     } else {
       els.proTip.hidden = true;
     }
+  }
 
-    const recs = (data.recommendations || []).slice(0, 10);
-    els.resultsGrid.innerHTML = recs.map((r, i) => productCard(r, i)).join("");
+  function renderResults(data) {
+    startResults();
+    renderResultsMeta(data);
 
-    $$(".heart", els.resultsGrid).forEach(btn => {
-      btn.addEventListener("click", () => toggleSave(btn));
-    });
+    const recs = (data.recommendations || []).slice(0, 10);
+    recs.forEach((r, i) => appendCard(r, i));
+  }
 
+  function appendCard(r, i) {
+    els.resultsGrid.insertAdjacentHTML("beforeend", productCard(r, i));
+    const card = els.resultsGrid.lastElementChild;
+    const heart = $(".heart", card);
+    if (heart) heart.addEventListener("click", () => toggleSave(heart));
     updateFab();
   }
 
+  // "More ideas": the continuation token from the last page asks the API
+  // for a few gifts that haven't been shown yet; they append to the grid.
+  async function loadMore() {
+    if (!state.continuation) return;
+    els.moreBtn.disabled = true;
+    els.moreBtn.textContent = "Finding more…";
+    try {
+      const res = await fetch("/api/recommend", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ continuation: state.continuation })
+      });
+      if (!res.ok) throw new Error(`API ${res.status}`);
+      const data = await res.json();
+      (data.recommendations || []).forEach((r, i) => appendCard(r, i));
+      state.continuation = (data.recommendations || []).length ? (data.continuation || "") : "";
+    } catch (err) {
+      console.error("More ideas failed:", err);
+    } finally {
+      els.moreBtn.disabled = false;
+      els.moreBtn.textContent = "More ideas";
+      els.moreBtn.hidden = !state.continuation;
+    }
+  }
+
+  els.moreBtn.addEventListener("click", loadMore);
+
+  function patchReasons(updates) {
+    updates.forEach(u => {
+      const card = $(`.product-card[data-id="${parseInt(u.id, 10)}"]`, els.resultsGrid);
+      const why  = card && $(".card-why", card);
+      if (why && u.why_applicable) why.textContent = u.why_applicable;
+    });
+  }
+
   function productCard(r, i) {
     const id       = r.id ?? (i + 1);
     const title    = r.title || "Gift";
@@ -421,7 +564,7 @@
     const price    = r.approx_price_inr || formatBudget(state.budget);
     const why      = r.why_applicable || r.description || "";
     const links    = r.purchase_links || {};
-    const { primary, secondary } = pickLinks(links, title);
+    const { primary, secondary } = pickLinks(links, title, r.prices_inr || {});
     const isSaved  = state.saved.some(s => s.id === id);
     const animDelay = (i * 55) + "ms";
 
@@ -434,7 +577,7 @@
       : "";
 
     return `
-      <article class="product-card" style="animation-delay:${animDelay}">
+      <article class="product-card" data-id="${escapeAttr(id)}" style="animation-delay:${animDelay}">
         <div class="card-top">
           <div class="card-icon-wrap" aria-hidden="true">${escapeHtml(glyph)}</div>
           <div class="card-body">
@@ -483,10 +626,14 @@
     ["blinkit",      "Blinkit"]
   ];
 
-  function pickLinks(links, title) {
+  // prices_inr holds a price for each merchant whose link is a resolved
+  // product page rather than a search; it goes on the button.
+  function pickLinks(links, title, prices) {
     const valid = LINK_ORDER
       .map(([k, label]) => {
         const url = links[k];
+        const price = Number(prices[k]);
+        if (price > 0) label += " · " + formatBudget(price);
         return (url && isSafeHttpUrl(url)) ? { url, label } : null;
       })
       .filter(Boolean);
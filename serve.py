@@ -0,0 +1,164 @@
+"""Self-hosted entry point: the API on an asyncio server (api/_aserver.py).
+
+    GEMINI_API_KEY=... python serve.py --port 8000
+    python serve.py --host 0.0.0.0 --max-inflight 2000 --max-queue 2000 --grace 25
+    python serve.py --workers 0          # pre-fork one worker per core
+
+Serves POST /api/recommend, POST /api/recommend_batch and GET /healthz;
+put the static files in public/ behind the same load balancer. The same
+environment variables as on Vercel apply. SIGTERM drains in-flight
+requests for up to --grace seconds before exiting.
+
+With --workers N the parent binds the socket, loads the catalog and warm
+set, and forks N workers that accept on the shared socket. What the parent
+loaded is shared copy-on-write (the mmap'd catalog is shared by the page
+cache anyway), and gc.freeze() keeps the collector from touching those
+pages. Unless RECOMMEND_CACHE_URL / GEMINI_QUOTA_URL say otherwise, the
+response cache and the quota window live in shared-memory segments
+(_cache.ShmStore), so a Gemini answer fetched by one worker is a hit in
+every other and the quota is counted once. The quota gets a small segment
+of its own: in the cache's, a full bucket would evict live counters to
+make room for answers. Per-worker buckets get 1/N of
+GEMINI_RPM / GEMINI_TPM. A worker that dies is replaced; SIGTERM is passed
+on to every worker and waited for.
+"""
+import argparse
+import os
+import resource
+import signal
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+
+def _raise_fd_limit() -> int:
+    """Lift the soft open-files limit to the hard one; each in-flight request holds two sockets."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+def _server_kwargs(args) -> dict:
+    return dict(max_inflight=args.max_inflight, max_queue=args.max_queue, grace=args.grace, keepalive=args.keepalive)
+
+
+def prefork(args, workers: int) -> int:
+    """Run `workers` forked servers on one listening socket; see module docstring."""
+    cache_shm = f"shm:///gifting-idea-{os.getpid()}?mb={args.shm_mb}"
+    quota_shm = f"shm:///gifting-idea-{os.getpid()}-quota?mb=1&slot=64"
+    os.environ.setdefault('RECOMMEND_CACHE_URL', cache_shm)
+    os.environ.setdefault('GEMINI_QUOTA_URL', quota_shm)
+    os.environ['RECOMMEND_WORKERS'] = str(workers)
+
+    sock = socket.create_server((args.host, args.port), backlog=2048)
+    import asyncio
+    import gc
+    import _aserver
+    import recommend
+    recommend.get_catalog()
+    recommend.get_warm_set()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid:
+            children[pid] = slot
+            return
+        # Worker: default signal handling until its own loop installs handlers.
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            async def main():
+                await _aserver.AsyncServer(args.host, sock=sock, **_server_kwargs(args)).serve()
+            asyncio.run(main())
+        except BaseException as exc:
+            print(f"worker {os.getpid()} failed: {type(exc).__name__}: {exc}", file=sys.stderr)
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(workers):
+        spawn(slot)
+    print(f"pre-forked {workers} workers on {args.host}:{sock.getsockname()[1]} "
+          f"(cache {os.environ['RECOMMEND_CACHE_URL']})", flush=True)
+
+    started = {slot: time.monotonic() for slot in range(workers)}
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        print(f"worker {pid} exited ({os.waitstatus_to_exitcode(status)}); restarting", file=sys.stderr)
+        if time.monotonic() - started[slot] < 1.0:
+            time.sleep(1.0)              # do not spin on a worker that dies at start
+        started[slot] = time.monotonic()
+        spawn(slot)
+
+    sock.close()
+    from urllib.parse import urlparse
+    from _cache import _shm_path
+    for name, shm in (('RECOMMEND_CACHE_URL', cache_shm), ('GEMINI_QUOTA_URL', quota_shm)):
+        if os.environ[name] != shm:
+            continue
+        try:
+            os.unlink(_shm_path(urlparse(shm)))
+        except FileNotFoundError:
+            pass
+    return 0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--host', default=os.environ.get('HOST', '127.0.0.1'))
+    ap.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    ap.add_argument('--workers', type=int, default=1, help='processes to pre-fork; 0 = one per core')
+    ap.add_argument('--max-inflight', type=int, default=1000, help='requests worked on at once (per worker)')
+    ap.add_argument('--max-queue', type=int, default=1000, help='requests waiting for a slot before 503s')
+    ap.add_argument('--grace', type=float, default=25.0, help='seconds to drain on SIGTERM')
+    ap.add_argument('--keepalive', type=float, default=15.0, help='idle keep-alive timeout, seconds')
+    ap.add_argument('--shm-mb', type=int, default=64, help='shared cache segment size with --workers')
+    args = ap.parse_args()
+
+    fds = _raise_fd_limit()
+    if fds != resource.RLIM_INFINITY and fds < 2 * args.max_inflight + 64:
+        print(f"warning: open-files limit {fds} is low for --max-inflight {args.max_inflight}", file=sys.stderr)
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    if workers > 1:
+        return prefork(args, workers)
+
+    import _aserver
+    _aserver.run(args.host, args.port, **_server_kwargs(args))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
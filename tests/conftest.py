@@ -0,0 +1,7 @@
+import os
+
+# recommend.py reads its configuration at import: the suite runs it without
+# Gemini (the rule-based path) and without any shared tier or resolver.
+for name in ('GEMINI_API_KEY', 'RECOMMEND_CACHE_URL', 'GEMINI_QUOTA_URL', 'PRODUCT_RESOLVER_URL',
+             'GEMINI_CONTEXT_CACHE', 'GIFT_CATALOG_PATH'):
+    os.environ.pop(name, None)
@@ -0,0 +1,167 @@
+import http.client
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import recommend
+import recommend_batch
+from _cache import ResponseCache
+
+MOTHER = {"relationship": "Mother", "occasion": "Diwali", "budget": 2000}
+
+
+def _gifts(rid):
+    return [{"title": f"{rid} gift {i}", "gift_type": "Traditional", "description": f"desc {i}", "price": 1500,
+             "icon": "*"} for i in range(10)]
+
+
+class FakeGemini:
+    """Answers packed prompts: LLM-1 gifts and LLM-2 reasons for every id in the prompt."""
+
+    def __init__(self):
+        self.calls = []
+        self.delay = {}      # stage -> seconds, or an Event to wait for
+
+    def __call__(self, prompt, max_tokens=2048, timeout=None, stage='gemini', schema=None, **kwargs):
+        self.calls.append((stage, timeout))
+        delay = self.delay.get(stage)
+        if isinstance(delay, threading.Event):
+            delay.wait(5)
+        elif delay:
+            time.sleep(delay)
+        rids = re.findall(r'^\[(r\d+)\]', prompt, re.M)
+        if stage == 'batch_llm1':
+            return json.dumps({rid: _gifts(rid) for rid in rids})
+        return json.dumps({rid: {g["title"]: f"reason for {g['title']}" for g in _gifts(rid)} for rid in rids})
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    fake = FakeGemini()
+    monkeypatch.setattr(recommend, 'GEMINI_API_KEY', 'test')
+    monkeypatch.setattr(recommend, 'GEMINI_STRUCTURED', False)
+    monkeypatch.setattr(recommend_batch, 'RESPONSE_CACHE', ResponseCache())
+    monkeypatch.setattr(recommend_batch, 'call_gemini', fake)
+    return fake
+
+
+def test_without_a_key_every_item_falls_back():
+    out = recommend_batch.get_batch_recommendations([MOTHER, {**MOTHER, "relationship": "Father"}])
+    assert [r["ok"] for r in out["results"]] == [True, True]
+    assert {r["result"]["meta"]["reason"] for r in out["results"]} == {"no_api_key"}
+    assert out["stats"]["packs"] == 0
+
+
+def test_identical_profiles_are_generated_once(gemini):
+    items = [MOTHER, {"relationship": " mother", "occasion": "DIWALI", "budget": 2400}, {**MOTHER, "notes": "likes tea"}]
+    out = recommend_batch.get_batch_recommendations(items)
+    assert out["stats"]["unique_profiles"] == 2 and out["stats"]["packs"] == 1
+    first, second, third = (r["result"]["recommendations"] for r in out["results"])
+    assert first == second and first != third
+    assert [r["index"] for r in out["results"]] == [0, 1, 2]
+
+
+def test_profiles_are_packed_and_cached(gemini, monkeypatch):
+    monkeypatch.setattr(recommend_batch, '_BATCH_PACK_SIZE', 3)
+    items = [{**MOTHER, "notes": f"note {i}"} for i in range(7)]
+    out = recommend_batch.get_batch_recommendations(items)
+    assert out["stats"]["packs"] == 3 and out["stats"]["late_packs"] == 0
+    assert [stage for stage, _ in gemini.calls].count('batch_llm1') == 3 and len(gemini.calls) == 6
+    assert all(r["result"]["ai_powered"] for r in out["results"])
+    rec = out["results"][0]["result"]["recommendations"][0]
+    assert rec["why_applicable"].startswith("reason for ")
+
+    again = recommend_batch.get_batch_recommendations(items)
+    assert again["stats"]["cache_hits"] == 7 and again["stats"]["packs"] == 0 and len(gemini.calls) == 6
+
+
+def test_calls_get_only_the_time_left(gemini):
+    recommend_batch.get_batch_recommendations([MOTHER], deadline_s=30)
+    assert all(0 < timeout <= 30 for _, timeout in gemini.calls)
+
+
+def test_deadline_falls_back_per_item_and_late_calls_still_cache(gemini, monkeypatch):
+    monkeypatch.setattr(recommend_batch, '_MIN_CALL_S', 0)
+    release = gemini.delay['batch_llm2'] = threading.Event()
+    out = recommend_batch.get_batch_recommendations([MOTHER], deadline_s=0.1)
+    result = out["results"][0]["result"]
+    assert not result["ai_powered"] and result["recommendations"]
+    assert result["meta"]["reason"] == "deadline" and out["stats"]["late_packs"] == 1
+
+    release.set()
+    key = recommend._cache_key(*recommend._request_args(recommend._sanitize_inputs(MOTHER)))
+    until = time.monotonic() + 5
+    while recommend_batch.RESPONSE_CACHE.get(key) is None and time.monotonic() < until:
+        time.sleep(0.01)
+    assert recommend_batch.RESPONSE_CACHE.get(key) is not None
+
+
+def test_packs_that_cannot_start_in_time_are_not_sent(gemini):
+    out = recommend_batch.get_batch_recommendations([MOTHER], deadline_s=recommend_batch._MIN_CALL_S / 2)
+    assert out["results"][0]["result"]["meta"]["reason"] == "deadline" and gemini.calls == []
+
+
+def test_personalization_is_skipped_when_it_would_not_fit(gemini, monkeypatch):
+    monkeypatch.setattr(recommend_batch, '_MIN_CALL_S', 0.3)
+    gemini.delay['batch_llm1'] = 0.3
+    out = recommend_batch.get_batch_recommendations([MOTHER], deadline_s=0.5)
+    result = out["results"][0]["result"]
+    assert result["ai_powered"] and result["meta"]["reason"] == "personalization_late"
+    assert [stage for stage, _ in gemini.calls] == ['batch_llm1']
+    assert result["recommendations"][0]["why_applicable"] == "desc 0"
+    assert recommend_batch.RESPONSE_CACHE.get(
+        recommend._cache_key(*recommend._request_args(recommend._sanitize_inputs(MOTHER)))) is None
+
+
+def test_item_errors_stay_with_their_item(gemini, monkeypatch):
+    real = recommend_batch._response
+
+    def response(recommendations, relationship, *args, **kwargs):
+        if relationship == 'Father':
+            raise RuntimeError("boom")
+        return real(recommendations, relationship, *args, **kwargs)
+
+    monkeypatch.setattr(recommend_batch, '_response', response)
+    out = recommend_batch.get_batch_recommendations([MOTHER, "not a dict", {**MOTHER, "relationship": "Father"}])
+    assert [(r["ok"], r.get("error")) for r in out["results"]] == [
+        (True, None), (False, "item is not an object"), (False, "internal error")]
+
+
+@pytest.fixture(scope='module')
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), recommend_batch.handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _post(address, body: bytes, method='POST', length=None):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.putrequest(method, '/api/recommend_batch')
+        conn.putheader('Content-Type', 'application/json')
+        conn.putheader('Content-Length', str(len(body) if length is None else length))
+        conn.endheaders(body)
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read() or b'null')
+    finally:
+        conn.close()
+
+
+def test_handler_limits(server):
+    assert _post(server, json.dumps([MOTHER] * recommend_batch._MAX_BATCH_ITEMS).encode())[0] == 200
+    assert _post(server, json.dumps([MOTHER] * (recommend_batch._MAX_BATCH_ITEMS + 1)).encode())[0] == 413
+    assert _post(server, b'', length=recommend_batch._MAX_BATCH_BYTES + 1)[0] == 413
+    assert _post(server, b'{"items": []}')[0] == 400
+    assert _post(server, b'not json')[0] == 400
+    assert _post(server, b'', method='GET')[0] == 405
+
+
+def test_handler_answers_items_in_order(server):
+    status, body = _post(server, json.dumps({"items": [MOTHER, 7]}).encode())
+    assert status == 200 and [r["ok"] for r in body["results"]] == [True, False]
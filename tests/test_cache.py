@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+import _aserver
+import recommend
+from _cache import ResponseCache, TTLCache
+from _timing import Timings
+
+
+def test_entries_expire_after_their_ttl():
+    cache = TTLCache(ttl=60)
+    cache.set('fresh', 1)
+    cache.set('stale', 2, ttl=0)
+    assert cache.get('fresh') == 1 and cache.get('stale') is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "evictions": 0, "expirations": 1}
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()["evictions"] == 1
+
+
+class DictStore:
+    def __init__(self, broken=False):
+        self.data, self.ttls, self.broken = {}, {}, broken
+
+    def get(self, key):
+        if self.broken:
+            raise ConnectionError("down")
+        return self.data.get(key)
+
+    def set(self, key, raw, ttl):
+        if self.broken:
+            raise ConnectionError("down")
+        self.data[key], self.ttls[key] = raw, ttl
+
+
+def test_each_hit_is_a_fresh_copy():
+    cache = ResponseCache()
+    cache.set('k', [{"title": "Diya"}])
+    cache.get('k')[0]["title"] = "changed"
+    assert cache.get('k') == [{"title": "Diya"}]
+
+
+def test_shared_tier_fills_the_local_one_with_the_cache_ttl():
+    store = DictStore()
+    ResponseCache(ttl=600, shared=store).set('k', [1])
+    assert store.ttls['k'] == 600
+    other = ResponseCache(shared=store)
+    assert other.get('k') == [1] and other.get('k') == [1]
+    assert other.stats()["shared_hits"] == 1 and other.stats()["hits"] == 1
+
+
+def test_a_broken_shared_tier_is_a_miss():
+    cache = ResponseCache(shared=DictStore(broken=True))
+    cache.set('k', [1])
+    assert cache.get('k') == [1]          # the local tier still has it
+    assert cache.get('other') is None
+    assert cache.stats()["shared_errors"] == 2
+
+
+@pytest.mark.parametrize('budget, band', [
+    (99, 99), (100, 100), (124, 100), (125, 125), (999, 800), (1000, 1000), (1999, 1600), (2000, 2000),
+    (2499, 2000), (2500, 2500), (10_000_000, 10_000_000),
+])
+def test_budget_band(budget, band):
+    assert recommend._budget_band(budget) == band
+
+
+PROFILE = ("Mother", "Diwali", "Adult", "Traditional")
+
+
+@pytest.fixture
+def generations(monkeypatch):
+    """get_recommendations with a fresh cache; records the budget each generation ran at."""
+    cache = ResponseCache()
+    budgets = []
+
+    def generation(*args, **kwargs):
+        budgets.append(args[4])
+        return [{"title": "Brass Diya Set", "description": "d", "price": args[4], "why_applicable": "w"}]
+        yield
+
+    monkeypatch.setattr(recommend, 'GEMINI_API_KEY', 'test')
+    monkeypatch.setattr(recommend, 'RESPONSE_CACHE', cache)
+    monkeypatch.setitem(recommend._OPS, 'cache_get', cache.get)
+    monkeypatch.setitem(recommend._OPS, 'cache_set', cache.set)
+    monkeypatch.setattr(recommend, '_generation', generation)
+    monkeypatch.setattr(recommend, 'get_warm_set', lambda: None)
+    return budgets
+
+
+def test_one_cached_set_serves_its_whole_band(generations):
+    first = recommend.get_recommendations(*PROFILE, 2400)
+    assert first["meta"]["cache"] == "miss" and generations == [2000]
+    for budget in (2000, 2100, 2499):
+        result = recommend.get_recommendations(*PROFILE, budget)
+        assert result["meta"]["cache"] == "hit"
+        assert all(r["price"] <= budget for r in result["recommendations"])
+    assert recommend.get_recommendations(*PROFILE, 2500)["meta"]["cache"] == "miss"
+    assert generations == [2000, 2500]
+
+
+def test_counters_reach_healthz_and_the_request_log(capsys):
+    recommend.RESPONSE_CACHE.get('rec:v1:never-set')
+    health = _aserver.AsyncServer().stats()["response_cache"]
+    assert health == recommend.RESPONSE_CACHE.stats() and health["misses"] >= 1
+    recommend._log_request('recommend', Timings(), {"status": 200})
+    assert json.loads(capsys.readouterr().out)["response_cache"] == recommend.RESPONSE_CACHE.stats()
@@ -0,0 +1,124 @@
+import random
+
+import pytest
+
+import recommend
+from _catalog import Catalog, get_catalog, write_binary
+
+
+def _items():
+    return [
+        {"title": "Cheap Funky", "gift_type": "Funky", "price_min": 100, "price_max": 400,
+         "categories": ["modern"], "audience": ["adult"]},
+        {"title": "Mid Funky", "gift_type": "Funky", "price_min": 500, "price_max": 1500,
+         "categories": ["modern"], "audience": ["adult"]},
+        {"title": "Mid Formal", "gift_type": "Formal", "price_min": 600, "price_max": 1400,
+         "categories": ["luxury"], "audience": ["adult"]},
+        {"title": "Mid Toy", "gift_type": "Funky", "price_min": 500, "price_max": 1500,
+         "categories": ["kids"], "audience": ["child"]},
+        {"title": "Pricey Funky", "gift_type": "Funky", "price_min": 4000, "price_max": 9000,
+         "categories": ["modern"], "audience": ["adult"]},
+        {"title": "Pricey Formal", "gift_type": "Formal", "price_min": 3000, "price_max": 12000,
+         "categories": ["luxury"], "audience": ["adult"]},
+    ]
+
+
+@pytest.fixture(params=['records', 'binary'])
+def catalog(request, tmp_path):
+    if request.param == 'records':
+        return Catalog.from_records(_items())
+    path = str(tmp_path / 'cat.bin')
+    write_binary(_items(), {}, path)
+    return Catalog.open(path)
+
+
+def titles(cat, ids):
+    return [cat.titles[i] for i in ids]
+
+
+def test_price_index_is_sorted_and_ranked(catalog):
+    keys = list(catalog.price_keys)
+    assert keys == sorted(keys)
+    for i in range(len(catalog)):
+        assert catalog.price_order[catalog.price_rank[i]] == i
+    assert catalog.price_of(catalog.id_of("Cheap Funky")) == 200
+
+
+def test_select_prefers_the_budget_band(catalog):
+    ids = catalog.select(1000, ["modern"], ["Funky", "Formal"], random.Random(1), audience="adult", count=2)
+    assert set(titles(catalog, ids)) == {"Mid Funky", "Mid Formal"}
+
+
+def test_gift_types_are_a_hard_filter(catalog):
+    ids = catalog.select(1000, ["modern"], ["Formal"], random.Random(1), audience="adult", count=10)
+    assert titles(catalog, ids) == ["Mid Formal", "Pricey Formal"]
+
+
+def test_unknown_gift_types_widen_to_everything(catalog):
+    ids = catalog.select(1000, ["modern"], ["Nonexistent"], random.Random(1), audience="adult", count=10)
+    assert len(ids) == 6
+    assert titles(catalog, ids)[-1] == "Mid Toy"     # the other audience only fills the page
+
+
+def test_audience_first_then_filled_from_categories(catalog):
+    ids = catalog.select(1000, ["kids", "modern"], ["Funky"], random.Random(1), audience="child", count=3)
+    assert titles(catalog, ids)[0] == "Mid Toy"
+    assert set(titles(catalog, ids)[1:]) == {"Mid Funky", "Cheap Funky"}
+
+
+def test_over_budget_only_after_affordable_and_cheapest_first(catalog):
+    ids = catalog.select(150, ["modern"], ["Funky"], random.Random(1), audience="adult", count=3)
+    assert titles(catalog, ids) == ["Cheap Funky", "Mid Funky", "Pricey Funky"]
+    assert catalog.price_for(catalog.id_of("Mid Funky"), 150) == 500
+
+
+def test_exclude(catalog):
+    first = catalog.select(1000, ["modern"], ["Funky", "Formal"], random.Random(1), audience="adult", count=2)
+    rest = catalog.select(1000, ["modern"], ["Funky", "Formal"], random.Random(1), audience="adult", count=10,
+                          exclude=first)
+    assert not set(first) & set(rest)
+    assert len(first) + len(rest) == 6
+
+
+# The shipped catalog, against what the fallback returned before prices were
+# added: the same gift-type and audience guarantees, and full pages.
+
+def fallback(*args, gift_types=None):
+    return recommend.get_fallback_recommendations(*args, gift_types=gift_types)
+
+
+def test_fallback_keeps_only_requested_gift_types():
+    recs = fallback("Wife", "Anniversary", "Adult", "Luxury", 5000, "", "", gift_types=["Romantic"])
+    assert {r["title"] for r in recs} == {"Perfume Gift Set", "Customized Photo Frame", "Heart-shaped Jewelry",
+                                          "Couple Keychains", "Love Letter Kit", "Couple Watches"}
+    for gift_types in (["Traditional"], ["Funky"]):
+        recs = fallback("Mother", "Diwali", "Adult", "Traditional", 2500, "", "", gift_types=gift_types)
+        assert len(recs) == 10
+        assert {r["gift_type"] for r in recs} == set(gift_types)
+
+
+def test_fallback_child_gets_a_full_page_of_childrens_gifts_first():
+    catalog = get_catalog()
+    recs = fallback("Son", "Birthday", "Child", "Fun", 500, "Male", "")
+    assert len(recs) == 10
+    kids = set(catalog.by_audience["child_male"])
+    head = [catalog.id_of(r["title"]) in kids for r in recs]
+    assert all(head[:len(kids)])
+
+
+def test_fallback_tiny_budget_still_follows_the_relationship():
+    recs = fallback("Boss", "Promotion", "Adult", "", 100, "", "")
+    assert len(recs) == 10
+    assert "Romantic" not in {r["gift_type"] for r in recs}
+    catalog = get_catalog()
+    for r in recs:
+        i = catalog.id_of(r["title"])
+        assert int(r["approx_price_inr"][3:].replace(',', '')) >= catalog.price_min[i] // 50 * 50
+
+
+def test_fallback_prices_stay_within_budget_when_items_fit():
+    catalog = get_catalog()
+    for r in fallback("Friend", "Birthday", "Adult", "Modern", 3000, "", ""):
+        i = catalog.id_of(r["title"])
+        if catalog.price_min[i] <= 3000:
+            assert int(r["approx_price_inr"][3:].replace(',', '')) <= 3000
@@ -0,0 +1,89 @@
+import base64
+import json
+import zlib
+
+import pytest
+
+import recommend
+
+PROFILE = recommend._request_args(recommend._sanitize_inputs(
+    {"relationship": "Mother", "occasion": "Diwali", "budget": "2000", "gift_types": ["Traditional"]}
+))
+
+
+def _token(state):
+    raw = zlib.compress(json.dumps(state).encode('utf-8'))
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def test_round_trip():
+    token = recommend.continuation_token(PROFILE, ["Brass Diya Set", "Silk Saree"])
+    assert '=' not in token and '+' not in token and '/' not in token
+    clean, shown, total = recommend.read_continuation(token)
+    assert recommend._request_args(clean) == PROFILE
+    assert shown == ["Brass Diya Set", "Silk Saree"] and total == 2
+
+
+def test_next_token_appends_to_what_was_shown():
+    first = recommend.continuation_token(PROFILE, ["A", "B"])
+    _, shown, total = recommend.read_continuation(first)
+    second = recommend.continuation_token(PROFILE, ["C"], (shown, 1, total))
+    assert recommend.read_continuation(second)[1:] == (["A", "B", "C"], 3)
+
+
+def test_shown_titles_are_capped_but_counted():
+    titles = [f"Gift {i}" for i in range(recommend._MORE_MAX_SHOWN + 5)]
+    _, shown, total = recommend.read_continuation(recommend.continuation_token(PROFILE, titles))
+    assert shown == titles[-recommend._MORE_MAX_SHOWN:]
+    assert total == len(titles)
+
+
+@pytest.mark.parametrize('token', [
+    '',
+    'not a token',
+    base64.urlsafe_b64encode(b'plain text').decode('ascii'),
+    _token({"p": list(PROFILE)}),
+    _token({"p": ["Mother"], "s": [], "n": 0}),
+    _token({"p": list(PROFILE), "s": "A", "n": 1}),
+    _token({"p": list(PROFILE), "s": [], "n": "many"}),
+])
+def test_invalid_token_raises_value_error(token):
+    with pytest.raises(ValueError):
+        recommend.read_continuation(token)
+
+
+def test_oversized_token_is_refused():
+    token = _token({"p": list(PROFILE), "s": ["x" * 100] * 10_000, "n": 0})
+    with pytest.raises(ValueError):
+        recommend.read_continuation(token)
+
+
+def test_tampered_token_is_sanitized_again():
+    profile = ["Mother <script>" * 50, "Diwali", "Adult", "Traditional", 10 ** 12, "", "", ["Bogus"], ""]
+    clean, shown, total = recommend.read_continuation(_token({"p": profile, "s": ["t" * 500, 7], "n": -3}))
+    assert len(clean["relationship"]) <= recommend._LIMITS["relationship"]
+    assert clean["budget"] == 10_000_000 and clean["gift_types"] is None
+    assert shown == ["t" * 120] and total == 1
+
+
+def test_more_continues_the_fallback_selection():
+    profile = recommend._request_args(recommend._sanitize_inputs({"relationship": "Mother", "occasion": "Diwali"}))
+    first = recommend.get_recommendations(*profile)
+    assert first["meta"]["reason"] == "no_api_key"
+    titles = [r["title"] for r in first["recommendations"]]
+
+    page = recommend.get_more_recommendations(first["continuation"], 3)
+    new = [r["title"] for r in page["recommendations"]]
+    assert len(new) == 3 and not set(new) & set(titles)
+    assert [r["id"] for r in page["recommendations"]] == [len(titles) + 1, len(titles) + 2, len(titles) + 3]
+    assert page["meta"]["page"] == {"shown": len(titles), "count": 3}
+
+    _, shown, total = recommend.read_continuation(page["continuation"])
+    assert shown == titles + new and total == len(titles) + 3
+
+
+@pytest.mark.parametrize('count, expected', [(None, recommend.MORE_COUNT), (0, recommend.MORE_COUNT), (50, 10),
+                                             ('x', recommend.MORE_COUNT)])
+def test_more_count_is_clamped(count, expected):
+    token = recommend.continuation_token(PROFILE, [])
+    assert recommend.get_more_recommendations(token, count)["meta"]["page"]["count"] == expected
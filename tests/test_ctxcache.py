@@ -0,0 +1,174 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import recommend
+from _ctxcache import ContextCache
+from _gemini import GeminiError
+from _ratelimit import AdmissionController
+from _steps import run
+
+INSTRUCTIONS = "You are a gift expert. " * 50
+
+
+def _expire_time(seconds: float) -> str:
+    stamp = datetime.fromtimestamp(time.time() + seconds, timezone.utc)
+    return stamp.strftime('%Y-%m-%dT%H:%M:%S.%f') + '123Z'     # nanoseconds, as the API sends
+
+
+class FakeClient:
+    model = 'models/fake'
+
+    def __init__(self, lifetime=3600.0, min_tokens=0):
+        self.lifetime = lifetime
+        self.min_tokens = min_tokens
+        self.created, self.updated = [], []
+        self.gone = set()
+
+    def _resource(self, name):
+        return {"name": name, "expireTime": _expire_time(self.lifetime),
+                "usageMetadata": {"totalTokenCount": len(INSTRUCTIONS) // 4}}
+
+    def create_cached_content(self, body):
+        if len(body["systemInstruction"]["parts"][0]["text"]) // 4 < self.min_tokens:
+            raise GeminiError(400, b'Cached content is too small')
+        self.created.append(body)
+        return self._resource(f"cachedContents/c{len(self.created)}")
+
+    def update_cached_content(self, name, ttl):
+        if name in self.gone:
+            raise GeminiError(403, b'permission denied or not found')
+        self.updated.append(name)
+        return self._resource(name)
+
+
+def _settle(cache):
+    """Wait for the background create / update started by lookup()."""
+    until = time.monotonic() + 5
+    while any(e["busy"] for e in cache._entries.values()) and time.monotonic() < until:
+        time.sleep(0.001)
+
+
+def test_first_lookup_creates_in_the_background():
+    client = FakeClient()
+    cache = ContextCache(client)
+    assert cache.lookup(INSTRUCTIONS) is None      # never waits on the API
+    _settle(cache)
+    assert cache.lookup(INSTRUCTIONS) == 'cachedContents/c1'
+    assert client.created[0]["systemInstruction"]["parts"][0]["text"] == INSTRUCTIONS
+    assert client.created[0]["ttl"] == '3600s'
+    assert cache.stats()["created"] == 1 and cache.stats()["live"] == 1
+
+
+def test_refreshes_before_expiry_without_dropping_the_name():
+    client = FakeClient(lifetime=100)
+    cache = ContextCache(client, refresh_before=300)
+    cache.lookup(INSTRUCTIONS)
+    _settle(cache)
+    assert cache.lookup(INSTRUCTIONS) == 'cachedContents/c1'   # still usable while the update runs
+    _settle(cache)
+    assert client.updated == ['cachedContents/c1']
+    assert len(client.created) == 1 and cache.stats()["refreshed"] >= 1
+
+
+def test_not_handed_out_inside_the_safety_margin():
+    client = FakeClient(lifetime=10)
+    cache = ContextCache(client, refresh_before=0)
+    cache.lookup(INSTRUCTIONS)
+    _settle(cache)
+    assert cache.lookup(INSTRUCTIONS) is None
+    _settle(cache)
+    assert client.updated == ['cachedContents/c1']
+
+
+def test_expired_resource_is_created_again():
+    client = FakeClient(lifetime=-1)
+    cache = ContextCache(client)
+    cache.lookup(INSTRUCTIONS)
+    _settle(cache)
+    assert cache.lookup(INSTRUCTIONS) is None
+    _settle(cache)
+    assert client.updated == [] and len(client.created) == 2
+
+
+def test_update_of_a_vanished_resource_creates_a_new_one():
+    client = FakeClient(lifetime=100)
+    cache = ContextCache(client, refresh_before=300)
+    cache.lookup(INSTRUCTIONS)
+    _settle(cache)
+    client.gone.add('cachedContents/c1')
+    cache.lookup(INSTRUCTIONS)
+    _settle(cache)
+    assert cache._entries[next(iter(cache._entries))]["name"] == 'cachedContents/c2'
+    assert len(client.created) == 2
+
+
+def test_refused_create_waits_retry_after():
+    client = FakeClient(min_tokens=10 ** 6)
+    cache = ContextCache(client, retry_after=600)
+    assert cache.lookup(INSTRUCTIONS) is None
+    _settle(cache)
+    assert cache.lookup(INSTRUCTIONS) is None
+    _settle(cache)
+    assert cache.stats()["failures"] == 1      # not retried before retry_after
+
+
+def test_invalidate_forgets_the_name():
+    cache = ContextCache(FakeClient())
+    cache.lookup(INSTRUCTIONS)
+    _settle(cache)
+    cache.invalidate('cachedContents/c1')
+    assert cache.stats()["invalidated"] == 1
+    assert cache.lookup(INSTRUCTIONS) is None
+
+
+def _prompt():
+    return recommend._Prompt(INSTRUCTIONS, "Recipient: Mother, Diwali, Rs.2,000")
+
+
+def _answer():
+    return {"candidates": [{"content": {"parts": [{"text": "[]"}]}}], "usageMetadata": {"promptTokenCount": 5}}
+
+
+@pytest.fixture
+def context_cache(monkeypatch):
+    def install(client):
+        cache = ContextCache(client)
+        monkeypatch.setattr(recommend, 'CONTEXT_CACHE', cache)
+        monkeypatch.setattr(recommend, 'GEMINI_API_KEY', 'test')
+        monkeypatch.setattr(recommend, 'ADMISSION', AdmissionController())
+        cache.lookup(_prompt().instructions)
+        _settle(cache)
+        return cache
+    return install
+
+
+def test_body_uses_the_cache_once_live(context_cache):
+    context_cache(FakeClient())
+    body = recommend._gemini_body(_prompt(), 100)
+    assert body["cachedContent"] == 'cachedContents/c1'
+    assert body["contents"][0]["parts"][0]["text"] == _prompt().context
+
+
+def test_refused_cache_sends_the_plain_prompt(context_cache):
+    context_cache(FakeClient(min_tokens=10 ** 6))
+    body = recommend._gemini_body(_prompt(), 100)
+    assert 'cachedContent' not in body
+    assert body["contents"][0]["parts"][0]["text"] == str(_prompt())
+
+
+def test_403_on_a_cached_call_resends_in_full(context_cache):
+    cache = context_cache(FakeClient())
+    bodies = []
+
+    def generate(body, timeout, hedge_after, trace):
+        bodies.append(body)
+        if 'cachedContent' in body:
+            raise GeminiError(403, b'CachedContent not found (or permission denied)')
+        return _answer()
+
+    ops = {'admit': lambda estimate, max_wait: True, 'generate': generate, 'settle': lambda estimate, actual: None}
+    assert run(recommend._gemini_call(_prompt(), 100, timeout=10, stage='test'), ops) == '[]'
+    assert [('cachedContent' in b) for b in bodies] == [True, False]
+    assert cache.stats()["invalidated"] == 1
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from _enrich import LinkEnricher, StubResolver, normalize_title, resolver_from_url
+
+MERCHANTS = ['amazon', 'flipkart']
+
+
+def _recs(*titles):
+    return [{"title": t, "price": 999} for t in titles]
+
+
+def _wait_idle(enricher):
+    until = time.monotonic() + 5
+    while enricher.stats()["pending"] and time.monotonic() < until:
+        time.sleep(0.001)
+
+
+def test_resolves_every_merchant_and_caches_by_title():
+    resolver = StubResolver()
+    enricher = LinkEnricher(resolver, MERCHANTS, deadline_s=2)
+    out, stats = enricher.enrich(_recs("Brass Diya Set", "Silk Saree"))
+    assert [sorted(r["products"]) for r in out] == [MERCHANTS, MERCHANTS]
+    assert all(p["url"].startswith('https://') for r in out for p in r["products"].values())
+    assert stats["resolved"] == 4 and stats["looked_up"] == 4 and stats["late"] == 0
+
+    again, stats = enricher.enrich(_recs("  brass DIYA set "))
+    assert again[0]["products"] == out[0]["products"]
+    assert stats["cached"] == 2 and stats["looked_up"] == 0
+    assert resolver.calls == 4
+
+
+def test_misses_keep_the_search_url_and_are_cached():
+    resolver = StubResolver(miss=1.0)
+    enricher = LinkEnricher(resolver, MERCHANTS, deadline_s=2)
+    out, stats = enricher.enrich(_recs("Brass Diya Set"))
+    assert "products" not in out[0] and stats["resolved"] == 0
+    _, stats = enricher.enrich(_recs("Brass Diya Set"))
+    assert stats["cached"] == 2 and resolver.calls == 2
+    assert enricher.stats()["found"] == 0
+
+
+def test_failed_lookups_are_not_cached():
+    calls = []
+
+    def flaky(title, merchant):
+        calls.append(merchant)
+        raise OSError("resolver down")
+
+    enricher = LinkEnricher(flaky, MERCHANTS, deadline_s=2)
+    enricher.enrich(_recs("Brass Diya Set"))
+    enricher.enrich(_recs("Brass Diya Set"))
+    assert len(calls) == 4 and enricher.stats()["errors"] == 4
+
+
+def test_deadline_leaves_late_lookups_running():
+    release = threading.Event()
+
+    def slow(title, merchant):
+        release.wait(5)
+        return {"url": f"https://example.com/{merchant}", "price_inr": 500}
+
+    enricher = LinkEnricher(slow, MERCHANTS, deadline_s=0.02)
+    out, stats = enricher.enrich(_recs("Brass Diya Set"))
+    assert "products" not in out[0] and stats["late"] == 2
+    release.set()
+    _wait_idle(enricher)
+    out, stats = enricher.enrich(_recs("Brass Diya Set"), deadline_s=0)
+    assert sorted(out[0]["products"]) == MERCHANTS and stats["looked_up"] == 0
+
+
+def test_sheds_past_max_pending_and_shares_identical_lookups():
+    release = threading.Event()
+
+    def blocked(title, merchant):
+        release.wait(5)
+        return None
+
+    enricher = LinkEnricher(blocked, MERCHANTS, workers=2, max_pending=3, deadline_s=0)
+    _, first = enricher.enrich(_recs("A", "B", "C"))
+    assert first["looked_up"] == 3 and enricher.stats()["shed"] == 3
+    _, again = enricher.enrich(_recs("A", "C"))     # A's two are in flight: shared; C's are shed
+    assert again["looked_up"] == 2 and enricher.stats()["lookups"] == 3 and enricher.stats()["shed"] == 5
+    release.set()
+    _wait_idle(enricher)
+    _, after = enricher.enrich(_recs("C"))
+    assert after["looked_up"] == 2 and enricher.stats()["lookups"] == 5
+
+
+@pytest.mark.parametrize('value', [
+    {"url": "http://insecure.example/p", "price_inr": 10},
+    {"price_inr": 10},
+    "https://example.com/p",
+])
+def test_unusable_answers_count_as_no_product(value):
+    enricher = LinkEnricher(lambda title, merchant: value, ['amazon'], deadline_s=2)
+    out, _ = enricher.enrich(_recs("Brass Diya Set"))
+    assert "products" not in out[0]
+
+
+def test_resolver_from_url():
+    assert resolver_from_url('') is None
+    stub = resolver_from_url('stub://?latency_ms=40&miss=0.25')
+    assert isinstance(stub, StubResolver) and stub.latency_s == 0.04 and stub.miss == 0.25
+    with pytest.raises(ValueError):
+        resolver_from_url('ftp://resolver')
+
+
+def test_normalize_title():
+    assert normalize_title("  Brass\tDiya  SET ") == "brass diya set"
+    assert normalize_title(None) == ""
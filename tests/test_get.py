@@ -0,0 +1,124 @@
+import asyncio
+import http.client
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import _aserver
+import recommend
+
+CANONICAL = 'age_group=Adult&budget=2000&occasion=Diwali&relationship=Mother&vibe=Traditional'
+
+
+def _canonical(data):
+    return recommend.canonical_query(recommend._sanitize_inputs(data))
+
+
+def test_equivalent_queries_share_one_canonical_form():
+    variants = [
+        {"relationship": "Mother", "occasion": "Diwali", "budget": "2000"},
+        {"relationship": "  mother ", "occasion": "DIWALI", "budget": "2400", "age_group": "adult"},
+        {"relationship": "Mother", "occasion": "Diwali", "budget": 2001, "vibe": "traditional",
+         "gift_types": ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"]},
+    ]
+    assert {_canonical(v) for v in variants} == {CANONICAL}
+
+
+def test_canonical_query_keeps_what_changes_the_answer():
+    query = _canonical({"relationship": "best  friend", "occasion": "Diwali", "gift_types": ["Luxury", "Formal", "Bogus"],
+                        "notes": " likes   tea ", "mode": "single", "city": "new delhi"})
+    assert query == ('age_group=Adult&budget=2000&city=New%20Delhi&gift_types=Formal%2CLuxury&mode=single'
+                     '&notes=likes%20tea&occasion=Diwali&relationship=Best%20Friend&vibe=Traditional')
+    assert _canonical(recommend._query_inputs(query)) == query
+
+
+@pytest.mark.parametrize('reason, late, s_maxage', [
+    ('no_api_key', 0, recommend.CDN_MAX_AGE),
+    ('deadline', 0, recommend.CDN_FALLBACK_MAX_AGE),
+    ('rate_limited', 0, recommend.CDN_FALLBACK_MAX_AGE),
+    (None, 2, recommend.CDN_FALLBACK_MAX_AGE),
+])
+def test_cache_control_is_short_for_a_stopgap(reason, late, s_maxage):
+    payload = {"meta": {"reason": reason, "links": {"late": late}}}
+    value = recommend._cache_control(payload, {"notes": ""})
+    assert value.startswith('public, ') and f"s-maxage={s_maxage}," in value
+
+
+def test_notes_are_never_stored():
+    clean = {"notes": "she just lost her job"}
+    assert recommend._cache_control({"meta": {}}, clean) == 'private, no-store'
+    assert recommend._cache_control(None, clean) == 'private, no-store'
+
+
+def test_etag_ignores_meta_and_matches_weakly():
+    etag = recommend._etag({"recommendations": [1], "meta": {"elapsed_ms": 3}})
+    assert etag == recommend._etag({"recommendations": [1], "meta": {"elapsed_ms": 9}})
+    assert recommend._etag_matches(etag, etag)
+    assert recommend._etag_matches(f'"other", {etag[2:]}', etag)
+    assert recommend._etag_matches('*', etag)
+    assert not recommend._etag_matches('', etag) and not recommend._etag_matches('"other"', etag)
+
+
+@pytest.fixture(scope='module')
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), recommend.handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _get(address, query, headers=None):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    try:
+        conn.request('GET', f'/api/recommend?{query}', headers=headers or {})
+        resp = conn.getresponse()
+        return resp.status, {k.lower(): v for k, v in resp.getheaders()}, resp.read()
+    finally:
+        conn.close()
+
+
+def test_handler_redirects_to_the_canonical_query(server):
+    status, headers, body = _get(server, 'occasion=diwali&relationship=mother&budget=2400')
+    assert status == 308 and body == b''
+    assert headers['location'] == f'/api/recommend?{CANONICAL}'
+    assert headers['cache-control'].startswith('public, ')
+
+
+def test_handler_answers_with_etag_then_304(server):
+    status, headers, body = _get(server, CANONICAL)
+    assert status == 200 and b'"recommendations"' in body
+    assert headers['cache-control'].startswith('public, ') and 's-maxage=' in headers['cache-control']
+    status, again, body = _get(server, CANONICAL, {'If-None-Match': headers['etag']})
+    assert status == 304 and body == b'' and 'content-length' not in again
+    assert again['etag'] == headers['etag']
+
+
+def test_handler_does_not_store_answers_with_notes(server):
+    query = _canonical({"relationship": "Mother", "occasion": "Diwali", "notes": "likes tea"})
+    status, headers, _ = _get(server, query.replace('Mother', 'mother'))
+    assert status == 308 and headers['cache-control'] == 'private, no-store'
+    status, headers, _ = _get(server, query)
+    assert status == 200 and headers['cache-control'] == 'private, no-store'
+
+
+def _aget(query, headers=None):
+    request = _aserver._Request('GET', f'/api/recommend?{query}', headers or {}, b'', True)
+    return asyncio.run(_aserver.AsyncServer()._get(request))
+
+
+def test_async_server_mirrors_the_handler():
+    status, payload, _, headers = _aget('relationship=mother&occasion=diwali')
+    assert status == 308 and payload is None
+    assert headers['Location'] == f'/api/recommend?{CANONICAL}'
+
+    status, payload, _, headers = _aget(CANONICAL)
+    assert status == 200 and payload["recommendations"]
+    assert headers['Cache-Control'].startswith('public, ')
+    status, _, _, _ = _aget(CANONICAL, {'if-none-match': headers['ETag']})
+    assert status == 304
+
+    status, _, _, headers = _aget(_canonical({"relationship": "Mother", "notes": "likes tea"}))
+    assert status == 200 and headers['Cache-Control'] == 'private, no-store'
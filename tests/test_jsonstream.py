@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from _jsonstream import JsonStream, iter_array, parse_array, parse_object, repair
+from bench_json_extract import CORPUS, incremental
+
+CASES = [json.loads(line) for line in open(CORPUS, encoding='utf-8')]
+
+
+@pytest.mark.parametrize('case', CASES, ids=[c['name'] for c in CASES])
+@pytest.mark.parametrize('chunk', [0, 1, 24])
+def test_corpus_counts(case, chunk):
+    assert incremental(case['text'], case['kind'], chunk) == case['expect']
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"title":"C"', {"title": "C"}),
+    ('{"title":"Ca', {"title": "Ca"}),
+    ('{"title":"C\\', {"title": "C"}),
+    ('{"a":[1,2', {"a": [1, 2]}),
+    ('{"a":"x","b', {"a": "x"}),
+    ('{"a":"x","b":', {"a": "x"}),
+    ('[[1,2],[3', [[1, 2], [3]]),
+])
+def test_repair_keeps_the_longest_valid_prefix(text, expected):
+    assert repair(text) == expected
+
+
+@pytest.mark.parametrize('text', ['{', '{"t":', '{"t', ''])
+def test_repair_without_content_is_none(text):
+    assert repair(text) is None
+
+
+def test_truncated_at_a_closer_keeps_the_last_element():
+    assert parse_array('[{"title":"A"},{"title":"C"') == [{"title": "A"}, {"title": "C"}]
+    assert parse_object('{"A":"r1","B":"r2"') == {"A": "r1", "B": "r2"}
+
+
+def test_fences_prose_and_trailing_commas():
+    text = 'Here you go:\n```json\n[{"title":"A",},\n{"title":"B"},]\n```\nEnjoy!'
+    assert parse_array(text) == [{"title": "A"}, {"title": "B"}]
+
+
+def test_malformed_element_is_skipped_and_counted():
+    stats = {}
+    assert parse_array("[{'title':'A'},{\"title\":\"B\"}]", stats=stats) == [{"title": "B"}]
+    assert stats["parse_errors"] == 1
+
+
+def test_elements_are_yielded_as_they_end():
+    stream = JsonStream('array')
+    assert stream.feed('[{"title":"A"},{"ti') == [{"title": "A"}]
+    assert stream.feed('tle":"B"}') == []
+    assert stream.feed(']') == [{"title": "B"}]
+    assert stream.close() == []
+    assert not stream.truncated
+
+
+def test_brackets_inside_strings_do_not_split():
+    chunks = ['[{"title":"a ]} [{ b", "d":"q\\"}"}', ']']
+    assert list(iter_array(chunks)) == [{"title": "a ]} [{ b", "d": 'q"}'}]
@@ -0,0 +1,49 @@
+from urllib.parse import quote_plus
+
+import pytest
+
+import recommend
+from _links import MERCHANTS, LinkBuilder
+
+TITLES = [
+    "Brass Diya Set",
+    "Tea & Biscuits Hamper (50% off!)",
+    "Rose/Gold #1 + Card? =yes",
+    "मिठाई का डिब्बा",
+    "  Silk   Saree  ",
+    "Mug 'World's Best' \"Dad\" <3",
+]
+
+CUSTOM = {
+    **MERCHANTS,
+    "nykaa": "https://www.nykaa.com/search/result/?q={q}&root=search",
+    "Amazon": "https://www.amazon.in/s?k={q}&i=gift",
+    "zepto": "https://www.zeptonow.com/search?query={q}",
+}
+
+
+def _old_path(merchants, title):
+    """Search URLs by plain substitution, then add_affiliate_tags, as before LinkBuilder."""
+    return recommend.add_affiliate_tags({name: t.replace('{q}', quote_plus(title)) for name, t in merchants.items()})
+
+
+@pytest.mark.parametrize('merchants', [MERCHANTS, CUSTOM], ids=['default', 'custom'])
+@pytest.mark.parametrize('amazon_tag, cid', [('', ''), ('gifting-21', ''), ('', '12345'), ('gift&ing-21', 'c/d 9')])
+@pytest.mark.parametrize('title', TITLES)
+def test_compiled_templates_match_add_affiliate_tags(monkeypatch, merchants, amazon_tag, cid, title):
+    monkeypatch.setattr(recommend, 'AMAZON_AFFILIATE_TAG', amazon_tag)
+    monkeypatch.setattr(recommend, 'CUELINKS_CID', cid)
+    builder = LinkBuilder(merchants, amazon_tag=amazon_tag, cuelinks_cid=cid)
+    assert builder.build(title) == _old_path(merchants, title)
+    assert builder.links(title) == builder.links(title) == builder.build(title)
+
+
+def test_memo_is_bounded_and_returns_copies():
+    builder = LinkBuilder(maxsize=2)
+    first = builder.links("A")
+    first["amazon"] = "changed"
+    assert builder.links("A")["amazon"] != "changed"
+    builder.links("B")
+    builder.links("C")
+    assert len(builder._memo) == 2 and "A" not in builder._memo
+    assert (builder.hits, builder.misses) == (1, 3)
@@ -0,0 +1,65 @@
+import pytest
+
+import recommend
+from _cache import ResponseCache
+
+PROFILE = ("Mother", "Diwali", "Adult", "Traditional", 2000, "", "", None, "")
+
+
+def _set(mode):
+    return [{"title": f"{mode} gift", "description": "d", "price": 1500, "why_applicable": "w", "category": "c",
+             "gift_type": "Traditional"}]
+
+
+@pytest.fixture
+def generations(monkeypatch):
+    """get_recommendations with a fresh cache and a race that records what it generates."""
+    cache = ResponseCache()
+    raced = []
+
+    def race(key, args, meta, mode):
+        raced.append(mode)
+        recs = _set(mode)
+        cache.set(key, recs)
+        meta.update(path="ai", reason="complete")
+        return recs, None
+
+    monkeypatch.setattr(recommend, 'GEMINI_API_KEY', 'test')
+    monkeypatch.setattr(recommend, 'RESPONSE_CACHE', cache)
+    monkeypatch.setitem(recommend._OPS, 'cache_get', cache.get)
+    monkeypatch.setitem(recommend._OPS, 'cache_set', cache.set)
+    monkeypatch.setitem(recommend._OPS, 'race', race)
+    monkeypatch.setattr(recommend, 'get_warm_set', lambda: None)
+    return raced
+
+
+def _ask(mode=''):
+    result = recommend.get_recommendations(*PROFILE, mode=mode)
+    return result["recommendations"][0]["title"], result["meta"]
+
+
+def test_an_explicit_mode_is_never_served_the_other_modes_set(generations):
+    assert _ask('dual')[0] == 'dual gift'
+    title, meta = _ask('single')
+    assert title == 'single gift' and meta["cache"] == "miss"
+    title, meta = _ask('dual')
+    assert title == 'dual gift' and meta["cache"] == "hit"
+    title, meta = _ask('single')
+    assert title == 'single gift' and meta["cache"] == "hit" and meta["mode"] == 'single'
+    assert generations == ['dual', 'single']
+
+
+def test_the_ab_arm_reads_its_own_sets(generations, monkeypatch):
+    _ask('dual')
+    monkeypatch.setattr(recommend, 'GEMINI_SINGLE_PASS_PCT', 100)
+    title, meta = _ask()
+    assert title == 'single gift' and meta["mode"] == 'single' and meta["cache"] == "miss"
+    monkeypatch.setattr(recommend, 'GEMINI_SINGLE_PASS_PCT', 0)
+    title, meta = _ask()
+    assert title == 'dual gift' and meta["mode"] == 'dual' and meta["cache"] == "hit"
+
+
+def test_mode_key():
+    key = recommend._cache_key(*PROFILE)
+    assert recommend._mode_key(key, 'dual') == key
+    assert recommend._mode_key(key, 'single') != key
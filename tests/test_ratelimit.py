@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from _ratelimit import AdmissionController, FileCounter, TokenBucket, open_counter
+
+
+def test_token_bucket_refills_at_its_rate_up_to_capacity():
+    bucket = TokenBucket(rate=2.0, capacity=4.0)
+    t0 = bucket._stamp
+    assert bucket.wait_for(4, t0) == 0.0
+    bucket.take(4)
+    assert bucket.wait_for(1, t0) == pytest.approx(0.5)
+    assert bucket.wait_for(1, t0 + 0.5) == 0.0
+    assert bucket.wait_for(4, t0 + 100) == 0.0 and bucket.level == 4.0
+
+
+def test_token_bucket_asks_at_most_its_capacity_and_can_go_negative():
+    bucket = TokenBucket(rate=1.0, capacity=2.0)
+    t0 = bucket._stamp
+    assert bucket.wait_for(10, t0) == 0.0        # a call bigger than the bucket waits for a full one
+    bucket.take(10)
+    assert bucket.wait_for(1, t0) == pytest.approx(9.0)
+    bucket.give(20)
+    assert bucket.level == 2.0
+
+
+def test_requests_past_the_burst_are_refused_without_waiting():
+    admission = AdmissionController(rpm=60, burst=0.05, max_wait=0)     # 3 banked, 1 per second
+    assert [admission.acquire() for _ in range(4)] == [True, True, True, False]
+    assert admission.stats()["admitted"] == 3 and admission.stats()["rejected"] == 1
+
+
+def test_short_shortage_is_queued():
+    admission = AdmissionController(rpm=600, burst=1 / 600, max_wait=0.5)   # 1 banked, 10 per second
+    assert admission.acquire() and admission.acquire()
+    assert admission.stats()["queued"] == 1
+
+
+def test_token_quota_and_settle():
+    admission = AdmissionController(tpm=6000, burst=0.5, max_wait=0)     # 3000 banked
+    assert admission.acquire(2500)
+    assert not admission.acquire(1000)
+    admission.settle(2500, 1000)         # the call used far less than estimated
+    assert admission.acquire(1000)
+
+
+def test_backoff_follows_retry_after_and_blocks_admission():
+    admission = AdmissionController(max_wait=0)
+    assert admission.backoff(retry_after=5) == pytest.approx(5, abs=0.1)
+    assert not admission.acquire()
+    assert admission.stats()["backoffs"] == 1 and admission.stats()["cooldown_s"] > 4
+
+
+def test_backoff_without_retry_after_is_capped_jitter():
+    admission = AdmissionController(backoff_base=0.01, backoff_cap=0.02)
+    for _ in range(10):
+        assert 0 <= admission.backoff() <= 0.02 + 1e-3
+
+
+def test_shared_window_counts_every_instance(tmp_path):
+    url = f"file://{tmp_path}/quota.json"
+    first = AdmissionController(rpm=3, burst=1, max_wait=0, counter=open_counter(url))
+    second = AdmissionController(rpm=3, burst=1, max_wait=0, counter=open_counter(url))
+    assert isinstance(first.counter, FileCounter)
+    assert first.acquire() and second.acquire() and first.acquire()
+    assert not second.acquire()
+
+
+def test_broken_counter_admits():
+    class Broken:
+        def incr(self, key, amount, ttl):
+            raise ConnectionError("down")
+
+    admission = AdmissionController(rpm=100, counter=Broken())
+    assert admission.acquire()
+    assert admission.stats()["counter_errors"] == 1
+
+
+def test_acquire_async_matches_acquire():
+    admission = AdmissionController(rpm=60, burst=0.05, max_wait=0)
+
+    async def main():
+        return [await admission.acquire_async() for _ in range(4)]
+
+    assert asyncio.run(main()) == [True, True, True, False]
@@ -0,0 +1,37 @@
+import time
+
+from _cache import ResponseCache, open_shm, open_store
+from _ratelimit import open_counter
+
+
+def test_one_store_per_segment_per_process(tmp_path):
+    url = f"shm://{tmp_path}/seg?mb=1"
+    cache, counter = open_store(url), open_counter(url)
+    assert cache is counter is open_shm(url)
+    assert open_shm(f"shm://{tmp_path}/other?mb=1") is not cache
+
+
+def test_cache_and_counter_share_the_table(tmp_path):
+    store = open_shm(f"shm://{tmp_path}/both?mb=1")
+    store.set('answer', '{"recs":[]}')
+    assert store.incr('gemini:rpm:1', 3, 60) == 3
+    assert store.incr('gemini:rpm:1', 2, 60) == 5
+    assert store.get('answer') == '{"recs":[]}'
+
+
+def test_response_cache_sets_its_own_ttl(tmp_path):
+    url = f"shm://{tmp_path}/ttl?mb=1"
+    open_counter(url)      # first opener, default ttl
+    cache = ResponseCache(ttl=0.05, shared=open_store(url, ttl=0.05))
+    cache.set('k', {"a": 1})
+    assert cache.shared.get('k') == '{"a":1}'
+    time.sleep(0.1)
+    assert cache.shared.get('k') is None
+
+
+def test_small_slots_hold_counters(tmp_path):
+    store = open_shm(f"shm://{tmp_path}/quota?mb=1&slot=64")
+    assert store.slot_size == 64
+    for i in range(100):
+        store.incr(f"gemini:tpm:{i}", i, 60)
+    assert store.incr('gemini:tpm:99', 1, 60) == 100
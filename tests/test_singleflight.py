@@ -0,0 +1,151 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import _aserver
+import recommend
+from _cache import SingleFlight, merge_trace
+from _timing import Timings
+
+
+def _traced(release, result, calls):
+    def fn(trace=None):
+        calls.append(1)
+        release.wait(5)
+        tokens = trace.setdefault("tokens", {"prompt": 0, "output": 0})
+        tokens["prompt"] += 100
+        tokens["output"] += 20
+        trace["hedge"] = "won"
+        return result
+    return fn
+
+
+def _follow(flight, key, fn, out, **kwargs):
+    def run():
+        trace = {"tokens": {"prompt": 5, "output": 1}}
+        try:
+            out.append((flight.do(key, fn, trace=trace, **kwargs), trace))
+        except Exception as e:
+            out.append((e, trace))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_for_followers(flight, n):
+    until = time.monotonic() + 5
+    while flight.coalesced < n and time.monotonic() < until:
+        time.sleep(0.001)
+
+
+def test_followers_share_the_result_and_the_leaders_trace():
+    flight, release, calls, out = SingleFlight(), threading.Event(), [], []
+    fn = _traced(release, {"recs": [1, 2]}, calls)
+    leader = _follow(flight, 'k', fn, out)
+    while not calls:
+        time.sleep(0.001)
+    followers = [_follow(flight, 'k', fn, out) for _ in range(3)]
+    _wait_for_followers(flight, 3)
+    release.set()
+    for t in [leader, *followers]:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert flight.stats() == {"calls": 1, "coalesced": 3, "timeouts": 0, "in_flight": 0}
+    results = [r for r, _ in out]
+    assert all(r == {"recs": [1, 2]} for r in results)
+    assert len({id(r) for r in results}) == 4   # each caller gets its own copy
+    for _, trace in out:
+        assert trace == {"tokens": {"prompt": 105, "output": 21}, "hedge": "won"}
+
+
+def test_follower_gives_up_at_its_deadline():
+    flight, release, calls, out = SingleFlight(), threading.Event(), [], []
+    fn = _traced(release, "late", calls)
+    leader = _follow(flight, 'k', fn, out)
+    while not calls:
+        time.sleep(0.001)
+    started = time.monotonic()
+    follower = _follow(flight, 'k', fn, out, deadline=time.monotonic() + 0.05)
+    follower.join(5)
+    assert 0.04 < time.monotonic() - started < 1
+    error, trace = out[0]
+    assert isinstance(error, TimeoutError)
+    assert trace == {"tokens": {"prompt": 5, "output": 1}}
+    assert flight.timeouts == 1
+
+    release.set()
+    leader.join(5)
+    assert out[1][0] == "late"
+
+
+def test_leader_error_reaches_followers():
+    flight, release = SingleFlight(), threading.Event()
+
+    def boom(trace=None):
+        release.wait(5)
+        trace["parse_errors"] = trace.get("parse_errors", 0) + 1
+        raise ValueError("bad answer")
+
+    out = []
+    leader = _follow(flight, 'k', boom, out)
+    while not flight.calls:
+        time.sleep(0.001)
+    follower = _follow(flight, 'k', boom, out)
+    _wait_for_followers(flight, 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    for error, trace in out:
+        assert isinstance(error, ValueError)
+        assert trace["parse_errors"] == 1
+
+
+def test_async_follower_of_a_thread_leader():
+    flight, release, calls, out = SingleFlight(), threading.Event(), [], []
+    leader = _follow(flight, 'k', _traced(release, [7], calls), out)
+    while not calls:
+        time.sleep(0.001)
+
+    async def follow(deadline=None):
+        trace = {}
+
+        async def never(trace=None):
+            raise AssertionError("a follower must not run the call")
+        try:
+            return await flight.do_async('k', never, deadline=deadline, trace=trace), trace
+        except TimeoutError as e:
+            return e, trace
+
+    async def main():
+        early = await follow(time.monotonic() + 0.02)
+        late = asyncio.ensure_future(follow())
+        await asyncio.sleep(0.02)
+        release.set()
+        return early, await late
+
+    early, late = asyncio.run(main())
+    leader.join(5)
+    assert isinstance(early[0], TimeoutError) and early[1] == {}
+    assert late == ([7], {"tokens": {"prompt": 100, "output": 20}, "hedge": "won"})
+
+
+@pytest.mark.parametrize('trace, delta, expected', [
+    ({}, {"tokens": {"prompt": 3}}, {"tokens": {"prompt": 3}}),
+    ({"tokens": {"prompt": 1, "output": 2}}, {"tokens": {"prompt": 3}}, {"tokens": {"prompt": 4, "output": 2}}),
+    ({"hedge": "lost", "parse_errors": 1}, {"hedge": "won", "parse_errors": 2}, {"hedge": "won", "parse_errors": 3}),
+])
+def test_merge_trace(trace, delta, expected):
+    merge_trace(trace, delta)
+    assert trace == expected
+
+
+def test_counters_reach_healthz_and_the_request_log(capsys):
+    recommend.INFLIGHT.do('counted', lambda trace=None: 1)
+    health = _aserver.AsyncServer().stats()["inflight"]
+    assert health == recommend.INFLIGHT.stats() and health["calls"] >= 1
+    recommend._log_request('recommend', Timings(), {"status": 200})
+    assert json.loads(capsys.readouterr().out)["inflight"] == recommend.INFLIGHT.stats()
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+
+import pytest
+
+import _aserver
+import recommend
+from _gemini import GeminiError
+from _ratelimit import AdmissionController
+from _steps import arun, run
+
+
+def _async_ops(ops):
+    def wrap(fn):
+        async def op(*args):
+            return fn(*args)
+        return op
+    return {name: wrap(fn) for name, fn in ops.items()}
+
+
+def _drive(kind, steps, ops):
+    if kind == 'sync':
+        return run(steps, ops)
+    return asyncio.run(arun(steps, _async_ops(ops)))
+
+
+@pytest.fixture(params=['sync', 'async'])
+def drive(request):
+    return lambda steps, ops: _drive(request.param, steps, ops)
+
+
+def test_op_errors_are_raised_at_the_yield(drive):
+    log = []
+
+    def steps():
+        try:
+            yield ('boom',)
+        except KeyError as e:
+            log.append(e.args[0])
+        try:
+            return (yield ('double', 21))
+        finally:
+            log.append('finally')
+
+    def boom():
+        raise KeyError('gone')
+
+    assert drive(steps(), {'boom': boom, 'double': lambda x: x * 2}) == 42
+    assert log == ['gone', 'finally']
+
+
+def test_uncaught_op_error_propagates_after_finally(drive):
+    log = []
+
+    def steps():
+        try:
+            yield ('fail',)
+        finally:
+            log.append('finally')
+
+    def fail():
+        raise ValueError('x')
+
+    with pytest.raises(ValueError):
+        drive(steps(), {'fail': fail})
+    assert log == ['finally']
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    monkeypatch.setattr(recommend, 'GEMINI_API_KEY', 'test')
+    monkeypatch.setattr(recommend, 'ADMISSION', AdmissionController(backoff_base=0.01))
+    calls, settled = [], []
+    answers = []
+
+    def generate(body, timeout, hedge_after, trace):
+        calls.append(body)
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    ops = {'admit': lambda estimate, max_wait: True, 'generate': generate,
+           'settle': lambda estimate, actual: settled.append(actual)}
+    return ops, answers, calls, settled
+
+
+def _answer(text, prompt_tokens=10, output_tokens=2):
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}],
+            "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens}}
+
+
+def test_gemini_call_retries_a_transient_error(drive, gemini):
+    ops, answers, calls, settled = gemini
+    answers += [GeminiError(503, b'busy'), _answer('hi')]
+    trace = {}
+    assert drive(recommend._gemini_call('prompt', 100, timeout=10, trace=trace, stage='test'), ops) == 'hi'
+    assert len(calls) == 2
+    assert settled == [0, 12]
+    assert trace["tokens"] == {"prompt": 10, "output": 2}
+
+
+def test_gemini_call_gives_up_on_a_client_error(drive, gemini):
+    ops, answers, calls, _ = gemini
+    answers += [GeminiError(400, b'bad'), _answer('unused')]
+    assert drive(recommend._gemini_call('prompt', 100, timeout=10, stage='test'), ops) is None
+    assert len(calls) == 1
+
+
+def test_gemini_call_not_admitted(drive, gemini):
+    ops, _, calls, _ = gemini
+    ops['admit'] = lambda estimate, max_wait: False
+    trace = {}
+    assert drive(recommend._gemini_call('prompt', 100, trace=trace, stage='test'), ops) is None
+    assert calls == [] and trace["admission"] == "rejected"
+
+
+class _Writer:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def test_preflight_has_no_content_length():
+    server = _aserver.AsyncServer()
+    request = _aserver._Request('OPTIONS', '/api/recommend', {'origin': 'http://localhost:3000'}, b'', True)
+    writer = _Writer()
+    asyncio.run(server._write(writer, 204, None, request=request, preflight=True))
+    head = writer.data.decode('latin-1')
+    assert head.startswith('HTTP/1.1 204 ')
+    assert 'Content-Length' not in head
+    assert head.endswith('\r\n\r\n')
+
+
+@pytest.fixture
+def fallback_threads(monkeypatch):
+    threads = []
+    real = _aserver.get_fallback_recommendations
+
+    def fallback(*args):
+        threads.append(threading.get_ident())
+        return real(*args)
+
+    monkeypatch.setattr(_aserver, 'get_fallback_recommendations', fallback)
+    return threads
+
+
+PROFILE = ("Mother", "Diwali", "Adult", "Traditional", 2000, "", "", None, "")
+
+
+def test_async_fallback_runs_off_the_event_loop(fallback_threads):
+    async def main():
+        return threading.get_ident(), await _aserver.aget_recommendations(*PROFILE)
+
+    loop_thread, result = asyncio.run(main())
+    assert result["meta"]["reason"] == "no_api_key" and result["recommendations"]
+    assert fallback_threads and loop_thread not in fallback_threads
+
+
+def test_async_race_computes_its_fallback_off_the_event_loop(fallback_threads, monkeypatch):
+    def no_gifts(*args, **kwargs):
+        return None
+        yield
+
+    monkeypatch.setattr(recommend, '_generation', no_gifts)
+
+    async def main():
+        meta = {}
+        return threading.get_ident(), await _aserver._race('k', PROFILE, meta, 'dual'), meta
+
+    loop_thread, (recs, fallback), meta = asyncio.run(main())
+    assert recs is None and fallback and meta["reason"] == "ai_failed"
+    assert fallback_threads and loop_thread not in fallback_threads
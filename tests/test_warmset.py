@@ -0,0 +1,35 @@
+import json
+
+import build_warmset
+import recommend
+from _timing import SamplingProfiler, Timings
+
+PROFILE = ("Mother", "Diwali", "Adult", "Traditional", 2000, "")
+
+
+def _log(capsys, profiler=None, args=PROFILE):
+    outcome = {"status": 200, "meta": {"cache": "miss", "path": "ai"}}
+    recommend._log_request('recommend', Timings(), outcome, profiler, recommend._warm_profile(*args, "", None))
+    return capsys.readouterr().out
+
+
+def test_sampled_requests_still_count_towards_the_warm_set(tmp_path, capsys):
+    profiler = SamplingProfiler(interval=0.001).start()
+    profiler.stop()
+    sampled = _log(capsys, profiler)
+    assert json.loads(sampled)["profiler"]["samples"] == profiler.samples
+
+    logs = tmp_path / 'requests.jsonl'
+    logs.write_text(sampled + _log(capsys) + '2026-10-18T10:00:00Z [info] ' + _log(capsys), encoding='utf-8')
+    counts = build_warmset.read_logs([str(logs)])
+    assert counts == {tuple(recommend._warm_profile(*PROFILE, "", None)): 3}
+
+
+def test_requests_the_warm_set_cannot_serve_are_not_counted(tmp_path, capsys):
+    recommend._log_request('recommend', Timings(), {"status": 200}, None,
+                           recommend._warm_profile(*PROFILE, "likes gardening", None))
+    line = capsys.readouterr().out
+    assert "warm_profile" not in json.loads(line)
+    logs = tmp_path / 'requests.jsonl'
+    logs.write_text(line, encoding='utf-8')
+    assert not build_warmset.read_logs([str(logs)])
@@ -0,0 +1,161 @@
+"""Benchmark: Catalog.select on a large synthetic catalog.
+
+Builds a catalog of --items synthetic gifts (prices log-uniform between
+Rs.100 and Rs.2,00,000, tags / categories / audiences / occasions drawn
+like the real one), compiles it to a temporary .bin and maps it the way
+the handlers do. Then, for --queries random profiles and budgets, it
+times two ways of answering "the best 10 gifts for this budget":
+
+- scan:   a per-item Python loop over every item priced 50-100% of the
+          budget, keeping the requested gift types and audience and
+          scoring each with the same weights, then heapq.nlargest;
+- select: Catalog.select -- two bisects for the budget band, bit-sliced
+          scoring over price positions.
+
+The memoized per-posting-list bitsets are built once before timing
+(reported as warm_ms); that cost is paid by the first request of a
+process, not by every request.
+
+    python tools/bench_catalog.py
+    python tools/bench_catalog.py --items 1000000 --queries 500 --json
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _catalog import _WEIGHTS, BUDGET_FLOOR, Catalog, write_binary  # noqa: E402
+
+TAGS = ["Formal", "Funky", "Romantic", "Practical", "Traditional", "Luxury"]
+CATEGORIES = ["traditional", "modern", "personalized", "luxury", "wellness", "festive", "romantic",
+              "home", "tech", "kids", "kids_boys", "kids_girls"]
+AUDIENCES = [["adult"], ["child", "child_male"], ["child", "child_female"], ["child", "child_female", "child_male"]]
+OCCASIONS = ["festival", "milestone", "romantic", "celebration"]
+
+
+def synthetic(n: int, rng: random.Random) -> list:
+    items = []
+    for i in range(n):
+        typical = math.exp(rng.uniform(math.log(100), math.log(200_000)))
+        spread = rng.uniform(1.5, 4.0)
+        items.append({
+            "title": f"Gift {i:07d}",
+            "gift_type": rng.choice(TAGS),
+            "icon": "🎁",
+            "price_min": max(50, int(typical / spread)),
+            "price_max": int(typical * spread),
+            "categories": rng.sample(CATEGORIES, rng.choice((1, 1, 2))),
+            "audience": rng.choices(AUDIENCES, (8, 1, 1, 1))[0],
+            "occasions": rng.sample(OCCASIONS, rng.choice((0, 0, 1))),
+        })
+    return items
+
+
+def scan(cat: Catalog, budget, categories, gift_types, occasion, audience, count=10) -> list:
+    """The straightforward version: score every in-band item in Python."""
+    lead = set(cat.by_category.get(categories[0], ())) if categories else set()
+    in_cats = set()
+    for c in categories:
+        in_cats.update(cat.by_category.get(c, ()))
+    in_occ = set(cat.by_occasion.get(occasion, ()))
+    in_aud = set(cat.by_audience.get(audience, ()))
+    wanted = {cat.tag_codes[t] for t in gift_types if t in cat.tag_codes}
+    floor, mid = budget * BUDGET_FLOOR, budget * (1 + BUDGET_FLOOR) / 2
+    scored = []
+    for i in range(len(cat)):
+        price = cat.price_of(i)
+        if not floor <= price <= budget or cat.tags[i] not in wanted or i not in in_aud:
+            continue
+        score = (_WEIGHTS['audience'] * (i in in_aud) + _WEIGHTS['gift_type'] * (cat.tags[i] in wanted)
+                 + _WEIGHTS['lead'] * (i in lead) + _WEIGHTS['category'] * (i in in_cats)
+                 + _WEIGHTS['occasion'] * (i in in_occ) + _WEIGHTS['fit'] * (price >= mid))
+        scored.append((score, i))
+    return [i for _, i in heapq.nlargest(count, scored)]
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--items', type=int, default=100_000)
+    ap.add_argument('--queries', type=int, default=2000)
+    ap.add_argument('--scan-queries', type=int, default=50, help='queries for the (slow) scan baseline')
+    ap.add_argument('--seed', type=int, default=7)
+    ap.add_argument('--json', action='store_true', help='print results as JSON')
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    items = synthetic(args.items, rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench_catalog.bin')
+        t0 = time.perf_counter()
+        write_binary(items, {}, path)
+        t1 = time.perf_counter()
+        cat = Catalog.open(path)
+        t2 = time.perf_counter()
+        for index in (cat.by_tag, cat.by_category, cat.by_audience, cat.by_occasion):
+            for ids in index.values():
+                cat.bits(ids)
+        t3 = time.perf_counter()
+
+        queries = []
+        for _ in range(args.queries):
+            budget = int(math.exp(rng.uniform(math.log(300), math.log(100_000))))
+            categories = rng.sample(CATEGORIES, 3)
+            queries.append((budget, categories, rng.sample(TAGS, rng.randint(1, 6)),
+                            rng.choice(OCCASIONS), rng.choice(("adult", "child", "child_male"))))
+
+        select_us, band = [], []
+        for budget, categories, tags, occasion, audience in queries:
+            lo, hi = cat.budget_span(budget)
+            band.append(hi - lo)
+            q0 = time.perf_counter()
+            cat.select(budget, categories, tags, random.Random(budget), occasion=occasion, audience=audience)
+            select_us.append((time.perf_counter() - q0) * 1e6)
+
+        scan_us = []
+        for budget, categories, tags, occasion, audience in queries[:args.scan_queries]:
+            q0 = time.perf_counter()
+            scan(cat, budget, categories, tags, occasion, audience)
+            scan_us.append((time.perf_counter() - q0) * 1e6)
+        del cat   # release the mapping before the directory goes
+
+    result = {
+        "items": args.items,
+        "queries": args.queries,
+        "build_ms": round((t1 - t0) * 1000, 1),
+        "open_ms": round((t2 - t1) * 1000, 2),
+        "warm_ms": round((t3 - t2) * 1000, 1),
+        "band_items_median": int(statistics.median(band)),
+        "select_us_p50": round(percentile(select_us, 0.5), 1),
+        "select_us_p99": round(percentile(select_us, 0.99), 1),
+        "scan_us_p50": round(percentile(scan_us, 0.5), 1),
+        "scan_us_p99": round(percentile(scan_us, 0.99), 1),
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['items']:,} items: build {result['build_ms']} ms, open {result['open_ms']} ms, "
+              f"bitsets {result['warm_ms']} ms (once per process)")
+        print(f"median budget band: {result['band_items_median']:,} items")
+        for label in ("scan", "select"):
+            print(f"  {label:>6}: p50 {result[f'{label}_us_p50']:>10,.1f} us   "
+                  f"p99 {result[f'{label}_us_p99']:>10,.1f} us")
+        print(f"  select is {result['scan_us_p50'] / result['select_us_p50']:.0f}x faster at p50")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
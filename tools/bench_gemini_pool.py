@@ -0,0 +1,107 @@
+"""Benchmark: fresh urllib connection per call vs the pooled GeminiClient.
+
+Runs both against tools/fake_gemini.py on localhost, so the difference is
+pure connection setup (TCP, plus TLS with --tls). Real-world savings are
+larger: every fresh call to generativelanguage.googleapis.com also pays a
+DNS lookup and a cross-region RTT per handshake round.
+
+    python tools/bench_gemini_pool.py --requests 300 --threads 4 --tls
+"""
+import argparse
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _gemini import GeminiClient  # noqa: E402
+import fake_gemini  # noqa: E402
+
+PAYLOAD = {"contents": [{"parts": [{"text": "Budget: Rs.2,000 INR"}]}],
+           "generationConfig": {"temperature": 0.7, "maxOutputTokens": 2048}}
+
+
+def self_signed_cert(tmpdir: str) -> tuple:
+    cert, key = os.path.join(tmpdir, 'cert.pem'), os.path.join(tmpdir, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+         '-keyout', key, '-out', cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+def run(label: str, call, requests: int, threads: int, server) -> dict:
+    before = dict(server.stats)
+    latencies = []
+
+    def one(_):
+        t0 = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    result = {
+        "label": label,
+        "requests": requests,
+        "connections": server.stats['connections'] - before['connections'],
+        "rps": round(requests / wall, 1),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+    print(f"{label:>8}: {result['rps']:>8} req/s  mean {result['mean_ms']:.2f}ms  "
+          f"p50 {result['p50_ms']:.2f}ms  p95 {result['p95_ms']:.2f}ms  "
+          f"connections opened {result['connections']}")
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--requests', type=int, default=200)
+    ap.add_argument('--threads', type=int, default=1)
+    ap.add_argument('--tls', action='store_true', help='serve the fake over TLS (needs openssl)')
+    ap.add_argument('--json', action='store_true', help='print results as JSON')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile = keyfile = ''
+        ctx = None
+        if args.tls:
+            certfile, keyfile = self_signed_cert(tmp)
+            ctx = ssl.create_default_context(cafile=certfile)
+        server = fake_gemini.serve(certfile=certfile, keyfile=keyfile)
+        url = server.model_url
+        body = json.dumps(PAYLOAD).encode('utf-8')
+
+        def fresh():
+            req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+            with urllib.request.urlopen(req, timeout=30, context=ctx) as resp:
+                json.loads(resp.read())
+
+        client = GeminiClient(url, 'bench', pool_size=max(8, args.threads), ssl_context=ctx)
+
+        results = [
+            run('urllib', fresh, args.requests, args.threads, server),
+            run('pooled', lambda: client.generate(PAYLOAD), args.requests, args.threads, server),
+        ]
+        server.shutdown()
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Regression + throughput benchmark for api/_jsonstream.py.
+
+tools/gemini_corpus.jsonl holds Gemini answers in the shapes that used to
+send requests to the fallback: fenced, prose around the JSON, truncated at
+maxOutputTokens mid-object or mid-string, a trailing comma, one malformed
+element, packed batch answers cut off inside a recipient. Each line is
+{"name", "kind": "array" | "object", "expect": <items>, "note", "text"};
+append new captures from the function logs as they turn up.
+
+For every case it reports how many gifts (array) or entries (object) the old
+whole-string json.loads path recovered against JsonStream, fed whole and in
+small chunks as from a stream, and fails (exit 1) if JsonStream misses the
+expected count. Then it times both over the corpus.
+
+    python tools/bench_json_extract.py
+    python tools/bench_json_extract.py --chunk 16 --repeat 500 --json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _jsonstream import JsonStream  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gemini_corpus.jsonl')
+
+
+def strip_fences(response: str) -> str:
+    """The hand-rolled fence trimming the handlers used before JsonStream."""
+    cleaned = response.strip()
+    if cleaned.startswith('```'):
+        cleaned = cleaned.split('\n', 1)[1] if '\n' in cleaned else cleaned[3:]
+    if cleaned.endswith('```'):
+        cleaned = cleaned.rsplit('```', 1)[0]
+    cleaned = cleaned.strip()
+    if cleaned.startswith('json'):
+        cleaned = cleaned[4:].strip()
+    return cleaned
+
+
+def whole_string(text: str, kind: str) -> int:
+    try:
+        value = json.loads(strip_fences(text))
+    except json.JSONDecodeError:
+        return 0
+    if kind == 'array':
+        return sum(1 for v in value if isinstance(v, dict)) if isinstance(value, list) else 0
+    return len(value) if isinstance(value, dict) else 0
+
+
+def incremental(text: str, kind: str, chunk: int = 0) -> int:
+    stream = JsonStream(kind)
+    items = []
+    if chunk:
+        for i in range(0, len(text), chunk):
+            items += stream.feed(text[i:i + chunk])
+    else:
+        items += stream.feed(text)
+    items += stream.close()
+    return len(items)
+
+
+def throughput(fn, cases: list, repeat: int) -> float:
+    """MB/s over the whole corpus."""
+    size = sum(len(c['text'].encode('utf-8')) for c in cases) * repeat
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for c in cases:
+            fn(c['text'], c['kind'])
+    return size / (time.perf_counter() - t0) / 1e6
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--corpus', default=CORPUS)
+    ap.add_argument('--chunk', type=int, default=24, help='chunk size for the streamed feed (chars)')
+    ap.add_argument('--repeat', type=int, default=200, help='corpus passes per throughput timing')
+    ap.add_argument('--json', action='store_true', help='print results as JSON')
+    args = ap.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    rows, failures = [], 0
+    for c in cases:
+        row = {
+            "name": c["name"],
+            "expect": c["expect"],
+            "json_loads": whole_string(c["text"], c["kind"]),
+            "stream_whole": incremental(c["text"], c["kind"]),
+            "stream_chunked": incremental(c["text"], c["kind"], args.chunk),
+        }
+        row["ok"] = row["stream_whole"] == row["stream_chunked"] == c["expect"]
+        failures += not row["ok"]
+        rows.append(row)
+
+    speed = {
+        "json_loads_mb_s": round(throughput(whole_string, cases, args.repeat), 1),
+        "stream_whole_mb_s": round(throughput(incremental, cases, args.repeat), 1),
+        "stream_chunked_mb_s": round(throughput(lambda t, k: incremental(t, k, args.chunk), cases, args.repeat), 1),
+    }
+    recovered = {
+        "json_loads": sum(r["json_loads"] for r in rows),
+        "stream": sum(r["stream_whole"] for r in rows),
+        "expected": sum(r["expect"] for r in rows),
+    }
+
+    if args.json:
+        print(json.dumps({"cases": rows, "recovered": recovered, "throughput": speed}, indent=2))
+    else:
+        print(f"{'case':<26} {'expect':>6} {'loads':>6} {'stream':>6} {'chunks':>6}")
+        for r in rows:
+            print(f"{r['name']:<26} {r['expect']:>6} {r['json_loads']:>6} {r['stream_whole']:>6} "
+                  f"{r['stream_chunked']:>6}{'' if r['ok'] else '  FAIL'}")
+        print(f"\nrecovered items: json.loads {recovered['json_loads']}, JsonStream {recovered['stream']} "
+              f"of {recovered['expected']}")
+        print(f"throughput: json.loads {speed['json_loads_mb_s']} MB/s, JsonStream whole "
+              f"{speed['stream_whole_mb_s']} MB/s, {args.chunk}-char chunks {speed['stream_chunked_mb_s']} MB/s")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
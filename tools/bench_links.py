@@ -0,0 +1,115 @@
+"""Micro-benchmark: purchase_links per second, old path vs api/_links.py.
+
+The old path built six f-string URLs per recommendation and re-parsed and
+re-quoted every one of them in add_affiliate_tags. Three variants are
+timed over the catalog's titles, drawn with a skewed popularity (a few
+titles recur, as with real traffic):
+
+- inline: f-strings + add_affiliate_tags, as before LinkBuilder;
+- build:  LinkBuilder.build, precompiled templates, no memo;
+- memo:   LinkBuilder.links, the per-title LRU the handlers use.
+
+Affiliate IDs are set (both programs by default) so the wrapping cost is
+included; the script first checks all three produce identical links and
+exits 1 if not.
+
+    python tools/bench_links.py
+    python tools/bench_links.py --n 200000 --memo-size 256 --no-cuelinks --json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import quote_plus
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _catalog import get_catalog  # noqa: E402
+from _links import NO_AFFILIATE_MERCHANTS, LinkBuilder, is_amazon_in  # noqa: E402
+
+
+def inline_links(title: str, amazon_tag: str, cid: str) -> dict:
+    """The pre-LinkBuilder code: six f-strings, then add_affiliate_tags."""
+    encoded_item = quote_plus(title)
+    links = {
+        "amazon": f"https://www.amazon.in/s?k={encoded_item}",
+        "flipkart": f"https://www.flipkart.com/search?q={encoded_item}",
+        "myntra": f"https://www.myntra.com/{encoded_item}",
+        "shoppersstop": f"https://www.shoppersstop.com/search?q={encoded_item}",
+        "blinkit": f"https://blinkit.com/s/?q={encoded_item}",
+        "meesho": f"https://www.meesho.com/search?q={encoded_item}"
+    }
+    out = {}
+    for merchant, url in links.items():
+        key = merchant.lower()
+        if key in NO_AFFILIATE_MERCHANTS:
+            out[merchant] = url
+        elif key == 'amazon':
+            out[merchant] = f"{url}{'&' if '?' in url else '?'}tag={quote_plus(amazon_tag)}" \
+                if amazon_tag and is_amazon_in(url) else url
+        elif cid:
+            out[merchant] = f"https://linksredirect.com/?cid={quote_plus(cid)}&source=linkkit&url={quote_plus(url)}"
+        else:
+            out[merchant] = url
+    return out
+
+
+def rate(fn, titles: list) -> float:
+    """Links per second."""
+    per_call = len(fn(titles[0]))
+    t0 = time.perf_counter()
+    for t in titles:
+        fn(t)
+    return len(titles) * per_call / (time.perf_counter() - t0)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--n', type=int, default=100000, help='recommendations to build per variant')
+    ap.add_argument('--memo-size', type=int, default=2048)
+    ap.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of title popularity (0 = uniform)')
+    ap.add_argument('--amazon-tag', default='bench-21')
+    ap.add_argument('--no-cuelinks', action='store_true', help='benchmark without Cuelinks wrapping')
+    ap.add_argument('--json', action='store_true', help='print results as JSON')
+    args = ap.parse_args()
+
+    cid = '' if args.no_cuelinks else '123456'
+    catalog = get_catalog()
+    pool = list(catalog.titles)
+    rng = random.Random(7)
+    weights = [1 / (i + 1) ** args.skew for i in range(len(pool))]
+    titles = rng.choices(pool, weights, k=args.n)
+
+    builder = LinkBuilder(amazon_tag=args.amazon_tag, cuelinks_cid=cid, maxsize=args.memo_size)
+    mismatches = [t for t in pool if not inline_links(t, args.amazon_tag, cid) == builder.build(t) == builder.links(t)]
+    if mismatches:
+        print(f"links differ for {len(mismatches)} titles, e.g. {mismatches[0]!r}", file=sys.stderr)
+        return 1
+
+    builder = LinkBuilder(amazon_tag=args.amazon_tag, cuelinks_cid=cid, maxsize=args.memo_size)
+    result = {
+        "titles": len(pool),
+        "recommendations": args.n,
+        "inline_links_per_s": round(rate(lambda t: inline_links(t, args.amazon_tag, cid), titles)),
+        "build_links_per_s": round(rate(builder.build, titles)),
+        "memo_links_per_s": round(rate(builder.links, titles)),
+    }
+    result["memo_hit_rate"] = round(builder.hits / max(1, builder.hits + builder.misses), 3)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        base = result["inline_links_per_s"]
+        print(f"{result['recommendations']} recommendations over {result['titles']} titles "
+              f"(cuelinks {'off' if args.no_cuelinks else 'on'})")
+        for label in ("inline", "build", "memo"):
+            n = result[f"{label}_links_per_s"]
+            print(f"  {label:>6}: {n:>12,} links/s  {n / base:5.1f}x")
+        print(f"  memo hit rate {result['memo_hit_rate']:.1%} (maxsize {args.memo_size})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Load test: /api/recommend under concurrency, against a fake Gemini.
+
+tools/fake_gemini.py stands in for the API (latency distribution, error
+and truncation rates are flags). Each path is served by a fresh worker
+process running api/recommend.py's `handler` on a local ThreadingHTTPServer,
+so the numbers include the real request parsing, JSON encoding and memory
+of one serverless-like instance:
+
+- ai:       GEMINI_API_KEY set; every request is a distinct cache miss;
+- cached:   GEMINI_API_KEY set; a few request variants, warmed first;
+- fallback: no key; the rule-based catalog answers.
+
+Requests are example_request.json with relationship, occasion, vibe and
+budget varied. Per path it reports p50/p95/p99 latency, requests per
+second, fallback and error rates, Gemini calls made and the worker's peak
+RSS. --out stores the results as JSON; --baseline compares against an
+earlier file so regressions show between commits.
+
+    python tools/bench_load.py --requests 300 --concurrency 16
+    python tools/bench_load.py --latency-dist lognormal:0.8,0.5 --error-rate 0.05 --truncate-rate 0.1
+    python tools/bench_load.py --stream --out load.json
+    python tools/bench_load.py --baseline load.json
+
+Server-side switches (GEMINI_PIPELINE=1, GEMINI_STRUCTURED=1, ...) are
+taken from the environment, so the same run can compare modes.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+API_DIR = os.path.join(ROOT, 'api')
+
+# The worker: serve `handler` until stdin closes, then report on stdout.
+# Its own logging goes to stderr, which is discarded unless --verbose.
+WORKER = """
+import json, resource, sys, threading
+from http.server import ThreadingHTTPServer
+report, sys.stdout = sys.stdout, sys.stderr
+sys.path.insert(0, %r)
+import recommend
+ThreadingHTTPServer.request_queue_size = 256   # the default 5 drops SYNs under load
+server = ThreadingHTTPServer(('127.0.0.1', 0), recommend.handler)
+server.daemon_threads = True
+threading.Thread(target=server.serve_forever, daemon=True).start()
+print(server.server_address[1], file=report, flush=True)
+sys.stdin.read()
+server.shutdown()
+print(json.dumps({
+    "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    "cache": recommend.RESPONSE_CACHE.stats(),
+    "admission": recommend.ADMISSION.stats(),
+    "tokens": recommend.TOKEN_USAGE,
+}), file=report)
+"""
+
+RELATIONSHIPS = ['Saali', 'Mother', 'Father', 'Best Friend', 'Wife', 'Boss', 'Brother', 'Colleague']
+OCCASIONS = ['Raksha Bandhan', 'Diwali', 'Birthday', 'Anniversary', 'Wedding', 'Holi']
+VIBES = ['Traditional', 'Funky', 'Practical', 'Luxury', 'Romantic', 'Formal']
+BUDGETS = [500, 1000, 2000, 3500, 5000, 10000]
+
+
+def payloads(base: dict, distinct: bool):
+    """Endless request bodies; `distinct` makes each one a cache miss."""
+    variants = itertools.cycle(itertools.product(RELATIONSHIPS, OCCASIONS, VIBES, BUDGETS))
+    for i, (rel, occ, vibe, budget) in enumerate(variants):
+        body = dict(base, relationship=rel, occasion=occ, vibe=vibe, budget=budget)
+        if distinct:
+            body["notes"] = f"load test {i}"
+        yield body
+
+
+def post(port: int, body: dict, stream: bool) -> dict:
+    """One request; returns status, latency, ttfb and whether AI answered."""
+    data = json.dumps(body).encode('utf-8')
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        conn.request('POST', '/api/recommend' + ('?stream=1' if stream else ''), body=data,
+                     headers={'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        ttfb = time.perf_counter() - t0
+        if stream:
+            last = None
+            for line in resp:
+                if line.strip():
+                    last = json.loads(line)
+            result = last or {}
+        else:
+            result = json.loads(resp.read() or b'{}')
+        return {"status": resp.status, "ms": (time.perf_counter() - t0) * 1000, "ttfb_ms": ttfb * 1000,
+                "ai": bool(result.get("ai_powered"))}
+    except (OSError, ValueError, http.client.HTTPException):
+        return {"status": 0, "ms": (time.perf_counter() - t0) * 1000, "ttfb_ms": None, "ai": False}
+    finally:
+        conn.close()
+
+
+def pct(values: list, p: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))], 1)
+
+
+def run_path(label: str, env: dict, args, base: dict, server) -> dict:
+    worker = subprocess.Popen([sys.executable, '-c', WORKER % os.path.abspath(API_DIR)], env=env,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              stderr=None if args.verbose else subprocess.DEVNULL, text=True)
+    port = int(worker.stdout.readline())
+    bodies = payloads(base, distinct=(label == 'ai'))
+    if label == 'cached':
+        bodies = itertools.cycle(list(itertools.islice(bodies, args.variants)))
+        for body in itertools.islice(bodies, args.variants):
+            post(port, body, False)       # warm: one miss per variant
+    lock = threading.Lock()
+
+    def next_body(_):
+        with lock:
+            return next(bodies)
+
+    calls_before = server.stats['requests']
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda i: post(port, next_body(i), args.stream), range(args.requests)))
+    wall = time.perf_counter() - t0
+    calls = server.stats['requests'] - calls_before
+
+    worker.stdin.close()
+    report = json.loads(worker.stdout.read().strip().splitlines()[-1])
+    worker.wait()
+
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["ms"] for r in ok]
+    out = {
+        "path": label,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "rps": round(len(ok) / wall, 1),
+        "latency_ms_p50": pct(latencies, 0.50),
+        "latency_ms_p95": pct(latencies, 0.95),
+        "latency_ms_p99": pct(latencies, 0.99),
+        "latency_ms_mean": round(statistics.fmean(latencies), 1) if latencies else None,
+        "fallback_rate": round(sum(not r["ai"] for r in ok) / len(ok), 3) if ok else None,
+        "error_rate": round(1 - len(ok) / len(results), 3),
+        "gemini_calls": calls,
+        "worker_rss_mb": report["rss_mb"],
+        "cache": report["cache"],
+        "admission": report["admission"],
+    }
+    if args.stream:
+        out["ttfb_ms_p50"] = pct([r["ttfb_ms"] for r in ok], 0.50)
+        out["ttfb_ms_p95"] = pct([r["ttfb_ms"] for r in ok], 0.95)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--requests', type=int, default=200, help='timed requests per path')
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--paths', default='ai,cached,fallback')
+    ap.add_argument('--variants', type=int, default=8, help='distinct requests on the cached path')
+    ap.add_argument('--stream', action='store_true', help='request NDJSON (?stream=1); adds time to first byte')
+    ap.add_argument('--latency-dist', default='lognormal:0.15,0.4', help='fake Gemini time to first byte')
+    ap.add_argument('--error-rate', type=float, default=0.0)
+    ap.add_argument('--truncate-rate', type=float, default=0.0)
+    ap.add_argument('--stream-interval', type=float, default=0.01, help='fake Gemini seconds between SSE events')
+    ap.add_argument('--deadline', type=float, default=0.0, help='RECOMMEND_DEADLINE for the workers')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', default='', help='write the results JSON here')
+    ap.add_argument('--baseline', default='', help='earlier --out file to compare against')
+    ap.add_argument('--json', action='store_true', help='print results as JSON')
+    ap.add_argument('--verbose', action='store_true', help="show the workers' logs")
+    args = ap.parse_args()
+
+    with open(os.path.join(ROOT, 'example_request.json')) as f:
+        base = json.load(f)
+    server = fake_gemini.serve(dist=args.latency_dist, error_rate=args.error_rate,
+                               truncate_rate=args.truncate_rate, stream_interval=args.stream_interval,
+                               seed=args.seed)
+    base_env = {k: v for k, v in os.environ.items()
+                if k not in ('GEMINI_API_KEY', 'GEMINI_API_URL', 'RECOMMEND_CACHE_URL')}
+    if args.deadline:
+        base_env['RECOMMEND_DEADLINE'] = str(args.deadline)
+    ai_env = dict(base_env, GEMINI_API_KEY='load', GEMINI_API_URL=server.model_url)
+    envs = {'ai': ai_env, 'cached': ai_env, 'fallback': base_env}
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r["path"]: r for r in json.load(f)["paths"]}
+
+    results = []
+    log = sys.stderr if args.json else sys.stdout
+    for label in [p.strip() for p in args.paths.split(',') if p.strip()]:
+        r = run_path(label, envs[label], args, base, server)
+        results.append(r)
+        line = (f"{label:>8}: {r['rps']:7.1f} rps  p50 {r['latency_ms_p50']:7.1f}  p95 {r['latency_ms_p95']:7.1f}  "
+                f"p99 {r['latency_ms_p99']:7.1f} ms  fallback {r['fallback_rate']:.1%}  "
+                f"errors {r['error_rate']:.1%}  gemini {r['gemini_calls']}  rss {r['worker_rss_mb']} MB")
+        if label in baseline:
+            b = baseline[label]
+            line += f"  vs baseline p95 {r['latency_ms_p95'] - b['latency_ms_p95']:+.1f} ms, rps {r['rps'] - b['rps']:+.1f}"
+        print(line, file=log)
+    server.shutdown()
+
+    doc = {
+        "config": {k: v for k, v in vars(args).items() if k not in ('out', 'baseline', 'json', 'verbose')},
+        "fake_gemini": dict(server.stats),
+        "paths": results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(doc, f, indent=2)
+    if args.json:
+        print(json.dumps(doc, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark: cold start of api/recommend.py, per code path.
+
+Each run is a fresh interpreter started with -X importtime, as on a Vercel
+cold start. It imports the handler module and serves one request, then
+reports:
+
+- import_ms: cumulative import time of `recommend`, as measured by -X importtime
+- first_ms: from the start of the import to the finished first response
+
+for two paths:
+
+- fallback: no GEMINI_API_KEY, so the rule-based catalog answers;
+- ai: GEMINI_API_KEY set, answered by tools/fake_gemini.py on localhost
+  (no network, so the number is interpreter + module work, not Gemini).
+
+    python tools/bench_startup.py --runs 15
+    python tools/bench_startup.py --json > startup.json
+    python tools/bench_startup.py --baseline startup.json   # show the delta
+
+--top N lists the N slowest imports (self time) from the last run, which is
+where to look when import_ms regresses.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini  # noqa: E402
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+
+# Runs in the child. Timing starts before the import so first_ms covers it.
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, %r)
+import recommend
+t1 = time.perf_counter()
+result = recommend.get_recommendations('Mother', 'Diwali', 'Adult', 'Traditional', 2500)
+t2 = time.perf_counter()
+assert result['recommendations'], result
+print(json.dumps({"import_wall_ms": (t1 - t0) * 1000, "first_ms": (t2 - t0) * 1000,
+                  "ai_powered": result['ai_powered']}))
+"""
+
+
+def parse_importtime(stderr: str) -> list:
+    """[(module, self_us, cumulative_us)] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cum_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cum_us)))
+    return rows
+
+
+def cold_start(env: dict) -> tuple:
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD % os.path.abspath(API_DIR)],
+        env=env, capture_output=True, text=True, timeout=60,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"child failed:\n{proc.stderr[-2000:]}")
+    out = json.loads(proc.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(proc.stderr)
+    out["import_ms"] = next(cum for name, _, cum in rows if name == 'recommend') / 1000
+    return out, rows
+
+
+def measure(label: str, env: dict, runs: int) -> tuple:
+    samples, rows = [], []
+    for _ in range(runs):
+        out, rows = cold_start(env)
+        samples.append(out)
+    result = {"path": label, "runs": runs, "ai_powered": samples[-1]["ai_powered"]}
+    for field in ("import_ms", "first_ms"):
+        values = sorted(s[field] for s in samples)
+        result[f"{field}_p50"] = round(statistics.median(values), 2)
+        result[f"{field}_min"] = round(values[0], 2)
+    return result, rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--runs', type=int, default=10)
+    ap.add_argument('--top', type=int, default=0, help='list the N slowest imports (self time)')
+    ap.add_argument('--baseline', default='', help='earlier --json output to compare against')
+    ap.add_argument('--json', action='store_true', help='print results as JSON')
+    args = ap.parse_args()
+
+    base_env = {k: v for k, v in os.environ.items()
+                if not k.startswith(('GEMINI_', 'RECOMMEND_CACHE'))}
+    server = fake_gemini.serve()
+    paths = [
+        ('fallback', dict(base_env)),
+        ('ai', dict(base_env, GEMINI_API_KEY='bench', GEMINI_API_URL=server.model_url)),
+    ]
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r["path"]: r for r in json.load(f)}
+
+    results = []
+    for label, env in paths:
+        result, rows = measure(label, env, args.runs)
+        results.append(result)
+        line = (f"{label:>8}: import {result['import_ms_p50']:7.2f} ms  "
+                f"first response {result['first_ms_p50']:7.2f} ms  (p50 of {args.runs})")
+        if label in baseline:
+            line += (f"  vs baseline {result['import_ms_p50'] - baseline[label]['import_ms_p50']:+.2f} / "
+                     f"{result['first_ms_p50'] - baseline[label]['first_ms_p50']:+.2f} ms")
+        print(line, file=sys.stderr if args.json else sys.stdout)
+        for name, self_us, cum_us in sorted(rows, key=lambda r: -r[1])[:args.top]:
+            print(f"          {self_us / 1000:7.2f} ms self {cum_us / 1000:7.2f} ms cum  {name}",
+                  file=sys.stderr if args.json else sys.stdout)
+    server.shutdown()
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
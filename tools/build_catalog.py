@@ -0,0 +1,115 @@
+"""Compile the gift catalog source into the mmap-able binary catalog.
+
+    python tools/build_catalog.py                      # data/gift_catalog.json -> .bin
+    python tools/build_catalog.py items.csv --meta data/gift_catalog.json
+    python tools/build_catalog.py --check              # exit 1 if the .bin is stale
+
+The source is either the JSON file (top-level "items" plus the
+"relationships", "occasions" and "pro_tips" maps) or a CSV of items with
+columns title, gift_type, icon, price_min, price_max, categories, audience,
+occasions -- prices in whole rupees, the list columns separated by ';'. A CSV carries no maps; --meta names a JSON file
+to take them from.
+
+The .bin records the sha256 of its source, so --check (e.g. in CI or a
+pre-commit hook) catches a JSON edit that was never rebuilt. The compiled
+file is committed: Vercel deploys data/ as-is and runs no build step for
+Python functions.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _catalog import DEFAULT_BIN, DEFAULT_JSON, Catalog, write_binary  # noqa: E402
+
+_LIST_COLUMNS = ('categories', 'audience', 'occasions')
+
+
+def read_source(path: str, meta_path: str = '') -> tuple:
+    """Return (items, meta) from a JSON or CSV source."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if path.endswith('.csv'):
+        rows = csv.DictReader(raw.decode('utf-8-sig').splitlines())
+        items = []
+        for row in rows:
+            item = {k: (v or '').strip() for k, v in row.items() if k}
+            for col in _LIST_COLUMNS:
+                item[col] = [v.strip() for v in item.get(col, '').split(';') if v.strip()]
+            items.append(item)
+        meta = {}
+    else:
+        meta = json.loads(raw)
+        items = meta.pop('items')
+    if meta_path:
+        with open(meta_path, encoding='utf-8') as f:
+            extra = json.load(f)
+        for key in ('relationships', 'occasions', 'pro_tips'):
+            meta.setdefault(key, extra.get(key, {}))
+    meta['source_sha256'] = digest
+    return items, meta
+
+
+def validate(items: list) -> None:
+    seen = set()
+    for n, item in enumerate(items):
+        title = item.get('title')
+        if not title:
+            raise SystemExit(f"item {n}: missing title")
+        if title in seen:
+            raise SystemExit(f"item {n}: duplicate title {title!r}")
+        seen.add(title)
+        if not item.get('categories'):
+            raise SystemExit(f"item {n} ({title}): no categories")
+        try:
+            low, high = int(item['price_min']), int(item['price_max'])
+        except (KeyError, TypeError, ValueError):
+            raise SystemExit(f"item {n} ({title}): price_min / price_max missing or not whole rupees")
+        if not 0 < low <= high:
+            raise SystemExit(f"item {n} ({title}): bad price range {low}..{high}")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('source', nargs='?', default=DEFAULT_JSON)
+    ap.add_argument('-o', '--output', default=DEFAULT_BIN)
+    ap.add_argument('--meta', default='', help='JSON file with relationships/occasions/pro_tips (for CSV sources)')
+    ap.add_argument('--check', action='store_true', help='only verify the output was built from this source')
+    args = ap.parse_args()
+
+    items, meta = read_source(args.source, args.meta)
+
+    if args.check:
+        try:
+            built = Catalog.open(args.output)
+        except (OSError, ValueError) as e:
+            print(f"{args.output}: {e}")
+            return 1
+        if built.source_sha256 != meta['source_sha256']:
+            print(f"{args.output} is stale; run python tools/build_catalog.py")
+            return 1
+        print(f"{args.output} is up to date ({len(built)} items)")
+        return 0
+
+    validate(items)
+    write_binary(items, meta, args.output)
+
+    # Report what the runtime gains: open cost of each representation.
+    t0 = time.perf_counter()
+    Catalog.from_json(args.source) if args.source.endswith('.json') else Catalog.from_records(items, meta)
+    t1 = time.perf_counter()
+    cat = Catalog.open(args.output)
+    t2 = time.perf_counter()
+    print(f"wrote {args.output}: {len(cat)} items, {os.path.getsize(args.output):,} bytes")
+    print(f"open: source {1000 * (t1 - t0):.2f} ms, mmap {1000 * (t2 - t1):.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
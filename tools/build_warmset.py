@@ -0,0 +1,171 @@
+"""Generate the warm set: AI recommendations for a season's hot profiles.
+
+    python tools/build_warmset.py --occasions "Diwali,Bhai Dooj" --logs logs/*.jsonl
+    python tools/build_warmset.py --occasions "Raksha Bandhan" --top 200 --dry-run
+    python tools/build_warmset.py --check      # print the current artifact's header
+
+A profile is relationship x occasion x age_group x vibe x budget band x
+gender: a request without notes, city or a gift-type filter, which is the
+bulk of peak-day traffic. Profiles are ranked by how often they appear in
+request logs. The handler's JSON log lines carry a "warm_profile" field; pass
+exported lines with --logs. The rest of --top is filled from the grid of
+--occasions x relationships x --age-groups x --vibes x --budgets, varying
+the occasion and relationship fastest. Occasions about one relationship
+(Raksha Bandhan, Karva Chauth, ...) only pair with the relationships they
+are about.
+
+Each profile goes through the same generation as a live cache miss
+(recommend._generate_ai_recommendations at the band floor), --concurrency
+at a time. GEMINI_* settings apply, including GEMINI_RPM / GEMINI_TPM, so
+the job stays inside quota. The result goes to data/warm_set.json.gz (see
+api/_warmset.py), valid for --ttl-days. Commit or deploy it before the
+season starts.
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import _warmset  # noqa: E402
+import recommend  # noqa: E402
+
+AGE_GROUPS = ['Young Adult', 'Adult', 'Middle Aged', 'Senior', 'Teen', 'Child']
+VIBES = ['Traditional', 'Modern', 'Quirky', 'Luxury', 'Wellness', 'Tech']
+BUDGETS = [1000, 2500, 5000]
+
+# Occasions that are about particular relationships.
+_AFFINITY = {
+    'raksha bandhan': ['sister', 'brother', 'cousin', 'saali'],
+    'bhai dooj': ['brother', 'sister', 'cousin'],
+    'karva chauth': ['wife', 'husband'],
+    "valentine's day": ['girlfriend', 'boyfriend', 'wife', 'husband'],
+    "mother's day": ['mother', 'grandparent', 'aunt'],
+    "father's day": ['father', 'grandparent', 'uncle'],
+}
+
+
+def _csv(value: str) -> list:
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def read_logs(paths: list) -> collections.Counter:
+    """Profile -> request count, from handler log lines (other lines skipped)."""
+    counts = collections.Counter()
+    for path in paths:
+        with (sys.stdin if path == '-' else open(path, encoding='utf-8')) as f:
+            for line in f:
+                start = line.find('{')     # platform log prefixes
+                if start < 0:
+                    continue
+                try:
+                    record = json.loads(line[start:])
+                except json.JSONDecodeError:
+                    continue
+                profile = record.get('warm_profile') if isinstance(record, dict) else None
+                if record.get('event') == 'recommend' and isinstance(profile, list) and len(profile) == 6:
+                    counts[tuple(profile)] += 1
+    return counts
+
+
+def grid(occasions: list, relationships: list, ages: list, vibes: list, budgets: list):
+    """Profiles in prior order: occasion and relationship vary fastest."""
+    for age, vibe, budget, rel, occ in itertools.product(ages, vibes, budgets, relationships, occasions):
+        if occ in _AFFINITY and rel not in _AFFINITY[occ]:
+            continue
+        yield (rel, occ, recommend._norm(age), recommend._norm(vibe), recommend._budget_band(budget), '')
+
+
+def hot_profiles(args, counts: collections.Counter) -> list:
+    occasions = [recommend._norm(o) for o in _csv(args.occasions)]
+    relationships = [recommend._norm(r) for r in _csv(args.relationships)] if args.relationships \
+        else list(recommend.RELATIONSHIPS)
+    picked = [p for p, _ in counts.most_common() if p[1] in occasions][:args.top]
+    seen = set(picked)
+    fill = grid(occasions, relationships, _csv(args.age_groups), _csv(args.vibes),
+                [int(b) for b in _csv(args.budgets)])
+    for profile in fill:
+        if len(picked) >= args.top:
+            break
+        if profile not in seen:
+            seen.add(profile)
+            picked.append(profile)
+    return picked
+
+
+def generate(profile: tuple) -> 'list | None':
+    rel, occ, age, vibe, band, gender = profile
+    return recommend._generate_ai_recommendations(rel.title(), occ.title(), age.title(), vibe.title(), band, gender.title(),
+                                                  '', None)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--occasions', default=','.join(o for o, kind in recommend.OCCASIONS.items() if kind == 'festival'),
+                    help='comma list; default: every festival in the catalog')
+    ap.add_argument('--relationships', default='', help='comma list; default: every catalog relationship')
+    ap.add_argument('--age-groups', default=','.join(AGE_GROUPS[:3]))
+    ap.add_argument('--vibes', default=','.join(VIBES))
+    ap.add_argument('--budgets', default=','.join(map(str, BUDGETS)), help='any budget in each band to cover')
+    ap.add_argument('--logs', nargs='*', default=[], help="handler log files ('-' for stdin)")
+    ap.add_argument('--top', type=int, default=300, help='profiles to generate')
+    ap.add_argument('--concurrency', type=int, default=4)
+    ap.add_argument('--ttl-days', type=float, default=21)
+    ap.add_argument('-o', '--output', default=_warmset.DEFAULT_PATH)
+    ap.add_argument('--dry-run', action='store_true', help='list the profiles and exit')
+    ap.add_argument('--check', action='store_true', help="print the existing artifact's header and exit")
+    args = ap.parse_args()
+
+    if args.check:
+        ws = _warmset.WarmSet.open(args.output)
+        print(json.dumps({"version": ws.version, "entries": len(ws), "fresh": ws.fresh(),
+                          "generated_at": time.strftime('%Y-%m-%d %H:%M', time.gmtime(ws.generated_at)),
+                          "expires_at": time.strftime('%Y-%m-%d %H:%M', time.gmtime(ws.expires_at)),
+                          **ws.meta}, indent=2))
+        return 0 if ws.fresh() else 1
+
+    counts = read_logs(args.logs)
+    profiles = hot_profiles(args, counts)
+    from_logs = sum(1 for p in profiles if p in counts)
+    print(f"{len(profiles)} profiles ({from_logs} from {sum(counts.values())} logged requests)", file=sys.stderr)
+    if args.dry_run:
+        for p in profiles:
+            print(json.dumps({"profile": p, "requests": counts.get(p, 0)}, ensure_ascii=False))
+        return 0
+    if not recommend.GEMINI_API_KEY:
+        print("GEMINI_API_KEY is not set", file=sys.stderr)
+        return 1
+
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(generate, profiles))
+    entries = {}
+    for profile, recs in zip(profiles, results):
+        if recs:
+            rel, occ, age, vibe, band, gender = profile
+            key = recommend._cache_key(rel, occ, age, vibe, band, gender, '', None)
+            entries[key] = {"profile": list(profile), "recs": recs}
+    failed = len(profiles) - len(entries)
+    if not entries:
+        print("no profile produced recommendations; nothing written", file=sys.stderr)
+        return 1
+
+    header = _warmset.write(args.output, entries, ttl=args.ttl_days * 86400, meta={
+        "catalog_sha256": recommend.CATALOG.source_sha256,
+        "model": recommend.GEMINI_API_URL.rsplit('/', 1)[-1].split(':')[0],
+        "occasions": [recommend._norm(o) for o in _csv(args.occasions)],
+        "profiles": len(entries),
+    })
+    print(f"wrote {args.output}: {len(entries)} profiles, {failed} failed, "
+          f"{os.path.getsize(args.output) / 1024:.0f} KiB, version {header['version']}, "
+          f"{time.monotonic() - t0:.0f}s; tokens {recommend.TOKEN_USAGE}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
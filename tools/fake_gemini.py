@@ -0,0 +1,367 @@
+"""Local stand-in for the Gemini REST API.
+
+Answers :generateContent and :streamGenerateContent?alt=sse with canned
+but well-formed gift JSON, so the recommend handler can be exercised and
+benchmarked without a key or network. Point the app at it with
+
+    python tools/fake_gemini.py --port 8765
+    GEMINI_API_KEY=fake \\
+    GEMINI_API_URL=http://127.0.0.1:8765/v1beta/models/fake:generateContent vercel dev
+
+It counts TCP connections and requests, so benchmarks can show how many
+handshakes a client actually paid for. --certfile/--keyfile serve TLS.
+
+For load tests it can misbehave like the real thing:
+
+- --latency-dist: time before the first byte, drawn per request from
+  "fixed:S", "uniform:LO,HI" or "lognormal:MEDIAN,SIGMA" (seconds);
+- --error-rate: share of requests answered 429 (with Retry-After) or 500;
+- --truncate-rate: share of answers cut off at a random point, as when
+  maxOutputTokens is hit (finishReason MAX_TOKENS);
+- --stream-chunks / --stream-interval: shape of :streamGenerateContent.
+
+It also stands in for context caching: POST /v1beta/cachedContents and
+PATCH .../cachedContents/ID?updateMask=ttl keep a systemInstruction for
+its ttl (refusing ones under --cache-min-tokens, as Gemini refuses small
+caches with a 400), a call naming a live cachedContent is answered as if
+that text came first (403 once it has expired), and usageMetadata reports
+cachedContentTokenCount. --prefill-ms adds that many ms per 1000 uncached
+prompt tokens, so cached calls come back measurably sooner.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import ssl
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ITEMS = [
+    ("Noise ColorFit Pro 4 Smartwatch", "Practical", "⌚"),
+    ("Forest Essentials Sandalwood Gift Set", "Luxury", "🧴"),
+    ("Handpainted Madhubani Wall Art", "Traditional", "🖼️"),
+    ("Boat Airdopes 141 Earbuds", "Funky", "🎧"),
+    ("Chumbak Quirky Desk Organizer", "Funky", "🗂️"),
+    ("Personalized Leather Journal", "Formal", "📔"),
+    ("Silver Plated Pooja Thali", "Traditional", "🪔"),
+    ("Couple Pottery Class Voucher", "Romantic", "🏺"),
+    ("Kindle Paperwhite", "Practical", "📚"),
+    ("Godiva Chocolate Hamper", "Luxury", "🍫"),
+    # Only reached by "more ideas" prompts that exclude the ten above.
+    ("Nicobar Ceramic Tea Set", "Traditional", "🫖"),
+    ("Wooden Chess Set with Storage", "Formal", "♟️"),
+    ("Bluetooth Retro Radio Speaker", "Funky", "📻"),
+    ("Aroma Diffuser with Essential Oils", "Practical", "🕯️"),
+    ("Hand-block Printed Silk Stole", "Luxury", "🧣"),
+    ("Star Map Print of a Special Night", "Romantic", "🌌"),
+    ("Terrarium DIY Kit", "Funky", "🌿"),
+    ("Brass Diya Set", "Traditional", "🪔"),
+    ("Monogrammed Travel Organizer", "Formal", "🧳"),
+    ("Instax Mini Instant Camera", "Practical", "📷"),
+]
+
+
+def gifts_json(budget: int = 2000, reasons: bool = False, exclude=(), count: int = 10) -> str:
+    exclude = set(exclude)
+    pool = [item for item in _ITEMS if item[0] not in exclude][:count]
+    gifts = [
+        {
+            "title": title,
+            "gift_type": gift_type,
+            "description": f"A thoughtful {gift_type.lower()} pick that fits the occasion.",
+            "price": int(budget * (0.55 + 0.04 * i)),
+            "icon": icon,
+        }
+        for i, (title, gift_type, icon) in enumerate(pool)
+    ]
+    if reasons:
+        # Single-pass prompt: the reasons come inline with each gift.
+        for g in gifts:
+            g["reasons"] = "Fits their style • Perfect for the occasion"
+    return json.dumps(gifts, indent=2, ensure_ascii=False)
+
+
+def reasons_json(titles: list) -> str:
+    return json.dumps({t: "Fits their style • Perfect for the occasion" for t in titles}, ensure_ascii=False)
+
+
+def conform(value, schema: dict):
+    """Reshape a canned answer to a responseSchema (maps -> [{title, reason}])."""
+    kind = schema.get('type', '').upper()
+    if kind == 'ARRAY' and isinstance(value, dict):
+        return [{"title": k, "reason": v} for k, v in value.items()]
+    if kind == 'OBJECT' and isinstance(value, dict) and 'properties' in schema:
+        props = schema['properties']
+        return {k: conform(v, props[k]) if k in props else v for k, v in value.items()}
+    return value
+
+
+def answer_for(prompt: str) -> str:
+    """Pick a canned answer based on which prompt template we received."""
+    packed = re.findall(r'^\[(r\d+)\] (.*)$', prompt, re.M)
+    if packed:
+        # recommend_batch: one prompt, several recipients keyed r1..rN
+        titles = dict(re.findall(r'^\[(r\d+)\] .*\nGifts: (\[.*\])$', prompt, re.M))
+        if titles:
+            return json.dumps({rid: json.loads(reasons_json(json.loads(t))) for rid, t in titles.items()},
+                              ensure_ascii=False)
+        out = {}
+        for rid, line in packed:
+            m = re.search(r'Budget: Rs\.([\d,]+)', line)
+            out[rid] = json.loads(gifts_json(int(m.group(1).replace(',', '')) if m else 2000))
+        return json.dumps(out, ensure_ascii=False)
+    m = re.search(r'Gifts:\n(\[.*?\])\n', prompt, re.S)
+    if m:
+        return reasons_json(json.loads(m.group(1)))
+    m = re.search(r'Budget: Rs\.([\d,]+)', prompt)
+    budget = int(m.group(1).replace(',', '')) if m else 2000
+    m = re.search(r'^Already suggested .*?: (\[.*\])$', prompt, re.M)
+    exclude = json.loads(m.group(1)) if m else ()
+    m = re.search(r'exactly (\d+) ', prompt)
+    count = int(m.group(1)) if m else 10
+    return "```json\n" + gifts_json(budget, 'also write "reasons"' in prompt, exclude, count) + "\n```"
+
+
+class FakeGemini(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, keep-alive
+    # clients hit the Nagle / delayed-ACK 40ms stall on every response.
+    disable_nagle_algorithm = True
+    latency = 0.0          # seconds before the first byte
+    latency_dist = None    # callable(rng) -> seconds; overrides latency
+    stream_chunks = 8      # SSE events per streamed answer
+    stream_interval = 0.0  # seconds between SSE events
+    error_rate = 0.0       # share answered 429 / 500
+    truncate_rate = 0.0    # share cut off mid-answer
+    prefill_ms = 0.0       # extra ms per 1000 uncached prompt tokens
+    cache_min_tokens = 0   # smallest cachedContents accepted
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats['connections'] += 1
+
+    def _read_body(self) -> dict:
+        n = int(self.headers.get('Content-Length', 0) or 0)
+        return json.loads(self.rfile.read(n) or b'{}')
+
+    def _read_request(self) -> tuple:
+        """(whole prompt, generationConfig, cached tokens); None prompt for a dead cachedContent."""
+        body = self._read_body()
+        prompt = ''.join(p.get('text', '') for c in body.get('contents', []) for p in c.get('parts', []))
+        cached = 0
+        if body.get('cachedContent'):
+            entry = self.server.cached_content(body['cachedContent'])
+            if entry is None:
+                return None, {}, 0
+            prompt = entry['text'] + '\n\n' + prompt
+            cached = entry['tokens']
+        return prompt, body.get('generationConfig') or {}, cached
+
+    def _resource(self, name: str) -> dict:
+        entry = self.server.cached_content(name)
+        expires = datetime.fromtimestamp(entry['expires'], timezone.utc).isoformat().replace('+00:00', 'Z')
+        return {"name": name, "model": entry['model'], "expireTime": expires,
+                "usageMetadata": {"totalTokenCount": entry['tokens']}}
+
+    def _create_cached_content(self) -> None:
+        body = self._read_body()
+        text = ''.join(p.get('text', '') for p in (body.get('systemInstruction') or {}).get('parts', []))
+        tokens = len(text) // 4
+        if tokens < self.cache_min_tokens:
+            self._send({"error": {"code": 400, "status": "INVALID_ARGUMENT",
+                                  "message": f"Cached content is too small. total_token_count={tokens}, "
+                                             f"min_total_token_count={self.cache_min_tokens}"}}, 400)
+            return
+        ttl = float(str(body.get('ttl', '3600s')).rstrip('s'))
+        with self.server.stats_lock:
+            self.server.stats['caches_created'] += 1
+            name = f"cachedContents/fake{self.server.stats['caches_created']}"
+            self.server.caches[name] = {"text": text, "tokens": tokens, "model": body.get('model', ''),
+                                        "expires": time.time() + ttl}
+        self._send(self._resource(name))
+
+    def do_PATCH(self):
+        name = self.path.split('?', 1)[0].split('/', 2)[-1]    # /v1beta/cachedContents/ID
+        body = self._read_body()
+        if self.server.cached_content(name) is None:
+            self._send({"error": {"code": 404, "status": "NOT_FOUND", "message": "CachedContent not found"}}, 404)
+            return
+        with self.server.stats_lock:
+            self.server.stats['caches_refreshed'] += 1
+            self.server.caches[name]['expires'] = time.time() + float(str(body.get('ttl', '3600s')).rstrip('s'))
+        self._send(self._resource(name))
+
+    def do_POST(self):
+        if self.path.split('?', 1)[0].endswith('/cachedContents'):
+            self._create_cached_content()
+            return
+        rng = self.server.rng
+        with self.server.stats_lock:
+            self.server.stats['requests'] += 1
+            fail = rng.random() < self.error_rate
+            truncate = rng.random() < self.truncate_rate
+            latency = self.latency_dist(rng) if self.latency_dist else self.latency
+            status = rng.choice((429, 500))
+            cut = rng.uniform(0.2, 0.9)
+        prompt, config, cached = self._read_request()
+        if prompt is None:
+            self._send({"error": {"code": 403, "status": "PERMISSION_DENIED",
+                                  "message": "CachedContent not found (or permission denied)"}}, 403)
+            return
+        time.sleep(latency + self.prefill_ms * (len(prompt) // 4 - cached) / 1e6)
+        if fail:
+            with self.server.stats_lock:
+                self.server.stats['errors'] += 1
+            self._send({"error": {"code": status, "message": "fake failure"}}, status,
+                       {'Retry-After': '1'} if status == 429 else None)
+            return
+        text = answer_for(prompt)
+        if config.get('responseSchema'):
+            # Structured output: bare JSON in the requested shape.
+            text = json.dumps(conform(json.loads(text.strip('`').removeprefix('json')), config['responseSchema']),
+                              ensure_ascii=False)
+        if truncate:
+            with self.server.stats_lock:
+                self.server.stats['truncated'] += 1
+            text = text[:int(len(text) * cut)]
+        # Roughly 4 characters per token, like the real tokenizer on English.
+        usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4}
+        usage["totalTokenCount"] = usage["promptTokenCount"] + usage["candidatesTokenCount"]
+        if cached:
+            usage["cachedContentTokenCount"] = cached
+        if ':streamGenerateContent' in self.path:
+            self._stream(text, usage)
+        else:
+            self._send({
+                "candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                                "finishReason": "MAX_TOKENS" if truncate else "STOP"}],
+                "usageMetadata": usage,
+            })
+
+    def _send(self, payload: dict, status: int = 200, headers: 'dict | None' = None) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, text: str, usage: dict) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        step = max(1, -(-len(text) // self.stream_chunks))
+        for i in range(0, len(text), step):
+            event = {"candidates": [{"content": {"parts": [{"text": text[i:i + step]}], "role": "model"}}],
+                     "usageMetadata": usage}
+            data = f"data: {json.dumps(event)}\r\n\r\n".encode('utf-8')
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+            time.sleep(self.stream_interval)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024   # async clients open hundreds of connections at once
+
+    def __init__(self, addr, handler=FakeGemini):
+        super().__init__(addr, handler)
+        self.stats = {'connections': 0, 'requests': 0, 'errors': 0, 'truncated': 0,
+                      'caches_created': 0, 'caches_refreshed': 0}
+        self.stats_lock = threading.Lock()
+        self.rng = random.Random()
+        self.caches: dict = {}      # cachedContents name -> {text, tokens, model, expires}
+
+    def cached_content(self, name: str) -> 'dict | None':
+        with self.stats_lock:
+            entry = self.caches.get(name)
+            if entry is not None and entry['expires'] <= time.time():
+                del self.caches[name]
+                entry = None
+            return entry
+
+    def handle_error(self, request, client_address):
+        # Clients dropping pooled or hedged connections is normal here.
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def model_url(self) -> str:
+        scheme = 'https' if isinstance(self.socket, ssl.SSLSocket) else 'http'
+        return f"{scheme}://127.0.0.1:{self.server_address[1]}/v1beta/models/fake:generateContent"
+
+
+def latency_dist(spec: str):
+    """"fixed:S" | "uniform:LO,HI" | "lognormal:MEDIAN,SIGMA" -> callable(rng)."""
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v]
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(*values)
+    if kind == 'lognormal' and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"bad latency distribution {spec!r}")
+
+
+def serve(port: int = 0, *, latency: float = 0.0, certfile: str = '', keyfile: str = '', dist: str = '',
+          error_rate: float = 0.0, truncate_rate: float = 0.0, stream_chunks: int = 8,
+          stream_interval: float = 0.0, seed: 'int | None' = None, prefill_ms: float = 0.0,
+          cache_min_tokens: int = 0) -> FakeGeminiServer:
+    """Start a fake on a background thread (port=0 picks a free port)."""
+    handler = type('ConfiguredFakeGemini', (FakeGemini,), {
+        'latency': latency,
+        'latency_dist': staticmethod(latency_dist(dist)) if dist else None,
+        'error_rate': error_rate,
+        'truncate_rate': truncate_rate,
+        'stream_chunks': stream_chunks,
+        'stream_interval': stream_interval,
+        'prefill_ms': prefill_ms,
+        'cache_min_tokens': cache_min_tokens,
+    })
+    server = FakeGeminiServer(('127.0.0.1', port), handler)
+    server.rng.seed(seed)
+    if certfile:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(certfile, keyfile or None)
+        server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--latency', type=float, default=0.0, help='seconds before each answer')
+    ap.add_argument('--latency-dist', default='', help='fixed:S | uniform:LO,HI | lognormal:MEDIAN,SIGMA')
+    ap.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered 429/500')
+    ap.add_argument('--truncate-rate', type=float, default=0.0, help='share of answers cut off')
+    ap.add_argument('--stream-chunks', type=int, default=8)
+    ap.add_argument('--stream-interval', type=float, default=0.0, help='seconds between SSE events')
+    ap.add_argument('--prefill-ms', type=float, default=0.0, help='ms per 1000 uncached prompt tokens')
+    ap.add_argument('--cache-min-tokens', type=int, default=0, help='smallest cachedContents accepted')
+    ap.add_argument('--certfile', default='')
+    ap.add_argument('--keyfile', default='')
+    args = ap.parse_args()
+    srv = serve(args.port, latency=args.latency, certfile=args.certfile, keyfile=args.keyfile,
+                dist=args.latency_dist, error_rate=args.error_rate, truncate_rate=args.truncate_rate,
+                stream_chunks=args.stream_chunks, stream_interval=args.stream_interval,
+                prefill_ms=args.prefill_ms, cache_min_tokens=args.cache_min_tokens)
+    print(f"fake Gemini at {srv.model_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,111 @@
+"""Tiny in-memory Redis stand-in for local dev and benchmarks.
+
+Speaks enough RESP for the shared cache and counters in api/:
+PING, SELECT, GET, SET [EX n|PX n] [NX], DEL, INCR, INCRBY, EXPIRE, PTTL.
+Not durable, not fast, single process -- point RECOMMEND_CACHE_URL at it
+instead of a real Redis when you just want to exercise the shared tier.
+
+    python tools/resp_standin.py --port 6380
+    RECOMMEND_CACHE_URL=redis://127.0.0.1:6380 vercel dev
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+_data: dict = {}
+_expiry: dict = {}
+_lock = threading.Lock()
+
+
+def _alive(key) -> bool:
+    exp = _expiry.get(key)
+    if exp is not None and exp <= time.monotonic():
+        _data.pop(key, None)
+        _expiry.pop(key, None)
+    return key in _data
+
+
+def _bulk(val) -> bytes:
+    if val is None:
+        return b"$-1\r\n"
+    b = val if isinstance(val, bytes) else str(val).encode()
+    return b"$%d\r\n%s\r\n" % (len(b), b)
+
+
+def execute(args: list) -> bytes:
+    cmd = args[0].upper()
+    with _lock:
+        if cmd == b'PING':
+            return b"+PONG\r\n"
+        if cmd == b'SELECT':
+            return b"+OK\r\n"
+        if cmd == b'GET':
+            return _bulk(_data[args[1]] if _alive(args[1]) else None)
+        if cmd == b'SET':
+            key, val, opts = args[1], args[2], [a.upper() for a in args[3:]]
+            if b'NX' in opts and _alive(key):
+                return b"$-1\r\n"
+            _data[key] = val
+            _expiry.pop(key, None)
+            for flag, scale in ((b'EX', 1.0), (b'PX', 0.001)):
+                if flag in opts:
+                    _expiry[key] = time.monotonic() + int(args[3 + opts.index(flag) + 1]) * scale
+            return b"+OK\r\n"
+        if cmd == b'DEL':
+            n = sum(1 for k in args[1:] if _alive(k) and _data.pop(k, None) is not None)
+            return b":%d\r\n" % n
+        if cmd in (b'INCR', b'INCRBY'):
+            key = args[1]
+            by = int(args[2]) if cmd == b'INCRBY' else 1
+            val = int(_data[key]) + by if _alive(key) else by
+            _data[key] = str(val).encode()
+            return b":%d\r\n" % val
+        if cmd == b'EXPIRE':
+            if not _alive(args[1]):
+                return b":0\r\n"
+            _expiry[args[1]] = time.monotonic() + int(args[2])
+            return b":1\r\n"
+        if cmd == b'PTTL':
+            if not _alive(args[1]):
+                return b":-2\r\n"
+            exp = _expiry.get(args[1])
+            return b":%d\r\n" % (-1 if exp is None else int((exp - time.monotonic()) * 1000))
+    return b"-ERR unknown command '%s'\r\n" % cmd
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.startswith(b'*'):
+                self.wfile.write(b"-ERR inline commands not supported\r\n")
+                continue
+            args = []
+            for _ in range(int(line[1:])):
+                n = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(n + 2)[:-2])
+            self.wfile.write(execute(args))
+
+
+class RESPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(host: str = '127.0.0.1', port: int = 6380) -> RESPServer:
+    """Start a stand-in on a background thread (port=0 picks a free port)."""
+    server = RESPServer((host, port), RESPHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=6380)
+    args = ap.parse_args()
+    print(f"RESP stand-in on {args.host}:{args.port}")
+    RESPServer((args.host, args.port), RESPHandler).serve_forever()